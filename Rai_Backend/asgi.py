@@ -9,10 +9,15 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from authentication.middleware import JWTAuthMiddleware
 from ai import routing as ai_routing
 from community import routing as community_routing
+from Rai_Backend import routing as stream_routing
 
 django_asgi_app = get_asgi_application()
 
-websocket_urlpatterns = ai_routing.websocket_urlpatterns + community_routing.websocket_urlpatterns
+websocket_urlpatterns = (
+    ai_routing.websocket_urlpatterns
+    + community_routing.websocket_urlpatterns
+    + stream_routing.websocket_urlpatterns
+)
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -0,0 +1,308 @@
+import hashlib
+import itertools
+import string
+import threading
+import time
+from contextlib import contextmanager
+import structlog
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact, In
+from django.db.models.signals import post_delete, post_save
+from django.db.models.sql.where import AND
+from django.dispatch import Signal
+
+logger = structlog.get_logger(__name__)
+
+_local = threading.local()
+_registry = {}
+
+# Sent by CacheInvalidatingQuerySet.update() with the primary keys of the updated rows and the names of
+# the assigned fields, for receivers that need to react to updates that skip post_save.
+rows_updated = Signal()
+
+
+def generation_key(namespace):
+    return f"gen:{namespace}"
+
+
+def _initial_generation():
+    # Redis runs allkeys-lru, so a counter can be evicted. Restarting it from the clock instead of 1
+    # keeps it ahead of every generation that was handed out before the eviction.
+    return int(time.time() * 1000)
+
+
+def get_generation(namespace):
+    key = generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        generation = _initial_generation()
+        if not cache.add(key, generation, None):
+            generation = cache.get(key) or generation
+    return generation
+
+
+def bump(*namespaces):
+    """Move each namespace to a new generation; everything cached under the old one is never read again."""
+    for namespace in namespaces:
+        key = generation_key(namespace)
+        try:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, _initial_generation(), None)
+        except Exception as e:
+            logger.error("cache_generation_bump_failed", namespace=namespace, error=str(e))
+
+
+def invalidate(*namespaces):
+    """Bump namespaces once the current transaction commits, or at the end of a deferred_invalidation block."""
+    if not namespaces:
+        return
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending.update(namespaces)
+        return
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+@contextmanager
+def deferred_invalidation():
+    """Collect invalidations from a batch of writes and bump each namespace once at the end."""
+    if getattr(_local, "pending", None) is not None:
+        yield
+        return
+    _local.pending = set()
+    try:
+        yield
+    finally:
+        pending, _local.pending = _local.pending, None
+        if pending:
+            transaction.on_commit(lambda: bump(*pending))
+
+
+def _template_fields(template):
+    return [name for _, name, _, _ in string.Formatter().parse(template) if name]
+
+
+def _expand(template, values):
+    """Format `template` with every combination of the candidate values for its fields."""
+    fields = _template_fields(template)
+    return {
+        template.format(**dict(zip(fields, combo)))
+        for combo in itertools.product(*(values[f] for f in fields))
+    }
+
+
+def _relevant(entry, instance, changed):
+    """
+    Whether a write concerns a registration: always when its `when` predicate accepts the instance,
+    otherwise when the known changed fields meet its `fields`. With neither, every write does.
+    """
+    if entry["when"] is not None and entry["when"](instance):
+        return True
+    if changed is not None and entry["fields"] is not None:
+        return bool(entry["fields"] & set(changed))
+    return entry["when"] is None
+
+
+def namespaces_for(instance, changed=None):
+    return {
+        t.format(**{f: getattr(instance, f) for f in _template_fields(t)})
+        for entry in _registry.get(type(instance), ())
+        if _relevant(entry, instance, changed)
+        for t in entry["templates"]
+    }
+
+
+def _on_save(sender, instance, created, update_fields=None, **kwargs):
+    invalidate(*namespaces_for(instance, None if created else update_fields))
+
+
+def _on_delete(sender, instance, **kwargs):
+    invalidate(*namespaces_for(instance))
+
+
+def register(model, *templates, fields=None, when=None):
+    """
+    Map a model onto cache namespaces. Templates are formatted with the instance's attributes,
+    e.g. 'user_conversations_{user_id}'. When `fields` is given, saves and updates that touch none
+    of them leave the namespaces alone. `when` marks instances whose every write matters, and limits
+    writes with unknown changed fields (creates, full saves, deletes) to those. A model can be
+    registered more than once.
+    """
+    _registry.setdefault(model, []).append({
+        "templates": templates,
+        "fields": frozenset(fields) if fields else None,
+        "when": when,
+    })
+    uid = model._meta.label_lower
+    post_save.connect(_on_save, sender=model, weak=False, dispatch_uid=f"cache_namespaces_save_{uid}")
+    post_delete.connect(_on_delete, sender=model, weak=False, dispatch_uid=f"cache_namespaces_delete_{uid}")
+
+
+def _plain(value):
+    return not hasattr(value, "resolve_expression")
+
+
+class CacheInvalidatingQuerySet(models.QuerySet):
+    """
+    Extends namespace invalidation to update(), bulk_create() and bulk_update(), which skip save().
+    delete() already sends post_delete per row; it is batched so each namespace is bumped once. When
+    rows_updated has receivers for the model, update() also reports which rows it changed.
+    """
+
+    def _filter_values(self):
+        """Values pinned by top-level equality and IN filters on this model, by attname."""
+        where = self.query.where
+        values = {}
+        if where.connector != AND or where.negated:
+            return values
+        for child in where.children:
+            if not isinstance(child, (Exact, In)) or not isinstance(child.lhs, Col):
+                continue
+            if child.lhs.alias != self.query.base_table or child.lhs.target.model is not self.model:
+                continue
+            rhs = child.rhs
+            if isinstance(child, In):
+                if not isinstance(rhs, (list, tuple, set, frozenset)) or not all(_plain(v) for v in rhs):
+                    continue
+                rhs = set(rhs)
+            elif _plain(rhs):
+                rhs = {rhs}
+            else:
+                continue
+            attname = child.lhs.target.attname
+            values[attname] = values[attname] & rhs if attname in values else rhs
+        return values
+
+    def _affected_namespaces(self, changed):
+        """
+        Namespaces an update() touches, under both the old and any newly assigned values. Templates whose
+        fields are all pinned by the filter are formatted from it; only the rest cost a SELECT.
+        """
+        entries = [e for e in _registry.get(self.model, ()) if e["fields"] is None or e["fields"] & set(changed)]
+        templates = {t for e in entries for t in e["templates"]}
+        if not templates:
+            return set()
+
+        known = self._filter_values()
+        assigned = {}
+        for name, value in changed.items():
+            if _plain(value):
+                field = self.model._meta.get_field(name)
+                assigned[field.attname] = {getattr(value, "pk", value)}
+
+        namespaces, unresolved = set(), []
+        for template in templates:
+            fields = _template_fields(template)
+            if not all(f in known for f in fields):
+                unresolved.append(template)
+                continue
+            namespaces |= _expand(template, {f: known[f] | assigned.get(f, set()) for f in fields})
+
+        if unresolved:
+            needed = sorted({f for t in unresolved for f in _template_fields(t)})
+            for row in self.order_by().values(*needed).distinct():
+                values = {f: {v} | assigned.get(f, set()) for f, v in row.items()}
+                namespaces |= {ns for t in unresolved for ns in _expand(t, values)}
+        return namespaces
+
+    def update(self, **kwargs):
+        namespaces = self._affected_namespaces(kwargs)
+        if not rows_updated.has_listeners(self.model):
+            rows = super().update(**kwargs)
+            if rows:
+                invalidate(*namespaces)
+            return rows
+
+        with transaction.atomic(using=self.db):
+            pks = list(self.order_by().select_for_update().values_list("pk", flat=True))
+            rows = super().update(**kwargs)
+        if rows:
+            invalidate(*namespaces)
+            rows_updated.send(sender=self.model, pks=pks, fields=list(kwargs))
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        # Any row may be new; with update_conflicts, any row may instead have had update_fields rewritten.
+        changed = kwargs.get("update_fields") if kwargs.get("update_conflicts") else None
+        namespaces = set()
+        for obj in objs:
+            namespaces |= namespaces_for(obj)
+            if changed:
+                namespaces |= namespaces_for(obj, changed)
+        invalidate(*namespaces)
+        return objs
+
+    def delete(self):
+        with deferred_invalidation():
+            return super().delete()
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        invalidate(*{ns for obj in objs for ns in namespaces_for(obj, fields)})
+        return rows
+
+
+def page_key(namespace, generation, part):
+    digest = hashlib.md5(part.encode()).hexdigest()
+    return f"{namespace}:{generation}:{digest}"
+
+
+def read_through(namespace, part, loader, timeout=None):
+    """
+    Return the cached value for `part` in `namespace`, calling `loader` on a miss.
+    Only one caller rebuilds a missing page; the others wait briefly for it instead of all hitting
+    the database at once. Falls back to `loader` when the cache is unavailable, and still returns
+    the loaded value when storing it fails.
+    """
+    timeout = settings.CACHE_PAGE_TIMEOUT if timeout is None else timeout
+    try:
+        key = page_key(namespace, get_generation(namespace), part)
+        value = cache.get(key)
+    except Exception as e:
+        logger.warning("read_through_cache_unavailable", namespace=namespace, error=str(e))
+        return loader()
+
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    try:
+        locked = cache.add(lock_key, "1", settings.CACHE_REBUILD_LOCK_TIMEOUT)
+    except Exception as e:
+        logger.warning("read_through_lock_unavailable", namespace=namespace, error=str(e))
+        return loader()
+
+    if locked:
+        try:
+            value = loader()
+            try:
+                cache.set(key, value, timeout)
+            except Exception as e:
+                logger.warning("read_through_store_failed", namespace=namespace, error=str(e))
+        finally:
+            try:
+                cache.delete(lock_key)
+            except Exception as e:
+                logger.warning("read_through_unlock_failed", namespace=namespace, error=str(e))
+        return value
+
+    deadline = time.monotonic() + settings.CACHE_REBUILD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        try:
+            value = cache.get(key)
+        except Exception as e:
+            logger.warning("read_through_cache_unavailable", namespace=namespace, error=str(e))
+            break
+        if value is not None:
+            return value
+    else:
+        logger.info("read_through_wait_expired", namespace=namespace)
+    return loader()
\ No newline at end of file
@@ -0,0 +1,302 @@
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import structlog
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+
+logger = structlog.get_logger(__name__)
+
+
+class LocalTier:
+    """Bounded in-process LRU with a per-entry expiry. Thread-safe."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+IMMUTABLE_TYPES = (str, bytes, int, float, bool)
+
+
+class ProcessTier:
+    """
+    The local LRU, its invalidation listener and counters for one process. Django builds a cache handle
+    per thread and per async context, so all of them share this state instead of each starting a
+    listener and keeping an LRU nobody else reads.
+    """
+
+    def __init__(self, channel, max_entries, timeout):
+        self.pid = os.getpid()
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.local = LocalTier(max_entries, timeout)
+        self.subscribed = threading.Event()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "local_hits": 0,
+            "local_misses": 0,
+            "redis_hits": 0,
+            "redis_misses": 0,
+            "invalidations_sent": 0,
+            "invalidations_received": 0,
+        }
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def ensure_listener(self, client):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, args=(client,), name="cache-invalidation", daemon=True)
+            self._listener.start()
+
+    def _listen(self, client):
+        backoff = 1
+        while True:
+            pubsub = None
+            try:
+                pubsub = client.get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.local.clear()
+                self.subscribed.set()
+                backoff = 1
+                for message in pubsub.listen():
+                    self.handle_invalidation(message)
+            except Exception as e:
+                logger.warning("cache_invalidation_listener_error", error=str(e), retry_in=backoff)
+            finally:
+                self.subscribed.clear()
+                self.local.clear()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def handle_invalidation(self, message):
+        if message.get("type") != "message":
+            return
+        try:
+            payload = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        if payload.get("o") == self.origin:
+            return
+        if payload.get("all"):
+            self.local.clear()
+        else:
+            self.local.discard(payload.get("k", []))
+        self.count("invalidations_received")
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+def process_tier(channel, max_entries, timeout):
+    """The calling process's tier for `channel`. Tiers inherited across a fork are dropped: their listener thread did not survive it."""
+    pid = os.getpid()
+    tier = _tiers.get((pid, channel))
+    if tier is not None:
+        return tier
+    with _tiers_lock:
+        for key in [k for k in _tiers if k[0] != pid]:
+            del _tiers[key]
+        return _tiers.setdefault((pid, channel), ProcessTier(channel, max_entries, timeout))
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    django_redis backend with a per-process LRU in front of Redis for keys matching LOCAL_PREFIXES.
+
+    Writes go to Redis first, then drop the local copy and publish the key on a pub/sub channel so
+    the other processes drop theirs. The local tier is only served while this process is subscribed;
+    if the subscription drops, the local tier is cleared and reads go straight to Redis until it is back.
+    Entries also expire after LOCAL_TIMEOUT seconds, which bounds staleness if a message is missed.
+    Mutable values are kept pickled and decoded on every hit, so callers never share an object.
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get("OPTIONS", {}))
+        self._local_prefixes = tuple(options.pop("LOCAL_PREFIXES", ()))
+        self._local_max_entries = int(options.pop("LOCAL_MAX_ENTRIES", 2048))
+        self._local_timeout = float(options.pop("LOCAL_TIMEOUT", 1.0))
+        self._channel = options.pop("INVALIDATION_CHANNEL", None) or f"{params.get('KEY_PREFIX', '')}:cache_invalidation"
+        params["OPTIONS"] = options
+        super().__init__(server, params)
+
+    @property
+    def _tier(self):
+        return process_tier(self._channel, self._local_max_entries, self._local_timeout)
+
+    def _is_local(self, key):
+        return bool(self._local_prefixes) and key.startswith(self._local_prefixes)
+
+    def _full_key(self, key, version=None):
+        return str(self.client.make_key(key, version=version))
+
+    def _publish(self, tier, payload):
+        self.client.get_client(write=True).publish(self._channel, json.dumps({"o": tier.origin, **payload}))
+
+    def _invalidate(self, full_keys):
+        if not full_keys:
+            return
+        tier = self._tier
+        tier.local.discard(full_keys)
+        try:
+            self._publish(tier, {"k": full_keys})
+            tier.count("invalidations_sent")
+        except Exception as e:
+            logger.error("cache_invalidation_publish_failed", error=str(e), keys=len(full_keys))
+
+    def _local_keys(self, keys, version=None):
+        return [self._full_key(k, version) for k in keys if self._is_local(k)]
+
+    def get(self, key, default=None, version=None, client=None):
+        if client is not None or not self._is_local(key):
+            return super().get(key, default=default, version=version, client=client)
+
+        tier = self._tier
+        tier.ensure_listener(self.client)
+        full_key = self._full_key(key, version)
+        if tier.subscribed.is_set():
+            entry = tier.local.get(full_key)
+            if entry is not None:
+                tier.count("local_hits")
+                pickled, value = entry
+                return pickle.loads(value) if pickled else value
+            tier.count("local_misses")
+
+        value = super().get(key, default=None, version=version)
+        if value is None:
+            tier.count("redis_misses")
+            return default
+        tier.count("redis_hits")
+        if tier.subscribed.is_set():
+            if type(value) in IMMUTABLE_TYPES:
+                tier.local.set(full_key, (False, value))
+            else:
+                tier.local.set(full_key, (True, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, xx=False):
+        result = super().set(key, value, timeout=timeout, version=version, client=client, nx=nx, xx=xx)
+        self._invalidate(self._local_keys([key], version))
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().add(key, value, timeout=timeout, version=version, client=client)
+        if result:
+            self._invalidate(self._local_keys([key], version))
+        return result
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        result = super().delete(key, version=version, prefix=prefix, client=client)
+        self._invalidate(self._local_keys([key], version))
+        return result
+
+    def delete_many(self, keys, version=None, client=None):
+        keys = list(keys)
+        result = super().delete_many(keys, version=version, client=client)
+        self._invalidate(self._local_keys(keys, version))
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().set_many(data, timeout=timeout, version=version, client=client)
+        self._invalidate(self._local_keys(data, version))
+        return result
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        result = super().incr(key, delta=delta, version=version, client=client, ignore_key_check=ignore_key_check)
+        self._invalidate(self._local_keys([key], version))
+        return result
+
+    def decr(self, key, delta=1, version=None, client=None):
+        result = super().decr(key, delta=delta, version=version, client=client)
+        self._invalidate(self._local_keys([key], version))
+        return result
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().touch(key, timeout=timeout, version=version, client=client)
+        self._invalidate(self._local_keys([key], version))
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super().delete_pattern(*args, **kwargs)
+        self._invalidate_all()
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._invalidate_all()
+        return result
+
+    def _invalidate_all(self):
+        tier = self._tier
+        tier.local.clear()
+        if not self._local_prefixes:
+            return
+        try:
+            self._publish(tier, {"all": 1})
+        except Exception as e:
+            logger.error("cache_invalidation_publish_failed", error=str(e), keys="all")
+
+    def tier_stats(self):
+        tier = self._tier
+        return {
+            **tier.snapshot(),
+            "pid": tier.pid,
+            "local_entries": len(tier.local),
+            "subscribed": tier.subscribed.is_set(),
+        }
\ No newline at end of file
@@ -0,0 +1,363 @@
+import asyncio
+import json
+import uuid
+import structlog
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.http import Http404
+from ai import engine
+from ai.consumers import MAX_MESSAGE_LENGTH as CHAT_MAX_MESSAGE_LENGTH
+from ai.services import AIService
+from ai.tasks import generate_ai_response, release_turn_lock
+from community.buffer import get_message_buffer
+from community.consumers import MAX_MESSAGE_LENGTH, TypingThrottle, broadcast_presence, broadcast_typing
+from community.services import CommunityService
+from community.signals import member_group_name
+from . import replay
+from .presence import GLOBAL_SCOPE, PresenceTracker, community_scope
+
+logger = structlog.get_logger(__name__)
+
+CHANNEL_KINDS = ("chat", "community")
+
+
+def parse_channel(name):
+    """'chat:<conversation id>' or 'community:<community id>' -> (kind, id). Raises ValueError."""
+    kind, _, raw = str(name).partition(":")
+    if kind not in CHANNEL_KINDS:
+        raise ValueError("Unknown channel")
+    return kind, str(uuid.UUID(raw))
+
+
+def wrap(channel, frame):
+    """Envelope a pre-encoded frame without decoding it again."""
+    return '{"channel":%s,"event":%s}' % (json.dumps(channel), frame)
+
+
+class Subscription:
+    """
+    One channel on a multiplexed socket. Outbound frames go through a bounded queue drained by the
+    subscription's own task, so a busy channel cannot stall the others or the channel-layer inbox.
+    """
+
+    def __init__(self, consumer, name, kind, object_id, groups, membership=None):
+        self.consumer = consumer
+        self.name = name
+        self.kind = kind
+        self.object_id = object_id
+        self.groups = groups
+        self.membership = membership
+        self.typing = TypingThrottle()
+        self.held = []
+        self.queue = asyncio.Queue(maxsize=settings.STREAM_CHANNEL_QUEUE_SIZE)
+        self.task = asyncio.get_running_loop().create_task(self._drain())
+
+    def release(self, frames):
+        """Queue the subscribe reply and any replay, then the live events that arrived meanwhile."""
+        held, self.held = self.held, None
+        for frame in frames + held:
+            self.put(frame)
+
+    def put(self, frame):
+        if self.held is not None:
+            self.held.append(frame)
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # The client is not keeping up with this channel: drop its backlog and ask it to refetch.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(wrap(self.name, json.dumps({"type": "resync_required"})))
+            logger.warning("stream_channel_overflow", channel=self.name, user_id=self.consumer.user.id)
+
+    async def _drain(self):
+        while True:
+            frame = await self.queue.get()
+            if frame is None:
+                return
+            await self.consumer.send(text_data=frame)
+
+    def close(self, last_frame=None):
+        """Stop at once, or with `last_frame` deliver what is queued, then that frame, then stop."""
+        if last_frame is None:
+            self.task.cancel()
+            return
+        self.held = None
+        if self.queue.maxsize and self.queue.qsize() > self.queue.maxsize - 2:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(wrap(self.name, json.dumps({"type": "resync_required"})))
+        self.queue.put_nowait(last_frame)
+        self.queue.put_nowait(None)
+
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    """
+    One authenticated socket for any number of conversations and communities.
+
+    Control frames: {"action": "subscribe" | "unsubscribe", "channel": "chat:<id>" | "community:<id>"}.
+    Both kinds accept a "message" action: a user turn for the AI on chat channels ("message", optional
+    "image_id"), a post on community channels. Community channels also accept "typing". Every event is delivered as
+    {"channel": ..., "event": <the frame the per-channel socket would send>}. History is not pushed on
+    subscribe; clients page it from the REST endpoints, or pass "last_seq" to replay what they missed.
+    Sequenced events may arrive slightly out of seq order when several senders race; see replay.append.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+
+        if self.user.is_anonymous:
+            logger.warning("stream_ws_rejected_anonymous")
+            await self.close(code=4001)
+            return
+
+        self.subscriptions = {}
+        await self.accept()
+        self.presence = PresenceTracker(self.user.id, self.channel_name, [GLOBAL_SCOPE])
+        await self.presence.start()
+        await self.send_json({"type": "ready", "max_subscriptions": settings.STREAM_MAX_SUBSCRIPTIONS})
+        logger.info("stream_ws_connected", user_id=self.user.id)
+
+    async def disconnect(self, close_code):
+        for name in list(getattr(self, "subscriptions", {})):
+            await self.unsubscribe(name, reply=False)
+        if hasattr(self, "presence"):
+            await self.presence.stop()
+        await get_message_buffer().flush()
+        logger.info("stream_ws_disconnected", user_id=getattr(self.user, "id", None), code=close_code)
+
+    async def send_json(self, content):
+        await self.send(text_data=json.dumps(content))
+
+    async def send_error(self, code, message, channel=None):
+        await self.send_json({"type": "error", "code": code, "channel": channel, "message": message})
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError as e:
+            logger.warning("stream_ws_invalid_json", error=str(e))
+            await self.send_error("invalid_json", "Invalid JSON payload.")
+            return
+
+        action = data.get("action")
+        name = data.get("channel")
+        try:
+            if action == "subscribe":
+                await self.subscribe(name, data.get("last_seq"))
+            elif action == "unsubscribe":
+                await self.unsubscribe(name)
+            elif action == "message":
+                await self.post_message(name, data)
+            elif action == "typing":
+                await self.post_typing(name, bool(data.get("is_typing", True)))
+            else:
+                await self.send_error("unknown_action", "Unknown action.")
+        except Exception as e:
+            logger.error("stream_ws_receive_error", error=str(e), action=action, exc_info=True)
+            await self.send_error("server_error", "A server error occurred.", name)
+
+    async def subscribe(self, name, last_seq=None):
+        try:
+            kind, object_id = parse_channel(name)
+        except ValueError:
+            await self.send_error("invalid_channel", "Invalid channel.", name)
+            return
+        name = f"{kind}:{object_id}"
+
+        if name in self.subscriptions:
+            await self.send_json({"type": "subscribed", "channel": name})
+            return
+        if len(self.subscriptions) >= settings.STREAM_MAX_SUBSCRIPTIONS:
+            await self.send_error("too_many_subscriptions", "Subscription limit reached.", name)
+            return
+
+        membership = None
+        if kind == "chat":
+            if not await self.can_access_conversation(object_id):
+                await self.send_error("not_found", "Conversation not found.", name)
+                return
+            groups = [f"chat_{object_id}"]
+        else:
+            membership = await self.get_membership_state(object_id)
+            if not membership:
+                await self.send_error("forbidden", "Not a member.", name)
+                return
+            groups = [f"community_{object_id}", member_group_name(object_id, self.user.id)]
+
+        subscription = Subscription(self, name, kind, object_id, groups, membership)
+        self.subscriptions[name] = subscription
+        for group in groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+
+        last_seq = last_seq if isinstance(last_seq, int) else None
+        seq, frames = await sync_to_async(replay.resume, thread_sensitive=False)(name, last_seq)
+        reply = json.dumps({
+            "type": "subscribed",
+            "channel": name,
+            "membership": membership,
+            "seq": seq,
+            "resumed": frames is not None,
+        })
+        subscription.release([reply] + [wrap(name, frame) for frame in frames or []])
+
+        if kind == "community" and await self.presence.add(community_scope(object_id)):
+            await broadcast_presence(self.channel_layer, object_id, self.user.id, "online")
+
+    async def unsubscribe(self, name, reply=True, last_frame=None):
+        try:
+            kind, object_id = parse_channel(name)
+        except ValueError:
+            await self.send_error("invalid_channel", "Invalid channel.", name)
+            return
+        name = f"{kind}:{object_id}"
+
+        subscription = self.subscriptions.pop(name, None)
+        if subscription is not None:
+            subscription.close(wrap(name, last_frame) if last_frame else None)
+            for group in subscription.groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+            if kind == "community" and await self.presence.discard(community_scope(object_id)):
+                await broadcast_presence(self.channel_layer, object_id, self.user.id, "offline")
+        if reply:
+            await self.send_json({"type": "unsubscribed", "channel": name})
+
+    def community_subscription(self, name):
+        subscription = self.subscriptions.get(name)
+        if subscription is None or subscription.kind != "community":
+            return None
+        return subscription
+
+    async def post_message(self, name, data):
+        subscription = self.subscriptions.get(name)
+        if subscription is not None and subscription.kind == "chat":
+            await self.post_turn(subscription, data)
+            return
+
+        subscription = self.community_subscription(name)
+        if subscription is None:
+            await self.send_error("not_subscribed", "Subscribe to the channel first.", name)
+            return
+
+        text = (data.get("message") or "").strip()
+        if not text:
+            return
+        if len(text) > MAX_MESSAGE_LENGTH:
+            await self.send_error(
+                "message_too_long", f"Message too long. Maximum {MAX_MESSAGE_LENGTH} characters allowed.", name
+            )
+            return
+        if subscription.membership["is_muted"]:
+            await self.send_error("muted", "You are muted in this community.", name)
+            return
+
+        msg, frame = await database_sync_to_async(CommunityService.prepare_message)(
+            subscription.object_id, self.user.id, text, data.get("client_id"), getattr(settings, "SERVER_BASE_URL", "")
+        )
+        get_message_buffer().add(msg)
+        await self.channel_layer.group_send(f"community_{subscription.object_id}", {
+            "type": "chat_message",
+            "community_id": subscription.object_id,
+            "frame": frame,
+        })
+
+    async def post_turn(self, subscription, data):
+        """Save a user turn on a chat channel and dispatch the AI reply, as ChatConsumer does."""
+        name, conversation_id = subscription.name, subscription.object_id
+        text = (data.get("message") or "").strip()
+        image_id = data.get("image_id")
+        if not text and not image_id:
+            return
+        if len(text) > CHAT_MAX_MESSAGE_LENGTH:
+            await self.send_error(
+                "message_too_long", f"Message too long. Maximum {CHAT_MAX_MESSAGE_LENGTH} characters allowed.", name
+            )
+            return
+
+        try:
+            msg, is_new_chat, error = await database_sync_to_async(AIService.submit_user_turn)(
+                self.user, conversation_id, text, image_id
+            )
+        except Exception as e:
+            logger.error("stream_ws_save_message_failed", error=str(e), channel=name, exc_info=True)
+            await self.send_error("save_failed", "Failed to save your message. Please try again.", name)
+            return
+        if error == "ai_busy":
+            await self.send_error("ai_busy", "AI is still thinking. Please wait.", name)
+            return
+        if error == "not_found":
+            await self.send_error("not_found", "Conversation not found.", name)
+            return
+
+        self.emit(name, json.dumps({
+            "type": "new_message",
+            "conversation_id": conversation_id,
+            "message": AIService.user_message_payload(msg, image_id),
+        }))
+
+        try:
+            dispatch = engine.submit if settings.AI_GENERATION_MODE == "async" else generate_ai_response.delay
+            dispatch(conversation_id, text, self.user.id, is_new_chat, image_id)
+        except Exception as e:
+            logger.error("stream_ws_dispatch_failed", error=str(e), channel=name, exc_info=True)
+            await database_sync_to_async(release_turn_lock)(conversation_id, self.user.id)
+            await self.send_error(
+                "ai_unavailable",
+                "AI service is temporarily unavailable. Your message was saved — please try again in a moment.",
+                name,
+            )
+
+    async def post_typing(self, name, is_typing):
+        subscription = self.community_subscription(name)
+        if subscription is not None and subscription.typing.allow(is_typing):
+            await broadcast_typing(self.channel_layer, subscription.object_id, self.user, is_typing, self.channel_name)
+
+    def emit(self, name, frame):
+        subscription = self.subscriptions.get(name)
+        if subscription is not None:
+            subscription.put(wrap(name, frame))
+
+    async def chat_message(self, event):
+        self.emit(f"community:{event['community_id']}", event["frame"])
+
+    async def forward_frame(self, event):
+        if event.get("exclude") != self.channel_name:
+            self.emit(f"community:{event['community_id']}", event["frame"])
+
+    async def membership_update(self, event):
+        name = f"community:{event['community_id']}"
+        subscription = self.subscriptions.get(name)
+        if subscription is None:
+            return
+        subscription.membership = event["membership"]
+        if subscription.membership:
+            self.emit(name, json.dumps({"type": "membership_update", **subscription.membership}))
+            return
+        await self.unsubscribe(name, reply=False, last_frame=json.dumps({"type": "membership_removed"}))
+
+    async def message_update(self, event):
+        self.emit(f"chat:{event['conversation_id']}", event["frame"])
+
+    async def message_delta(self, event):
+        self.emit(f"chat:{event['conversation_id']}", event["frame"])
+
+    async def chat_title_update(self, event):
+        self.emit(f"chat:{event['conversation_id']}", event["frame"])
+
+    async def chat_error(self, event):
+        self.emit(f"chat:{event['conversation_id']}", event["frame"])
+
+    @database_sync_to_async
+    def can_access_conversation(self, conversation_id):
+        try:
+            AIService.check_conversation_access(self.user, conversation_id)
+        except Http404:
+            return False
+        return True
+
+    @database_sync_to_async
+    def get_membership_state(self, community_id):
+        return CommunityService.get_membership_state(community_id, self.user.id)
\ No newline at end of file
@@ -0,0 +1,223 @@
+import base64
+import datetime
+import decimal
+import json
+import uuid
+from collections import OrderedDict
+from django.db.models import Q
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def _to_json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, decimal.Decimal)):
+        return str(value)
+    return value
+
+
+def encode_cursor(position, reverse=False):
+    payload = {"p": [_to_json_value(v) for v in position]}
+    if reverse:
+        payload["r"] = 1
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (position, reverse). Raises ValueError on anything that isn't a cursor we issued."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        return list(payload["p"]), bool(payload.get("r"))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _resolve_field(model, path):
+    field = None
+    for part in path.split("__"):
+        field = model._meta.pk if part == "pk" else model._meta.get_field(part)
+        if field.is_relation:
+            model = field.related_model
+    if field.is_relation:
+        field = field.target_field
+    return field
+
+
+def _position_value(obj, path):
+    value = obj
+    for part in path.split("__"):
+        value = getattr(value, part)
+    return value
+
+
+def flip_ordering(ordering):
+    return [f[1:] if f.startswith("-") else f"-{f}" for f in ordering]
+
+
+def keyset_filter(model, ordering, position):
+    """
+    Q object selecting rows strictly after `position` in `ordering`, i.e. the row-value comparison
+    (a, b, c) > (x, y, z) expanded so each branch can use the composite index.
+    """
+    if len(position) != len(ordering):
+        raise ValueError("Invalid cursor")
+
+    values =[]
+    for field_name, raw in zip(ordering, position):
+        path = field_name.lstrip("-")
+        try:
+            values.append(_resolve_field(model, path).to_python(raw))
+        except (FieldDoesNotExist, ValidationError):
+            raise ValueError("Invalid cursor")
+
+    condition = Q()
+    for i, field_name in enumerate(ordering):
+        path = field_name.lstrip("-")
+        lookup = "lt" if field_name.startswith("-") else "gt"
+        branch = Q(**{f"{ordering[j].lstrip('-')}": values[j] for j in range(i)})
+        branch &= Q(**{f"{path}__{lookup}": values[i]})
+        condition |= branch
+    return condition
+
+
+def cursor_position(obj, ordering):
+    return [_position_value(obj, f.lstrip("-")) for f in ordering]
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (ordering..., pk) without COUNT(*) or OFFSET.
+    The ordering is taken from `ordering` when set, otherwise from the queryset, and a pk
+    tie-breaker is appended so positions are unique. The total is only counted on ?include_count=true.
+    """
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = None
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    count_query_param = "include_count"
+    ordering = None
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_ordering(self, queryset):
+        ordering = list(self.ordering or queryset.query.order_by or queryset.model._meta.ordering or ["-pk"])
+        pk_name = queryset.model._meta.pk.name
+        if not any(f.lstrip("-") in ("pk", pk_name) for f in ordering):
+            ordering.append("-pk" if ordering[0].startswith("-") else "pk")
+        return ordering
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, "").lower() in ("1", "true", "yes")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.count = queryset.count() if self.wants_count(request) else None
+        page_size = self.get_page_size(request)
+        ordering = self.get_ordering(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        position, reverse = None, False
+        if cursor:
+            try:
+                position, reverse = decode_cursor(cursor)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        query_ordering = flip_ordering(ordering) if reverse else ordering
+        queryset = queryset.order_by(*query_ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(keyset_filter(queryset.model, query_ordering, position))
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        has_next = has_more if not reverse else True
+        has_previous = position is not None if not reverse else has_more
+
+        self.next_cursor = encode_cursor(cursor_position(rows[-1], ordering)) if rows and has_next else None
+        self.previous_cursor = (
+            encode_cursor(cursor_position(rows[0], ordering), reverse=True) if rows and has_previous else None
+        )
+        return rows
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("count", self.count),
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("next_cursor", self.next_cursor),
+            ("previous_cursor", self.previous_cursor),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "count": {"type": "integer", "nullable": True},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "next_cursor": {"type": "string", "nullable": True},
+                "previous_cursor": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        parameters = [{
+            "name": self.cursor_query_param,
+            "required": False,
+            "in": "query",
+            "description": "Opaque pagination cursor from the next/previous links.",
+            "schema": {"type": "string"},
+        }, {
+            "name": self.count_query_param,
+            "required": False,
+            "in": "query",
+            "description": "Set to true to include the total count (runs a COUNT query).",
+            "schema": {"type": "boolean"},
+        }]
+        if self.page_size_query_param:
+            parameters.append({
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            })
+        return parameters
\ No newline at end of file
@@ -0,0 +1,151 @@
+import asyncio
+import time
+import structlog
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = structlog.get_logger(__name__)
+
+GLOBAL_SCOPE = "global"
+
+# KEYS: scope users zset, this user's connections zset. ARGV: user id, channel name, now, ttl.
+# Returns 1 when the user was not online in the scope before this call.
+JOIN_SCRIPT = """
+local now = tonumber(ARGV[3])
+local expires = now + tonumber(ARGV[4])
+local previous = redis.call('ZSCORE', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[2], expires, ARGV[2])
+redis.call('EXPIRE', KEYS[2], math.ceil(tonumber(ARGV[4])))
+redis.call('ZADD', KEYS[1], 'GT', expires, ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if previous and tonumber(previous) > now then
+    return 0
+end
+return 1
+"""
+
+# KEYS as above. ARGV: user id, channel name, now. Returns 1 when the user's last connection left.
+LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', tonumber(ARGV[3]))
+if redis.call('ZCARD', KEYS[2]) > 0 then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+
+def _key(scope, user_id=None):
+    prefix = settings.CACHES["default"].get("KEY_PREFIX", "")
+    if user_id is None:
+        return f"{prefix}:presence:{scope}"
+    return f"{prefix}:presence:{scope}:{user_id}"
+
+
+def community_scope(community_id):
+    return f"community_{community_id}"
+
+
+class PresenceService:
+    """
+    Online state in Redis sorted sets, scored by expiry time. Each scope has a set of user ids and
+    each user a set of their live connections, so a second device keeps the user online when the
+    first one disconnects. Sockets that die without disconnecting simply stop heartbeating and expire.
+    """
+
+    _scripts = {}
+
+    @staticmethod
+    def _script(source):
+        script = PresenceService._scripts.get(source)
+        if script is None:
+            script = PresenceService._scripts[source] = get_redis_connection("default").register_script(source)
+        return script
+
+    @staticmethod
+    def join(scope, user_id, channel_name):
+        """Register or refresh a connection. Returns True when the user just came online in the scope."""
+        result = PresenceService._script(JOIN_SCRIPT)(
+            keys=[_key(scope), _key(scope, user_id)],
+            args=[user_id, channel_name, time.time(), settings.PRESENCE_TTL],
+        )
+        return bool(result)
+
+    @staticmethod
+    def leave(scope, user_id, channel_name):
+        """Drop a connection. Returns True when it was the user's last one in the scope."""
+        result = PresenceService._script(LEAVE_SCRIPT)(
+            keys=[_key(scope), _key(scope, user_id)],
+            args=[user_id, channel_name, time.time()],
+        )
+        return bool(result)
+
+    @staticmethod
+    def online_count(scope):
+        return get_redis_connection("default").zcount(_key(scope), time.time(), "+inf")
+
+    @staticmethod
+    def online_user_ids(scope):
+        members = get_redis_connection("default").zrangebyscore(_key(scope), time.time(), "+inf")
+        return [int(m) for m in members]
+
+    @staticmethod
+    def online_status(user_ids, scope=GLOBAL_SCOPE):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        now = time.time()
+        scores = get_redis_connection("default").zmscore(_key(scope), user_ids)
+        return {uid: score is not None and score > now for uid, score in zip(user_ids, scores)}
+
+
+class PresenceTracker:
+    """Keeps one socket registered in a set of scopes, heartbeating from a background task."""
+
+    def __init__(self, user_id, channel_name, scopes):
+        self.user_id = user_id
+        self.channel_name = channel_name
+        self.scopes = list(scopes)
+        self._task = None
+
+    async def _call(self, method, scope):
+        try:
+            return await sync_to_async(method, thread_sensitive=False)(scope, self.user_id, self.channel_name)
+        except Exception as e:
+            logger.warning("presence_update_failed", scope=scope, user_id=self.user_id, error=str(e))
+            return False
+
+    async def start(self):
+        """Join every scope. Returns the scopes the user just came online in."""
+        joined = [scope for scope in self.scopes if await self._call(PresenceService.join, scope)]
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        return joined
+
+    async def add(self, scope):
+        """Join one more scope. Returns True when the user just came online in it."""
+        if scope in self.scopes:
+            return False
+        self.scopes.append(scope)
+        return await self._call(PresenceService.join, scope)
+
+    async def discard(self, scope):
+        """Leave one scope. Returns True when the user went offline in it."""
+        if scope not in self.scopes:
+            return False
+        self.scopes.remove(scope)
+        return await self._call(PresenceService.leave, scope)
+
+    async def stop(self):
+        """Leave every scope. Returns the scopes the user went offline in."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        return [scope for scope in self.scopes if await self._call(PresenceService.leave, scope)]
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            for scope in list(self.scopes):
+                await self._call(PresenceService.join, scope)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import time
+from urllib.parse import parse_qs
+import structlog
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = structlog.get_logger(__name__)
+
+# KEYS: sequence counter, event stream. ARGV: frame (a JSON object), now in ms, stream max length, ttl.
+# Returns {seq, frame with "seq" spliced in}. A missing counter (expired or evicted) restarts above both
+# the clock and the newest buffered entry, so sequence numbers never go backwards for a channel.
+APPEND_SCRIPT = """
+local seq
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    seq = redis.call('INCR', KEYS[1])
+else
+    seq = tonumber(ARGV[2])
+    local top = redis.call('XREVRANGE', KEYS[2], '+', '-', 'COUNT', 1)
+    if top[1] then
+        seq = math.max(seq, tonumber(string.match(top[1][1], '^(%d+)')))
+    end
+    seq = seq + 1
+    redis.call('SET', KEYS[1], string.format('%d', seq))
+end
+local frame = '{"seq":' .. string.format('%d', seq) .. ',' .. string.sub(ARGV[1], 2)
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], string.format('%d', seq) .. '-0', 'f', frame)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return {seq, frame}
+"""
+
+_script = None
+
+
+def _keys(channel):
+    prefix = settings.CACHES["default"].get("KEY_PREFIX", "")
+    return f"{prefix}:seq:{channel}", f"{prefix}:events:{channel}"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def append(channel, frame):
+    """
+    Give `frame` the channel's next sequence number and buffer it for replay. Returns (seq, frame).
+
+    The seq is fixed here, before the caller publishes the frame to the channel's group, and publishing
+    is a separate round trip. Two senders racing on one channel can therefore deliver N+1 ahead of N.
+    Clients order frames by seq: when one skips ahead they hold it briefly for the gap to fill, and
+    resume with last_seq if it does not.
+    """
+    global _script
+    if _script is None:
+        _script = get_redis_connection("default").register_script(APPEND_SCRIPT)
+    seq, frame = _script(
+        keys=list(_keys(channel)),
+        args=[frame, int(time.time() * 1000), settings.REPLAY_MAXLEN, settings.REPLAY_TTL],
+    )
+    return int(seq), _decode(frame)
+
+
+def sequence(channel, frame):
+    """append(), but a Redis failure only costs resumability: the frame goes out without a seq."""
+    try:
+        return append(channel, frame)
+    except Exception as e:
+        logger.warning("replay_append_failed", channel=channel, error=str(e))
+        return None, frame
+
+
+def current_seq(channel):
+    value = get_redis_connection("default").get(_keys(channel)[0])
+    return int(value) if value is not None else 0
+
+
+def resume(channel, last_seq=None):
+    """
+    Returns (current seq, frames after last_seq, oldest first). Frames is None when the client has to
+    reload instead: no last_seq, a gap because the buffer was trimmed or expired, or Redis is down.
+    Callers join the channel's group before calling this, so a live event may also appear in the
+    replay; clients drop frames whose seq they have already seen.
+    """
+    try:
+        current = current_seq(channel)
+        if last_seq is None or last_seq > current or current - last_seq > settings.REPLAY_MAXLEN:
+            return current, None
+        if last_seq == current:
+            return current, []
+        entries = get_redis_connection("default").xrange(_keys(channel)[1], min=f"{last_seq + 1}-0")
+    except Exception as e:
+        logger.warning("replay_read_failed", channel=channel, error=str(e))
+        return None, None
+
+    if not entries or int(_decode(entries[0][0]).split("-")[0]) != last_seq + 1:
+        return current, None
+    return current, [_decode(fields[b"f"]) for _, fields in entries]
+
+
+def last_seq_from_scope(scope):
+    """The ?last_seq= a reconnecting socket passes to ask for a replay instead of the history dump."""
+    values = parse_qs(scope.get("query_string", b"").decode("utf8")).get("last_seq")
+    try:
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
\ No newline at end of file
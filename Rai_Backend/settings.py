@@ -20,6 +20,24 @@ LOGS_DIR = BASE_DIR / "logs"
 LOGS_DIR.mkdir(exist_ok=True)
 
 THE_ODDS_API_KEY = os.getenv("THE_ODDS_API_KEY")
+ODDS_API_BASE_URL = os.getenv("ODDS_API_BASE_URL", "https://api.the-odds-api.com/v4").rstrip("/")
+ODDS_SYNC_BATCH_SIZE = int(os.getenv("ODDS_SYNC_BATCH_SIZE", 200))
+ODDS_SYNC_MAX_GAMES = int(os.getenv("ODDS_SYNC_MAX_GAMES", 1000))
+ODDS_SPORTS = [s.strip() for s in os.getenv("ODDS_SPORTS", "").split(",") if s.strip()]
+ODDS_SPORTS_REFRESH_INTERVAL = int(os.getenv("ODDS_SPORTS_REFRESH_INTERVAL", 3600))
+ODDS_SYNC_INTERVAL_LIVE = int(os.getenv("ODDS_SYNC_INTERVAL_LIVE", 60))
+ODDS_SYNC_INTERVAL_SOON = int(os.getenv("ODDS_SYNC_INTERVAL_SOON", 300))
+ODDS_SYNC_INTERVAL_IDLE = int(os.getenv("ODDS_SYNC_INTERVAL_IDLE", 3600))
+ODDS_SYNC_INTERVAL_EMPTY = int(os.getenv("ODDS_SYNC_INTERVAL_EMPTY", 21600))
+ODDS_SYNC_LIVE_LEAD = int(os.getenv("ODDS_SYNC_LIVE_LEAD", 3600))
+ODDS_SYNC_SOON_LEAD = int(os.getenv("ODDS_SYNC_SOON_LEAD", 86400))
+ODDS_SYNC_LIVE_WINDOW = int(os.getenv("ODDS_SYNC_LIVE_WINDOW", 14400))
+ODDS_SYNC_LEASE = int(os.getenv("ODDS_SYNC_LEASE", 300))
+ODDS_API_QUOTA_FLOOR = int(os.getenv("ODDS_API_QUOTA_FLOOR", 100))
+ODDS_SNAPSHOT_RETENTION_DAYS = int(os.getenv("ODDS_SNAPSHOT_RETENTION_DAYS", 30))
+ODDS_SNAPSHOT_PRUNE_BATCH = int(os.getenv("ODDS_SNAPSHOT_PRUNE_BATCH", 5000))
+ODDS_HISTORY_DEFAULT_POINTS = int(os.getenv("ODDS_HISTORY_DEFAULT_POINTS", 100))
+ODDS_HISTORY_MAX_POINTS = int(os.getenv("ODDS_HISTORY_MAX_POINTS", 500))
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 
@@ -145,17 +163,26 @@ CACHE_REDIS_URL = os.getenv(
 
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "Rai_Backend.cache_backends.TwoTierRedisCache",
         "LOCATION": CACHE_REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
             "IGNORE_EXCEPTIONS": False,
+            "LOCAL_PREFIXES": [
+                p.strip() for p in os.getenv("CACHE_LOCAL_PREFIXES", "gen:,ws_auth_,otp_limit_,_membership_").split(",") if p.strip()
+            ],
+            "LOCAL_MAX_ENTRIES": int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", 2048)),
+            "LOCAL_TIMEOUT": float(os.getenv("CACHE_LOCAL_TIMEOUT", 1.0)),
         },
         "TIMEOUT": int(os.getenv("CACHE_DEFAULT_TIMEOUT", 300)),
         "KEY_PREFIX": os.getenv("CACHE_KEY_PREFIX", "rai"),
     }
 }
 
+CACHE_PAGE_TIMEOUT = int(os.getenv("CACHE_PAGE_TIMEOUT", 300))
+CACHE_REBUILD_LOCK_TIMEOUT = int(os.getenv("CACHE_REBUILD_LOCK_TIMEOUT", 10))
+CACHE_REBUILD_WAIT = float(os.getenv("CACHE_REBUILD_WAIT", 1.0))
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -182,6 +209,7 @@ CELERY_BROKER_POOL_LIMIT = int(os.getenv("CELERY_BROKER_POOL_LIMIT", 10))
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = os.getenv("CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP", "True").lower() == "true"
 CELERY_TASK_ROUTES = {
     "ai.tasks.generate_ai_response": {"queue": "heavy_queue"},
+    "ai.tasks.generate_conversation_title": {"queue": "default", "priority": 9},
     "*": {"queue": "default"},
 }
 
@@ -194,9 +222,17 @@ CELERY_BEAT_SCHEDULE = {
         "task": "authentication.tasks.cleanup_expired_otps_task",
         "schedule": crontab(minute=0),
     },
-    "sync-odds-every-5-minutes": {
+    "dispatch-odds-sync-every-minute": {
         "task": "betting.tasks.sync_odds_data",
-        "schedule": crontab(minute='*/5'),
+        "schedule": crontab(),
+    },
+    "replay-unsaved-community-messages": {
+        "task": "community.tasks.replay_unsaved_messages",
+        "schedule": crontab(),
+    },
+    "prune-odds-snapshots-nightly": {
+        "task": "betting.tasks.prune_odds_snapshots",
+        "schedule": crontab(hour=3, minute=30),
     },
 }
 
@@ -265,7 +301,7 @@ REST_FRAMEWORK = {
     },
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "EXCEPTION_HANDLER": "authentication.exceptions.custom_exception_handler",
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "Rai_Backend.pagination.KeysetPagination",
     "PAGE_SIZE": int(os.getenv("PAGE_SIZE", 20)),
 }
 
@@ -398,6 +434,38 @@ LOGGING = {
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+OPENAI_TRANSCRIBE_TIMEOUT = float(os.getenv("OPENAI_TRANSCRIBE_TIMEOUT", 120))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "True").lower() == "true"
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60))
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", 12000))
+AI_CONTEXT_MAX_MESSAGES = int(os.getenv("AI_CONTEXT_MAX_MESSAGES", 50))
+AI_SUMMARY_MAX_TOKENS = int(os.getenv("AI_SUMMARY_MAX_TOKENS", 500))
+AI_IMAGE_MAX_DIMENSION = int(os.getenv("AI_IMAGE_MAX_DIMENSION", 1568))
+AI_IMAGE_JPEG_QUALITY = int(os.getenv("AI_IMAGE_JPEG_QUALITY", 85))
+AI_VISION_MAX_IMAGES = int(os.getenv("AI_VISION_MAX_IMAGES", 3))
+AI_VISION_CACHE_TIMEOUT = int(os.getenv("AI_VISION_CACHE_TIMEOUT", 3600))
+AI_VISION_USE_URLS = os.getenv("AI_VISION_USE_URLS", "False").lower() == "true"
+AI_CHAT_HISTORY_PAGE_SIZE = int(os.getenv("AI_CHAT_HISTORY_PAGE_SIZE", 50))
+AI_GENERATION_MODE = os.getenv("AI_GENERATION_MODE", "celery")
+AI_ASYNC_MAX_INFLIGHT = int(os.getenv("AI_ASYNC_MAX_INFLIGHT", 200))
+AI_ASYNC_TURN_TIMEOUT = float(os.getenv("AI_ASYNC_TURN_TIMEOUT", CELERY_TASK_SOFT_TIME_LIMIT))
+AI_STREAMING_ENABLED = os.getenv("AI_STREAMING_ENABLED", "True").lower() == "true"
+AI_STREAM_FLUSH_INTERVAL = float(os.getenv("AI_STREAM_FLUSH_INTERVAL", 0.25))
+COMMUNITY_WRITE_BUFFER_INTERVAL = float(os.getenv("COMMUNITY_WRITE_BUFFER_INTERVAL", 0.05))
+COMMUNITY_WRITE_BUFFER_MAX = int(os.getenv("COMMUNITY_WRITE_BUFFER_MAX", 100))
+COMMUNITY_UNSAVED_REPLAY_BATCH = int(os.getenv("COMMUNITY_UNSAVED_REPLAY_BATCH", 500))
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", 60))
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", 20))
+PRESENCE_TYPING_INTERVAL = float(os.getenv("PRESENCE_TYPING_INTERVAL", 3))
+PRESENCE_BROADCAST_INTERVAL = float(os.getenv("PRESENCE_BROADCAST_INTERVAL", 2))
+STREAM_MAX_SUBSCRIPTIONS = int(os.getenv("STREAM_MAX_SUBSCRIPTIONS", 100))
+STREAM_CHANNEL_QUEUE_SIZE = int(os.getenv("STREAM_CHANNEL_QUEUE_SIZE", 256))
+REPLAY_MAXLEN = int(os.getenv("REPLAY_MAXLEN", 200))
+REPLAY_TTL = int(os.getenv("REPLAY_TTL", 3600))
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 
 SOCIALACCOUNT_EMAIL_VERIFICATION = "none"
@@ -0,0 +1,248 @@
+import uuid
+from unittest import mock
+import fakeredis
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, override_settings
+from ai.models import Conversation, Message
+from community.models import Community, Membership
+from .cache import generation_key, get_generation, page_key, read_through
+from .cache_backends import LocalTier, ProcessTier, TwoTierRedisCache
+
+
+LOCMEM = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM)
+class CacheInvalidatingQuerySetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.alice = User.objects.create_user(username="alice", email="alice@example.com", password="x" * 12)
+        self.bob = User.objects.create_user(username="bob", email="bob@example.com", password="x" * 12)
+        self.first, self.second, self.third = (Conversation.objects.create(user=self.alice) for _ in range(3))
+
+    def bumped(self, write, *namespaces):
+        """Run `write` and return which of `namespaces` moved to a new generation."""
+        before = {ns: get_generation(ns) for ns in namespaces}
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        return {ns for ns in namespaces if cache.get(generation_key(ns)) != before[ns]}
+
+    def conversation_namespaces(self):
+        return (
+            f"conversation_{self.first.id}", f"conversation_{self.second.id}", f"conversation_{self.third.id}",
+            f"user_conversations_{self.alice.id}", f"user_conversations_{self.bob.id}",
+        )
+
+    def test_update_by_pk(self):
+        bumped = self.bumped(
+            lambda: Conversation.objects.filter(pk=self.first.pk).update(title="renamed"),
+            *self.conversation_namespaces(),
+        )
+        self.assertEqual(bumped, {f"conversation_{self.first.id}", f"user_conversations_{self.alice.id}"})
+
+    def test_update_pinned_by_filter_skips_select(self):
+        Message.objects.create(conversation=self.first, sender="user", text="hi")
+        with self.assertNumQueries(1):
+            bumped = self.bumped(
+                lambda: Message.objects.filter(conversation=self.first).update(text="edited"),
+                f"conversation_messages_{self.first.id}", f"conversation_messages_{self.second.id}",
+            )
+        self.assertEqual(bumped, {f"conversation_messages_{self.first.id}"})
+
+    def test_update_by_pk_in(self):
+        bumped = self.bumped(
+            lambda: Conversation.objects.filter(pk__in=[self.first.pk, self.second.pk]).update(title="renamed"),
+            *self.conversation_namespaces(),
+        )
+        self.assertEqual(bumped, {
+            f"conversation_{self.first.id}", f"conversation_{self.second.id}", f"user_conversations_{self.alice.id}",
+        })
+
+    def test_or_filter_falls_back_to_select(self):
+        queryset = Conversation.objects.filter(Q(pk=self.first.pk) | Q(pk=self.second.pk))
+        with self.assertNumQueries(2):
+            bumped = self.bumped(lambda: queryset.update(title="renamed"), *self.conversation_namespaces())
+        self.assertEqual(bumped, {
+            f"conversation_{self.first.id}", f"conversation_{self.second.id}", f"user_conversations_{self.alice.id}",
+        })
+
+    def test_negated_filter_falls_back_to_select(self):
+        queryset = Conversation.objects.exclude(pk=self.first.pk)
+        with self.assertNumQueries(2):
+            bumped = self.bumped(lambda: queryset.update(title="renamed"), *self.conversation_namespaces())
+        self.assertEqual(bumped, {
+            f"conversation_{self.second.id}", f"conversation_{self.third.id}", f"user_conversations_{self.alice.id}",
+        })
+
+    def test_reassignment_bumps_old_and_new_values(self):
+        bumped = self.bumped(
+            lambda: Conversation.objects.filter(pk=self.first.pk).update(user=self.bob),
+            *self.conversation_namespaces(),
+        )
+        self.assertEqual(bumped, {
+            f"conversation_{self.first.id}", f"user_conversations_{self.alice.id}", f"user_conversations_{self.bob.id}",
+        })
+
+    def test_update_of_unregistered_fields_is_ignored(self):
+        with self.assertNumQueries(1):
+            bumped = self.bumped(
+                lambda: Conversation.objects.filter(user=self.alice).update(total_tokens_used=5),
+                *self.conversation_namespaces(),
+            )
+        self.assertEqual(bumped, set())
+
+    def test_bulk_create_update_conflicts(self):
+        community = Community.objects.create(name="Sharps")
+        Membership.objects.create(community=community, user=self.alice)
+        namespaces = (
+            f"_membership_{community.id}_{self.alice.id}", f"user_memberships_{self.alice.id}",
+            f"_membership_{community.id}_{self.bob.id}", f"user_memberships_{self.bob.id}",
+        )
+        bumped = self.bumped(
+            lambda: Membership.objects.bulk_create(
+                [Membership(community=community, user=self.alice, role="admin")],
+                update_conflicts=True, update_fields=["role"], unique_fields=["community", "user"],
+            ),
+            *namespaces,
+        )
+        self.assertEqual(bumped, set(namespaces[:2]))
+        self.assertEqual(Membership.objects.get(community=community, user=self.alice).role, "admin")
+
+
+@override_settings(CACHES=LOCMEM, CACHE_REBUILD_WAIT=0.1)
+class ReadThroughTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.loader = mock.Mock(return_value=["page"])
+
+    def test_caches_loaded_value(self):
+        self.assertEqual(read_through("feed", "1", self.loader), ["page"])
+        self.assertEqual(read_through("feed", "1", self.loader), ["page"])
+        self.loader.assert_called_once_with()
+
+    def test_failed_lock_builds_without_it(self):
+        with mock.patch.object(cache, "add", side_effect=ConnectionError):
+            self.assertEqual(read_through("feed", "1", self.loader), ["page"])
+        self.loader.assert_called_once_with()
+
+    def test_failed_store_still_returns_value(self):
+        with mock.patch.object(cache, "set", side_effect=ConnectionError), \
+                mock.patch.object(cache, "delete", side_effect=ConnectionError):
+            self.assertEqual(read_through("feed", "1", self.loader), ["page"])
+        self.loader.assert_called_once_with()
+
+    def test_failed_poll_builds_without_waiting(self):
+        real_get = cache.get
+        calls = []
+
+        def flaky_get(key, *args, **kwargs):
+            calls.append(key)
+            if len(calls) > 2:
+                raise ConnectionError
+            return real_get(key, *args, **kwargs)
+
+        # Another worker holds the rebuild lock, and the cache drops while this one waits for it.
+        cache.add(f"{page_key('feed', get_generation('feed'), '1')}:lock", "1")
+        with mock.patch.object(cache, "get", side_effect=flaky_get):
+            self.assertEqual(read_through("feed", "1", self.loader), ["page"])
+        self.assertEqual(len(calls), 3)
+        self.loader.assert_called_once_with()
+
+
+class LocalTierTests(SimpleTestCase):
+    def test_entries_expire(self):
+        local = LocalTier(max_entries=10, timeout=1.0)
+        with mock.patch("Rai_Backend.cache_backends.time.monotonic", side_effect=[100.0, 100.5, 101.5]):
+            local.set("k", "v")
+            self.assertEqual(local.get("k"), "v")
+            self.assertIsNone(local.get("k"))
+        self.assertEqual(len(local), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        local = LocalTier(max_entries=2, timeout=60)
+        local.set("a", 1)
+        local.set("b", 2)
+        local.get("a")
+        local.set("c", 3)
+        self.assertEqual([local.get(k) for k in "abc"], [1, None, 3])
+
+
+class PeerCache(TwoTierRedisCache):
+    """A TwoTierRedisCache with a tier of its own, standing in for another process."""
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self.peer_tier = ProcessTier(self._channel, self._local_max_entries, self._local_timeout)
+        self.peer_tier.ensure_listener = lambda client: None
+        self.peer_tier.subscribed.set()
+
+    @property
+    def _tier(self):
+        return self.peer_tier
+
+
+class TwoTierRedisCacheTests(SimpleTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        params = {
+            "KEY_PREFIX": "test",
+            "OPTIONS": {
+                "CONNECTION_POOL_KWARGS": {"connection_class": fakeredis.FakeConnection, "server": server},
+                "LOCAL_PREFIXES": ["gen:"],
+                "LOCAL_TIMEOUT": 60,
+            },
+        }
+        # django_redis keeps one connection pool per URL for the life of the process, so each test needs its own.
+        location = f"redis://{uuid.uuid4().hex}:6379/0"
+        self.first = PeerCache(location, params)
+        self.second = PeerCache(location, params)
+        # Each peer's invalidation listener, pumped by hand instead of from a thread.
+        self.subscriptions = {}
+        for peer in (self.first, self.second):
+            pubsub = fakeredis.FakeRedis(server=server).pubsub()
+            pubsub.subscribe(peer._channel)
+            self.subscriptions[peer] = pubsub
+
+    def deliver(self):
+        for peer, pubsub in self.subscriptions.items():
+            while (message := pubsub.get_message(timeout=0.01)) is not None:
+                peer.peer_tier.handle_invalidation(message)
+
+    def test_only_local_prefixes_are_kept_in_process(self):
+        self.first.set("gen:feed", 1)
+        self.first.set("page:feed", [1, 2])
+        for _ in range(2):
+            self.assertEqual(self.first.get("gen:feed"), 1)
+            self.assertEqual(self.first.get("page:feed"), [1, 2])
+
+        stats = self.first.tier_stats()
+        self.assertEqual((stats["local_hits"], stats["redis_hits"], stats["local_entries"]), (1, 1, 1))
+
+    def test_unsubscribed_tier_reads_through(self):
+        self.first.set("gen:feed", 1)
+        self.first.get("gen:feed")
+        self.first.peer_tier.subscribed.clear()
+        self.first.get("gen:feed")
+        self.assertEqual(self.first.tier_stats()["local_hits"], 0)
+
+    def test_writes_drop_peer_copies(self):
+        writes = [
+            ("set", lambda: self.second.set("gen:feed", 5), 5),
+            ("incr", lambda: self.second.incr("gen:feed"), 6),
+            ("delete", lambda: self.second.delete("gen:feed"), None),
+        ]
+        self.second.set("gen:feed", 1)
+        self.deliver()
+        for name, write, expected in writes:
+            with self.subTest(write=name):
+                self.first.get("gen:feed")
+                write()
+                self.deliver()
+                self.assertEqual(self.first.get("gen:feed"), expected)
+                self.assertEqual(self.second.get("gen:feed"), expected)
+
+        self.assertEqual(self.first.tier_stats()["invalidations_received"], 4)
+        self.assertEqual(self.second.tier_stats()["invalidations_received"], 0)
\ No newline at end of file
@@ -7,6 +7,7 @@ from rest_framework.permissions import IsAdminUser
 from rest_framework.authentication import SessionAuthentication
 from django.http import JsonResponse
 from django.db import connection
+from django.core.cache import cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,11 +17,14 @@ def health_check(request):
     try:
         with connection.cursor() as cursor:
             cursor.execute("SELECT 1")
-        return JsonResponse({
+        data = {
             "status": "healthy",
             "database": "connected",
             "version": "1.0.0"
-        })
+        }
+        if getattr(request.user, "is_staff", False) and hasattr(cache, "tier_stats"):
+            data["cache"] = cache.tier_stats()
+        return JsonResponse(data)
     except Exception as e:
         logger.error("health_check_failed", error=str(e), exc_info=True)
         return JsonResponse({
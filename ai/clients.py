@@ -0,0 +1,196 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+import httpx
+import structlog
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+logger = structlog.get_logger(__name__)
+
+_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_stats = {}
+_owner_pid = os.getpid()
+
+
+def _new_stats():
+    return {"requests_total": 0, "in_flight": 0, "created_at": time.time()}
+
+
+def _http_options():
+    return {
+        "http2": settings.OPENAI_HTTP2,
+        "timeout": httpx.Timeout(settings.OPENAI_TIMEOUT, connect=5.0),
+        "limits": httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def _count_request(stats):
+    with _stats_lock:
+        stats["requests_total"] += 1
+        stats["in_flight"] += 1
+
+
+def _release_once(stats):
+    """A callback that takes the request out of in_flight the first time it runs."""
+    released = False
+
+    def release():
+        nonlocal released
+        with _stats_lock:
+            if not released:
+                released = True
+                stats["in_flight"] = max(stats["in_flight"] - 1, 0)
+    return release
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body that leaves in_flight when closed, so streamed completions count until their last chunk."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+def _build_http_client(stats):
+    def on_request(request):
+        _count_request(stats)
+
+    def on_response(response):
+        response.stream = _TrackedStream(response.stream, _release_once(stats))
+
+    return httpx.Client(
+        event_hooks={"request": [on_request], "response": [on_response]},
+        **_http_options(),
+    )
+
+
+def _build_async_http_client(stats):
+    async def on_request(request):
+        _count_request(stats)
+
+    async def on_response(response):
+        response.stream = _AsyncTrackedStream(response.stream, _release_once(stats))
+
+    return httpx.AsyncClient(
+        event_hooks={"request": [on_request], "response": [on_response]},
+        **_http_options(),
+    )
+
+
+def _check_fork():
+    if _owner_pid != os.getpid():
+        _after_fork_in_child()
+
+
+def get_openai_client(name="default", timeout=None):
+    """Return the process-wide OpenAI client, creating it on first use."""
+    _check_fork()
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                stats = _new_stats()
+                client = OpenAI(
+                    api_key=settings.OPENAI_API_KEY,
+                    base_url=settings.OPENAI_BASE_URL,
+                    http_client=_build_http_client(stats),
+                )
+                _clients[name] = client
+                _stats[name] = stats
+                logger.info("openai_client_created", name=name, pid=os.getpid())
+    if timeout is not None:
+        return client.with_options(timeout=timeout)
+    return client
+
+
+def get_async_openai_client(name="default"):
+    """Return the AsyncOpenAI client bound to the running event loop, creating it on first use."""
+    _check_fork()
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = _async_clients[loop] = {}
+    entry = clients.get(name)
+    if entry is None:
+        stats = _new_stats()
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            http_client=_build_async_http_client(stats),
+        )
+        # Stats live with the loop's client, so each loop reports its own pool and both go away together.
+        entry = clients[name] = (client, stats)
+        logger.info("async_openai_client_created", name=name, pid=os.getpid())
+    return entry[0]
+
+
+def _after_fork_in_child():
+    """The parent's lock may be held mid-fork and its sockets are shared, so start over without closing them."""
+    global _lock, _stats_lock, _owner_pid
+    _lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _clients.clear()
+    _async_clients.clear()
+    _stats.clear()
+    _owner_pid = os.getpid()
+
+
+def get_pool_stats():
+    _check_fork()
+    pools = {}
+    registered = [(name, client, _stats.get(name, {})) for name, client in list(_clients.items())]
+    for loop, clients in list(_async_clients.items()):
+        registered.extend(
+            (f"async:{name}:{id(loop)}", client, stats) for name, (client, stats) in list(clients.items())
+        )
+    for name, client, stats in registered:
+        with _stats_lock:
+            stats = dict(stats)
+        try:
+            connections = client._client._transport._pool.connections
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for c in connections if c.is_idle())
+        except AttributeError:
+            pass
+        pools[name] = stats
+    return {"pid": os.getpid(), "pools": pools}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
\ No newline at end of file
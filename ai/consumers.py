@@ -1,14 +1,21 @@
 import json
 import structlog
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.core.cache import cache
+from . import engine
 from .tasks import generate_ai_response
 from .services import AIService
+from Rai_Backend.pagination import cursor_position, decode_cursor, encode_cursor, keyset_filter
+from Rai_Backend.presence import GLOBAL_SCOPE, PresenceTracker
+from Rai_Backend import replay
 
 logger = structlog.get_logger(__name__)
 
 MAX_MESSAGE_LENGTH = 50000
+HISTORY_ORDERING = ("-created_at", "-id")
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -39,18 +46,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.channel_layer.group_add(self.room_group_name, self.channel_name)
             await self.accept()
 
-            history = await self.get_chat_history(self.conversation_id)
-            await self.send_json({
-                "type": "chat_history",
-                "conversation_id": self.conversation_id,
-                "messages": history,
-            })
+            seq, frames = await sync_to_async(replay.resume, thread_sensitive=False)(
+                f"chat:{self.conversation_id}", replay.last_seq_from_scope(self.scope)
+            )
+            if frames is not None:
+                for frame in frames:
+                    await self.send(text_data=frame)
+                await self.send_json({"type": "resumed", "conversation_id": self.conversation_id, "seq": seq})
+            else:
+                history = await self.get_chat_history(self.conversation_id)
+                await self.send_json({
+                    "type": "chat_history",
+                    "conversation_id": self.conversation_id,
+                    "seq": seq,
+                    **history,
+                })
         else:
             await self.accept()
 
+        self.presence = PresenceTracker(self.user.id, self.channel_name, [GLOBAL_SCOPE])
+        await self.presence.start()
+
         logger.info("ws_connected", user_id=self.user.id, conversation_id=self.conversation_id)
 
     async def disconnect(self, close_code):
+        if hasattr(self, "presence"):
+            await self.presence.stop()
+
         if hasattr(self, "conversation_id") and self.conversation_id:
             has_processing = await self.check_processing_messages(self.conversation_id)
             if not has_processing:
@@ -71,6 +93,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
 
         try:
+            if data.get("action") == "load_more":
+                await self.load_more(data.get("before"))
+                return
+
             message_text = data.get("message", "").strip()
             image_id = data.get("image_id")
 
@@ -85,69 +111,55 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 })
                 return
 
-            if not self.conversation_id:
-                conversation = await self.create_new_conversation(self.user)
-                self.conversation_id = str(conversation.id)
-                self.room_group_name = f"chat_{self.conversation_id}"
-                await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-
+            try:
+                msg, is_new_chat, error = await self.submit_user_turn(
+                    self.user, self.conversation_id, message_text, image_id
+                )
+            except Exception as e:
+                logger.error("ws_save_message_failed", error=str(e), exc_info=True)
                 await self.send_json({
-                    "type": "conversation_created",
-                    "conversation_id": self.conversation_id,
+                    "type": "error",
+                    "code": "save_failed",
+                    "message": "Failed to save your message. Please try again.",
                 })
+                return
 
-            lock_key = f"ai_processing_lock:{self.conversation_id}:{self.user.id}"
-            has_processing = await self.check_processing_messages(self.conversation_id)
-            if not has_processing:
-                await database_sync_to_async(cache.delete)(lock_key)
-
-            if not await self.acquire_lock(lock_key, 240):
+            if error == "ai_busy":
                 await self.send_json({
                     "type": "error",
                     "code": "ai_busy",
                     "message": "AI is still thinking. Please wait.",
                 })
                 return
-
-            is_new_chat = (await self.get_message_count(self.conversation_id)) == 0
-
-            try:
-                msg = await self.save_message(self.conversation_id, message_text, "user", image_id)
-            except Exception as e:
-                logger.error("ws_save_message_failed", error=str(e), exc_info=True)
-                await database_sync_to_async(cache.delete)(lock_key)
+            if error == "not_found":
                 await self.send_json({
                     "type": "error",
-                    "code": "save_failed",
-                    "message": "Failed to save your message. Please try again.",
+                    "code": "conversation_not_found",
+                    "message": "Conversation not found.",
                 })
                 return
 
-            from django.conf import settings
-            def format_url(url):
-                if not url:
-                    return None
-                if url.startswith("http"):
-                    return url
-                return f"{settings.SERVER_BASE_URL}{url}"
+            if not self.conversation_id:
+                self.conversation_id = str(msg.conversation_id)
+                self.room_group_name = f"chat_{self.conversation_id}"
+                await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+
+                await self.send_json({
+                    "type": "conversation_created",
+                    "conversation_id": self.conversation_id,
+                })
+
+            lock_key = f"ai_processing_lock:{self.conversation_id}:{self.user.id}"
 
             await self.send_json({
                 "type": "new_message",
                 "conversation_id": self.conversation_id,
-                "message": {
-                    "id": msg.id,
-                    "text": msg.text,
-                    "sender": msg.sender,
-                    "is_ai": False,
-                    "status": msg.status,
-                    "image_id": image_id,
-                    "image_url": format_url(msg.image.url) if msg.image else None,
-                    "created_at": str(msg.created_at),
-                },
+                "message": AIService.user_message_payload(msg, image_id),
             })
 
             try:
-                generate_ai_response.delay(
+                dispatch = engine.submit if settings.AI_GENERATION_MODE == "async" else generate_ai_response.delay
+                dispatch(
                     str(self.conversation_id),
                     message_text,
                     self.user.id,
@@ -172,25 +184,34 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error("ws_receive_error", error=str(e), exc_info=True)
             await self.send_json({"type": "error", "code": "server_error", "message": "A server error occurred."})
 
+    async def load_more(self, before):
+        if not self.conversation_id or not before:
+            return
+        try:
+            history = await self.get_chat_history(self.conversation_id, before)
+        except ValueError:
+            await self.send_json({"type": "error", "code": "invalid_cursor", "message": "Invalid history cursor."})
+            return
+        await self.send_json({
+            "type": "chat_history_page",
+            "conversation_id": self.conversation_id,
+            **history,
+        })
+
     async def send_json(self, content):
         await self.send(text_data=json.dumps(content))
 
     async def message_update(self, event):
-        await self.send_json({
-            "type": "message_update",
-            "conversation_id": event["conversation_id"],
-            "message": event["message"],
-        })
+        await self.send(text_data=event["frame"])
+
+    async def message_delta(self, event):
+        await self.send(text_data=event["frame"])
 
     async def chat_title_update(self, event):
-        await self.send_json({"type": "title_updated", "title": event["title"]})
+        await self.send(text_data=event["frame"])
 
     async def chat_error(self, event):
-        await self.send_json({"type": "error", "message": event["message"]})
-
-    @database_sync_to_async
-    def acquire_lock(self, key, timeout):
-        return cache.add(key, "true", timeout)
+        await self.send(text_data=event["frame"])
 
     @database_sync_to_async
     def check_processing_messages(self, conv_id):
@@ -203,38 +224,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         return Conversation.objects.filter(id=conv_id, user=user, is_active=True).exists()
 
     @database_sync_to_async
-    def create_new_conversation(self, user):
-        return AIService.create_conversation(user)
-
-    @database_sync_to_async
-    def save_message(self, conv_id, text, sender, image_id):
-        from .models import Message
-        if image_id:
-            try:
-                msg = Message.objects.get(id=image_id, conversation_id=conv_id)
-            except Message.DoesNotExist:
-                raise ValueError(f"Image message {image_id} not found in conversation {conv_id}")
-            msg.text = text
-            msg.status = "completed"
-            msg.save(update_fields=["text", "status"])
-            return msg
-        else:
-            return Message.objects.create(
-                conversation_id=conv_id,
-                text=text,
-                sender=sender,
-                status="completed",
-            )
-
-    @database_sync_to_async
-    def get_message_count(self, conv_id):
-        from .models import Message
-        return Message.objects.filter(conversation_id=conv_id).count()
+    def submit_user_turn(self, user, conv_id, text, image_id):
+        return AIService.submit_user_turn(user, conv_id, text, image_id)
 
     @database_sync_to_async
-    def get_chat_history(self, conv_id):
+    def get_chat_history(self, conv_id, before=None):
+        """One page of history, newest first by (created_at, id), returned oldest-to-newest."""
         from .models import Message
-        from django.conf import settings
 
         def format_url(url):
             if not url:
@@ -243,17 +239,31 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 return url
             return f"{settings.SERVER_BASE_URL}{url}"
 
-        messages = Message.objects.filter(conversation_id=conv_id).order_by("created_at")
-        return [
-            {
-                "id": m.id,
-                "text": m.text,
-                "sender": m.sender,
-                "is_ai": m.sender == "ai",
-                "status": m.status,
-                "image_id": m.id if m.image else None,
-                "image_url": format_url(m.image.url) if m.image else None,
-                "created_at": str(m.created_at),
-            }
-            for m in messages
-        ]
\ No newline at end of file
+        limit = settings.AI_CHAT_HISTORY_PAGE_SIZE
+        messages = Message.objects.filter(conversation_id=conv_id)
+        if before:
+            position, _ = decode_cursor(before)
+            messages = messages.filter(keyset_filter(Message, HISTORY_ORDERING, position))
+
+        page = list(messages.order_by(*HISTORY_ORDERING)[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+
+        return {
+            "messages": [
+                {
+                    "id": m.id,
+                    "text": m.text,
+                    "sender": m.sender,
+                    "is_ai": m.sender == "ai",
+                    "status": m.status,
+                    "image_id": m.id if m.image else None,
+                    "image_url": format_url(m.image.url) if m.image else None,
+                    "created_at": str(m.created_at),
+                }
+                for m in page
+            ],
+            "has_more": has_more,
+            "next_cursor": encode_cursor(cursor_position(page[0], HISTORY_ORDERING)) if has_more else None,
+        }
\ No newline at end of file
@@ -0,0 +1,57 @@
+import structlog
+from django.conf import settings
+from .models import Message
+from .utils import count_tokens
+
+logger = structlog.get_logger(__name__)
+
+IMAGE_TOKEN_COST = 85
+
+
+def message_tokens(msg):
+    tokens = msg.token_count or count_tokens(msg.text)
+    if msg.image:
+        tokens += IMAGE_TOKEN_COST
+    return tokens
+
+
+def build_context(conversation, exclude_id=None, reserved_tokens=0):
+    """
+    Select the newest messages that fit in the token budget, walking backwards from the latest turn.
+    Returns the messages in chronological order, their token total and whether older unsummarized
+    turns fell outside the window.
+    """
+    budget = settings.AI_CONTEXT_TOKEN_BUDGET - reserved_tokens - conversation.summary_token_count
+
+    queryset = Message.objects.filter(conversation_id=conversation.id)
+    if exclude_id:
+        queryset = queryset.exclude(id=exclude_id)
+    if conversation.summary_until_id:
+        queryset = queryset.filter(id__gt=conversation.summary_until_id)
+
+    candidates = list(
+        queryset.only("id", "sender", "text", "image", "image_hash", "token_count", "created_at")
+        .order_by("-created_at", "-id")[:settings.AI_CONTEXT_MAX_MESSAGES + 1]
+    )
+
+    selected =[]
+    used = 0
+    for msg in candidates[:settings.AI_CONTEXT_MAX_MESSAGES]:
+        cost = message_tokens(msg)
+        if selected and used + cost > budget:
+            break
+        selected.append(msg)
+        used += cost
+
+    selected.reverse()
+    has_overflow = len(selected) < len(candidates)
+
+    logger.debug(
+        "ai_context_built",
+        conversation_id=str(conversation.id),
+        messages=len(selected),
+        tokens=used,
+        budget=budget,
+        overflow=has_overflow,
+    )
+    return selected, used, has_overflow
\ No newline at end of file
@@ -0,0 +1,168 @@
+import asyncio
+import weakref
+import structlog
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from .clients import get_async_openai_client
+from .tasks import (
+    INJECTION_REFUSAL, MAX_REPLY_TOKENS, MAX_TURN_RETRIES, TIMEOUT_TEXT, TRANSIENT_ERRORS, UNAVAILABLE_TEXT,
+    DeltaBuffer, build_messages_payload, chat_event, complete_turn, fail_ai_message, release_turn_lock, retry_countdown,
+    retry_turn, start_turn, validate_input,
+)
+
+logger = structlog.get_logger(__name__)
+
+_running = set()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(settings.AI_ASYNC_MAX_INFLIGHT)
+    return semaphore
+
+
+def submit(conversation_id, user_text, user_id, is_new_chat=False, image_id=None):
+    """Schedule an AI turn on the running event loop. Mirrors generate_ai_response.delay()."""
+    task = asyncio.get_running_loop().create_task(
+        generate_ai_response(conversation_id, user_text, user_id, is_new_chat, image_id)
+    )
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def _send_event(channel_layer, conversation_id, event):
+    event = await sync_to_async(chat_event, thread_sensitive=False)(conversation_id, event)
+    await channel_layer.group_send(f"chat_{conversation_id}", event)
+
+
+async def _send_delta(channel_layer, conversation_id, message_id, delta):
+    await _send_event(channel_layer, conversation_id, {"type": "message_delta", "message_id": message_id, "delta": delta})
+
+
+async def _complete(client, channel_layer, conversation_id, ai_msg, messages_payload):
+    if not settings.AI_STREAMING_ENABLED:
+        response = await client.chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=messages_payload,
+            max_tokens=MAX_REPLY_TOKENS,
+        )
+        return response.choices[0].message.content, response.usage
+
+    stream = await client.chat.completions.create(
+        model=settings.OPENAI_MODEL,
+        messages=messages_payload,
+        max_tokens=MAX_REPLY_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    buffer = DeltaBuffer(settings.AI_STREAM_FLUSH_INTERVAL)
+    usage = None
+    async for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        flushed = buffer.add(delta)
+        if flushed:
+            await _send_delta(channel_layer, conversation_id, ai_msg.id, flushed)
+
+    flushed = buffer.drain()
+    if flushed:
+        await _send_delta(channel_layer, conversation_id, ai_msg.id, flushed)
+    return buffer.text, usage
+
+
+async def _attempt(client, channel_layer, conversation_id, user_text, user_id, is_new_chat, retries, state):
+    turn = await database_sync_to_async(start_turn)(
+        conversation_id, user_id, user_text, is_new_chat,
+        first_attempt=retries == 0, ai_msg_id=state["ai_msg"].id if state["ai_msg"] else None,
+    )
+    if turn is None:
+        return
+    conversation, state["ai_msg"] = turn
+
+    messages_payload = await database_sync_to_async(build_messages_payload)(conversation, state["ai_msg"])
+    ai_text, usage = await _complete(client, channel_layer, conversation_id, state["ai_msg"], messages_payload)
+    tokens_used = await database_sync_to_async(complete_turn)(state["ai_msg"], conversation_id, ai_text, usage)
+
+    logger.info("ai_task_completed", conversation_id=conversation_id, tokens_used=tokens_used, engine="async")
+
+
+async def generate_ai_response(conversation_id, user_text, user_id, is_new_chat=False, image_id=None):
+    """
+    Async counterpart of ai.tasks.generate_ai_response. Same retry schedule, failure texts and lock
+    release, but the upstream call only holds a coroutine, so one process multiplexes many turns. Each
+    attempt holds an AI_ASYNC_MAX_INFLIGHT slot; the back-off between attempts does not.
+    """
+    channel_layer = get_channel_layer()
+    state = {"ai_msg": None}
+    retries = 0
+
+    try:
+        if not validate_input(user_text):
+            logger.warning("prompt_injection_detected", user_id=user_id, conversation_id=conversation_id)
+            await _send_event(channel_layer, conversation_id, {"type": "chat_error", "message": INJECTION_REFUSAL})
+            return
+
+        client = get_async_openai_client()
+        while True:
+            logger.info("ai_task_started", conversation_id=conversation_id, user_id=user_id, attempt=retries + 1, engine="async")
+            try:
+                async with _get_semaphore():
+                    await asyncio.wait_for(
+                        _attempt(client, channel_layer, conversation_id, user_text, user_id, is_new_chat, retries, state),
+                        timeout=settings.AI_ASYNC_TURN_TIMEOUT,
+                    )
+                return
+            except TRANSIENT_ERRORS as e:
+                logger.warning(
+                    "ai_transient_error_retrying",
+                    error=str(e),
+                    error_type=type(e).__name__,
+                    attempt=retries + 1,
+                    conversation_id=conversation_id,
+                )
+                if retries >= MAX_TURN_RETRIES:
+                    if state["ai_msg"]:
+                        await database_sync_to_async(fail_ai_message)(state["ai_msg"], conversation_id, UNAVAILABLE_TEXT)
+                    return
+                if state["ai_msg"]:
+                    await database_sync_to_async(retry_turn)(state["ai_msg"])
+                await asyncio.sleep(retry_countdown(retries))
+                retries += 1
+
+    except asyncio.TimeoutError:
+        logger.error("ai_task_soft_timeout", conversation_id=conversation_id, engine="async")
+        if state["ai_msg"]:
+            await database_sync_to_async(fail_ai_message)(state["ai_msg"], conversation_id, TIMEOUT_TEXT)
+
+    except asyncio.CancelledError:
+        logger.warning("ai_task_cancelled", conversation_id=conversation_id, engine="async")
+        if state["ai_msg"]:
+            await database_sync_to_async(fail_ai_message)(state["ai_msg"], conversation_id, UNAVAILABLE_TEXT)
+        raise
+
+    except Exception as e:
+        logger.error(
+            "ai_generation_failed",
+            error=str(e),
+            error_type=type(e).__name__,
+            conversation_id=conversation_id,
+            engine="async",
+            exc_info=True,
+        )
+        if state["ai_msg"]:
+            await database_sync_to_async(fail_ai_message)(state["ai_msg"], conversation_id)
+
+    finally:
+        await database_sync_to_async(release_turn_lock)(conversation_id, user_id)
\ No newline at end of file
@@ -1,9 +1,9 @@
 from django.db import models
 from django.conf import settings
 from django.core.validators import MaxLengthValidator
-from django.core.cache import cache
 import uuid
-import tiktoken
+from Rai_Backend.cache import CacheInvalidatingQuerySet, register
+from .utils import count_tokens
 
 class Conversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -14,6 +14,11 @@ class Conversation(models.Model):
     is_active = models.BooleanField(default=True, db_index=True)
     deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
     total_tokens_used = models.IntegerField(default=0)
+    summary = models.TextField(blank=True)
+    summary_token_count = models.IntegerField(default=0)
+    summary_until_id = models.BigIntegerField(null=True, blank=True)
+
+    objects = CacheInvalidatingQuerySet.as_manager()
 
     class Meta:
         ordering =['-updated_at']
@@ -23,16 +28,6 @@ class Conversation(models.Model):
             models.Index(fields=['user', 'is_active', '-updated_at']),
         ]
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'user_conversations_{self.user_id}')
-        cache.delete(f'conversation_{self.id}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete(f'user_conversations_{self.user_id}')
-        cache.delete(f'conversation_{self.id}')
-        super().delete(*args, **kwargs)
-
     def __str__(self):
         return f"{self.user.username} - {self.title}"
 
@@ -50,31 +45,36 @@ class Message(models.Model):
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES, db_index=True)
     text = models.TextField(validators=[MaxLengthValidator(50000)], blank=True)
     image = models.ImageField(upload_to='chat_images/', null=True, blank=True, db_index=True)
+    image_hash = models.CharField(max_length=64, blank=True, db_index=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='completed', db_index=True)
     token_count = models.IntegerField(default=0, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def save(self, *args, **kwargs):
         if not self.token_count and self.text:
-            try:
-                encoding = tiktoken.get_encoding("cl100k_base")
-                self.token_count = len(encoding.encode(self.text))
-            except Exception:
-                self.token_count = len(self.text) // 4
-                
+            self.token_count = count_tokens(self.text)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'token_count' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'token_count']
+
         super().save(*args, **kwargs)
-        cache.delete(f'conversation_messages_{self.conversation_id}')
 
-    def delete(self, *args, **kwargs):
-        cache.delete(f'conversation_messages_{self.conversation_id}')
-        super().delete(*args, **kwargs)
+    objects = CacheInvalidatingQuerySet.as_manager()
 
     class Meta:
         ordering = ['created_at']
         indexes =[
             models.Index(fields=['conversation', '-created_at']),
+            models.Index(fields=['conversation', '-created_at', '-id']),
             models.Index(fields=['conversation', 'sender', '-created_at']),
             models.Index(fields=['conversation', 'token_count']),
             models.Index(fields=['conversation', 'sender']),
             models.Index(fields=['conversation', 'image']),
-        ]
\ No newline at end of file
+        ]
+
+
+register(
+    Conversation, 'user_conversations_{user_id}', 'conversation_{id}',
+    fields=['user', 'title', 'is_active', 'updated_at'],
+)
+register(Message, 'conversation_messages_{conversation_id}')
\ No newline at end of file
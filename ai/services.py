@@ -1,7 +1,12 @@
 import structlog
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
 from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from Rai_Backend.cache import read_through
 from .models import Conversation, Message
 
 logger = structlog.get_logger(__name__)
@@ -18,8 +23,20 @@ class AIService:
 
     @staticmethod
     def get_messages(user, conversation_id):
-        conversation = get_object_or_404(Conversation, id=conversation_id, user=user, is_active=True)
-        return Message.objects.filter(conversation=conversation).order_by('created_at')
+        AIService.check_conversation_access(user, conversation_id)
+        return Message.objects.filter(conversation_id=conversation_id).order_by('created_at')
+
+    @staticmethod
+    def check_conversation_access(user, conversation_id):
+        """Raise Http404 unless the user owns the active conversation. The owner is cached in conversation_{id}."""
+        owner_id = read_through(
+            f'conversation_{conversation_id}', 'owner',
+            lambda: Conversation.objects.filter(
+                id=conversation_id, is_active=True
+            ).values_list('user_id', flat=True).first() or '',
+        )
+        if owner_id != user.id:
+            raise Http404("Conversation not found")
 
     @staticmethod
     def create_conversation(user, title="New Chat"):
@@ -50,4 +67,78 @@ class AIService:
                 )
 
             Conversation.objects.filter(id=conversation_id).update(updated_at=timezone.now())
-            return True
\ No newline at end of file
+            return True
+
+    @staticmethod
+    def user_message_payload(msg, image_id=None):
+        """The accepted user message as echoed back to the sender's socket in a new_message frame."""
+        image_url = msg.image.url if msg.image else None
+        if image_url and not image_url.startswith("http"):
+            image_url = f"{settings.SERVER_BASE_URL}{image_url}"
+        return {
+            "id": msg.id,
+            "text": msg.text,
+            "sender": msg.sender,
+            "is_ai": False,
+            "status": msg.status,
+            "image_id": image_id,
+            "image_url": image_url,
+            "created_at": str(msg.created_at),
+        }
+
+    @staticmethod
+    def submit_user_turn(user, conversation_id, text, image_id=None, lock_timeout=240):
+        """
+        Everything the chat socket needs before dispatching an AI turn, in one transaction:
+        ownership check, AI lock, new-chat detection and the message insert.
+        Creates the conversation when conversation_id is None. Returns (message, is_new_chat, error_code).
+        """
+        lock_key = None
+        try:
+            with transaction.atomic():
+                if conversation_id:
+                    state = Conversation.objects.filter(
+                        id=conversation_id, user=user, is_active=True
+                    ).annotate(
+                        has_messages=Exists(Message.objects.filter(conversation_id=OuterRef('pk'))),
+                        has_processing=Exists(
+                            Message.objects.filter(conversation_id=OuterRef('pk'), status='processing')
+                        ),
+                    ).values('has_messages', 'has_processing').first()
+                    if state is None:
+                        return None, False, 'not_found'
+                else:
+                    conversation = AIService.create_conversation(user)
+                    conversation_id = conversation.id
+                    state = {'has_messages': False, 'has_processing': False}
+
+                key = f"ai_processing_lock:{conversation_id}:{user.id}"
+                if not state['has_processing']:
+                    cache.delete(key)
+                if not cache.add(key, "true", lock_timeout):
+                    return None, False, 'ai_busy'
+                lock_key = key
+
+                if image_id:
+                    try:
+                        msg = Message.objects.get(id=image_id, conversation_id=conversation_id)
+                    except Message.DoesNotExist:
+                        raise ValueError(f"Image message {image_id} not found in conversation {conversation_id}")
+                    msg.text = text
+                    msg.status = 'completed'
+                    msg.save(update_fields=['text', 'status'])
+                else:
+                    msg = Message.objects.create(
+                        conversation_id=conversation_id,
+                        text=text,
+                        sender='user',
+                        status='completed',
+                    )
+                Conversation.objects.filter(id=conversation_id, user=user).update(updated_at=timezone.now())
+        except Exception:
+            # The lock lives in the cache, outside the transaction; a rollback has to release it by hand.
+            if lock_key:
+                cache.delete(lock_key)
+            raise
+
+        return msg, not state['has_messages'], None
\ No newline at end of file
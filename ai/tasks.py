@@ -1,15 +1,22 @@
+import json
 import structlog
-import base64
+import functools
 import re
-import tiktoken
+import time
 from celery import shared_task
 from celery.exceptions import SoftTimeLimitExceeded
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.core.cache import cache
-from openai import OpenAI, RateLimitError, APITimeoutError, APIConnectionError
+from django.db.models import F
+from Rai_Backend import replay
+from openai import RateLimitError, APITimeoutError, APIConnectionError
+from .clients import get_openai_client, get_pool_stats
+from .context import build_context
 from .models import Conversation, Message
+from .utils import count_tokens
+from .vision import image_content_part
 
 logger = structlog.get_logger(__name__)
 
@@ -30,6 +37,27 @@ DANGEROUS_PATTERNS =[
 ]
 
 
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and Rai, an AI assistant.
+Merge the new messages into the existing summary. Keep facts, decisions, user preferences and open questions.
+Reply with only the updated summary, written in the third person."""
+
+MAX_REPLY_TOKENS = 1000
+MAX_TURN_RETRIES = 3
+TRANSIENT_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError)
+
+INJECTION_REFUSAL = "I cannot comply with that request due to safety guidelines."
+UNAVAILABLE_TEXT = "AI service is temporarily unavailable. Please try again."
+TIMEOUT_TEXT = "Request timed out. Please try again."
+
+SUMMARY_BATCH_SIZE = 100
+SUMMARY_MESSAGE_CHARS = 2000
+
+
+@functools.lru_cache(maxsize=None)
+def _system_prompt_tokens():
+    return count_tokens(SYSTEM_PROMPT)
+
+
 def validate_input(text):
     if not text:
         return True
@@ -39,19 +67,128 @@ def validate_input(text):
     return True
 
 
+def render_event(event):
+    """Client frame for an event sent to a chat_<conversation id> group."""
+    kind = event["type"]
+    if kind == "message_update":
+        return {"type": "message_update", "conversation_id": event["conversation_id"], "message": event["message"]}
+    if kind == "message_delta":
+        return {
+            "type": "message_delta",
+            "conversation_id": event["conversation_id"],
+            "message_id": event["message_id"],
+            "delta": event["delta"],
+        }
+    if kind == "chat_title_update":
+        return {"type": "title_updated", "title": event["title"]}
+    return {"type": "error", "message": event["message"]}
+
+
+def chat_event(conversation_id, event):
+    """Render the frame once and give it the conversation's next seq; every socket forwards it as-is."""
+    event = {**event, "conversation_id": str(conversation_id)}
+    event["seq"], event["frame"] = replay.sequence(f"chat:{conversation_id}", json.dumps(render_event(event)))
+    return event
+
+
+def send_chat_event(conversation_id, event):
+    async_to_sync(get_channel_layer().group_send)(f"chat_{conversation_id}", chat_event(conversation_id, event))
+
+
 def send_ws_message(conversation_id, message_data):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"chat_{conversation_id}",
-        {
-            "type": "message_update",
-            "conversation_id": str(conversation_id),
-            "message": message_data,
-        },
+    send_chat_event(conversation_id, {"type": "message_update", "message": message_data})
+
+
+def send_ws_delta(conversation_id, message_id, delta):
+    send_chat_event(conversation_id, {"type": "message_delta", "message_id": message_id, "delta": delta})
+
+
+class DeltaBuffer:
+    """Accumulates streamed deltas and releases them at most once per flush interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.parts =[]
+        self.pending =[]
+        self.last_flush = 0.0
+
+    def add(self, delta):
+        self.parts.append(delta)
+        self.pending.append(delta)
+        now = time.monotonic()
+        if now - self.last_flush >= self.interval:
+            self.last_flush = now
+            return self.drain()
+        return None
+
+    def drain(self):
+        if not self.pending:
+            return None
+        chunk = "".join(self.pending)
+        self.pending.clear()
+        return chunk
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+
+def _stream_completion(client, conversation_id, ai_msg, messages_payload):
+    """Forward completion deltas to the chat group, coalesced into periodic flushes."""
+    stream = client.chat.completions.create(
+        model=settings.OPENAI_MODEL,
+        messages=messages_payload,
+        max_tokens=MAX_REPLY_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True},
     )
 
+    buffer = DeltaBuffer(settings.AI_STREAM_FLUSH_INTERVAL)
+    usage = None
+
+    for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+
+        flushed = buffer.add(delta)
+        if flushed:
+            send_ws_delta(conversation_id, ai_msg.id, flushed)
+
+    flushed = buffer.drain()
+    if flushed:
+        send_ws_delta(conversation_id, ai_msg.id, flushed)
 
-def _fail_ai_message(ai_msg, conversation_id, text="System Error. AI is currently unavailable."):
+    return buffer.text, usage
+
+
+def _add_conversation_tokens(conversation_id, tokens):
+    if tokens:
+        Conversation.objects.filter(id=conversation_id).update(
+            total_tokens_used=F("total_tokens_used") + tokens
+        )
+
+
+def _schedule_summary(conversation_id, before_id):
+    if not cache.add(f"ai_summary_lock:{conversation_id}", "true", 300):
+        return
+    try:
+        update_conversation_summary.delay(str(conversation_id), before_id)
+    except Exception as e:
+        cache.delete(f"ai_summary_lock:{conversation_id}")
+        logger.warning("summary_dispatch_failed", error=str(e), conversation_id=conversation_id)
+
+
+def retry_countdown(retries):
+    return 15 * (retries + 1)
+
+
+def fail_ai_message(ai_msg, conversation_id, text="System Error. AI is currently unavailable."):
     """Helper to mark an AI message as failed and notify the client."""
     ai_msg.status = "failed"
     ai_msg.text = text
@@ -66,166 +203,171 @@ def _fail_ai_message(ai_msg, conversation_id, text="System Error. AI is currentl
     })
 
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=15)
-def generate_ai_response(self, conversation_id, user_text, user_id, is_new_chat=False, image_id=None):
-    channel_layer = get_channel_layer()
-    group_name = f"chat_{conversation_id}"
-    client = OpenAI(api_key=settings.OPENAI_API_KEY, timeout=30.0)
-    ai_msg = None
-
-    logger.info(
-        "ai_task_started",
-        conversation_id=conversation_id,
-        user_id=user_id,
-        attempt=self.request.retries + 1,
-    )
-
+def start_turn(conversation_id, user_id, user_text, is_new_chat, first_attempt=True, ai_msg_id=None):
+    """
+    Create the placeholder AI message for a turn, or reset the one a failed attempt left behind
+    (ai_msg_id), and announce it. Returns (conversation, ai_msg) or None.
+    """
     try:
-        if not validate_input(user_text):
-            logger.warning("prompt_injection_detected", user_id=user_id, conversation_id=conversation_id)
-            async_to_sync(channel_layer.group_send)(
-                group_name,
-                {"type": "chat_error", "message": "I cannot comply with that request due to safety guidelines."},
-            )
-            return
-
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-        except Conversation.DoesNotExist:
-            logger.error("ai_task_conversation_not_found", conversation_id=conversation_id)
-            return
+        conversation = Conversation.objects.get(id=conversation_id)
+    except Conversation.DoesNotExist:
+        logger.error("ai_task_conversation_not_found", conversation_id=conversation_id)
+        return None
 
+    ai_msg = None
+    if ai_msg_id is not None:
+        ai_msg = Message.objects.filter(id=ai_msg_id, conversation=conversation, sender="ai").first()
+    if ai_msg is None:
         ai_msg = Message.objects.create(
             conversation=conversation,
             sender="ai",
             text="",
             status="processing",
         )
+    else:
+        ai_msg.text = ""
+        ai_msg.status = "processing"
+        ai_msg.save(update_fields=["text", "status"])
+
+    send_ws_message(conversation_id, {
+        "id": ai_msg.id,
+        "text": "",
+        "sender": "ai",
+        "is_ai": True,
+        "status": "processing",
+        "created_at": str(ai_msg.created_at),
+    })
+
+    if is_new_chat and user_text and first_attempt:
+        try:
+            generate_conversation_title.delay(str(conversation_id), user_text[:100])
+        except Exception as e:
+            logger.warning("title_dispatch_failed", error=str(e), conversation_id=conversation_id)
+
+    return conversation, ai_msg
+
 
-        send_ws_message(conversation_id, {
-            "id": ai_msg.id,
-            "text": "",
-            "sender": "ai",
-            "is_ai": True,
-            "status": "processing",
-            "created_at": str(ai_msg.created_at),
+def build_messages_payload(conversation, ai_msg):
+    messages_payload =[{"role": "system", "content": SYSTEM_PROMPT}]
+    if conversation.summary:
+        messages_payload.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{conversation.summary}",
         })
 
-        if is_new_chat and user_text:
+    recent_msgs, _, has_overflow = build_context(
+        conversation, exclude_id=ai_msg.id, reserved_tokens=_system_prompt_tokens()
+    )
+    if has_overflow and recent_msgs:
+        _schedule_summary(conversation.id, recent_msgs[0].id)
+
+    image_ids = {msg.id for msg in recent_msgs if msg.image}
+    vision_ids = set(sorted(image_ids, reverse=True)[:settings.AI_VISION_MAX_IMAGES])
+
+    hist_list =[]
+    for msg in recent_msgs:
+        role = "assistant" if msg.sender == "ai" else "user"
+        content =[]
+        if msg.text:
+            content.append({"type": "text", "text": msg.text})
+
+        if msg.id in vision_ids:
             try:
-                title_res = client.chat.completions.create(
-                    model=settings.OPENAI_MODEL,
-                    messages=[
-                        {"role": "system", "content": "Generate a short 3-word title based on the user prompt. Reply with only the title, no quotes."},
-                        {"role": "user", "content": user_text[:100]},
-                    ],
-                    max_tokens=15,
-                )
-                title = title_res.choices[0].message.content.strip().replace('"', "")
-                conversation.title = title[:100]
-                conversation.save(update_fields=["title", "updated_at"])
-                async_to_sync(channel_layer.group_send)(
-                    group_name, {"type": "chat_title_update", "title": title}
-                )
+                content.append(image_content_part(msg))
             except Exception as e:
-                logger.warning("title_generation_failed", error=str(e))
+                logger.error("vision_image_fetch_failed", error=str(e), image_id=msg.id, exc_info=True)
+        elif msg.image and not msg.text:
+            content.append({"type": "text", "text": "[Shared an image]"})
 
-        messages_payload =[{"role": "system", "content": SYSTEM_PROMPT}]
+        if content:
+            if len(content) == 1 and content[0]["type"] == "text":
+                hist_list.append({"role": role, "content": content[0]["text"]})
+            else:
+                hist_list.append({"role": role, "content": content})
 
-        recent_msgs = list(
-            Message.objects.filter(conversation_id=conversation_id)
-            .exclude(id=ai_msg.id)
-            .order_by("-created_at")[:10]
-        )
-        recent_msgs.reverse()
+    messages_payload.extend(hist_list)
 
-        hist_list =[]
-        for msg in recent_msgs:
-            role = "assistant" if msg.sender == "ai" else "user"
-            content =[]
-            if msg.text:
-                content.append({"type": "text", "text": msg.text})
+    logger.debug("ai_request_payload", message_count=len(messages_payload), conversation_id=str(conversation.id))
+    return messages_payload
 
-            if msg.image:
-                try:
-                    with msg.image.open("rb") as img_file:
-                        encoded_string = base64.b64encode(img_file.read()).decode("utf-8")
-                    ext = msg.image.name.split(".")[-1].lower() if "." in msg.image.name else "jpeg"
-                    mime_type = f"image/{ext}" if ext in["jpeg", "png", "webp", "gif"] else "image/jpeg"
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {"url": f"data:{mime_type};base64,{encoded_string}"},
-                    })
-                except Exception as e:
-                    logger.error("vision_image_fetch_failed", error=str(e), image_id=msg.id, exc_info=True)
-
-            if content:
-                if len(content) == 1 and content[0]["type"] == "text":
-                    hist_list.append({"role": role, "content": content[0]["text"]})
-                else:
-                    hist_list.append({"role": role, "content": content})
-
-        messages_payload.extend(hist_list)
-
-        MAX_CONTEXT_TOKENS = 120000
-        current_tokens = 0
-        try:
-            encoding = tiktoken.get_encoding("cl100k_base")
-            for m in messages_payload:
-                if isinstance(m["content"], str):
-                    current_tokens += len(encoding.encode(m["content"]))
-                elif isinstance(m["content"], list):
-                    for part in m["content"]:
-                        if part.get("type") == "text":
-                            current_tokens += len(encoding.encode(part["text"]))
-                        elif part.get("type") == "image_url":
-                            current_tokens += 85
-        except Exception as e:
-            logger.warning("tiktoken_encoding_failed", error=str(e))
 
-        if current_tokens > MAX_CONTEXT_TOKENS:
-            logger.warning("token_budget_exceeded", tokens=current_tokens, conversation_id=conversation_id)
-            if ai_msg:
-                _fail_ai_message(
-                    ai_msg,
-                    conversation_id,
-                    text="Conversation history is too long. Please start a new chat."
-                )
-            cache.delete(f"ai_processing_lock:{conversation_id}:{user_id}")
-            return
+def complete_turn(ai_msg, conversation_id, ai_text, usage):
+    tokens_used = usage.total_tokens if usage else 0
 
-        logger.debug("ai_request_payload", message_count=len(messages_payload), current_tokens=current_tokens, conversation_id=conversation_id)
+    ai_msg.text = ai_text
+    ai_msg.token_count = usage.completion_tokens if usage else count_tokens(ai_text)
+    ai_msg.status = "completed"
+    ai_msg.save(update_fields=["text", "token_count", "status"])
+    _add_conversation_tokens(conversation_id, tokens_used)
 
-        response = client.chat.completions.create(
-            model=settings.OPENAI_MODEL,
-            messages=messages_payload,
-            max_tokens=1000,
+    send_ws_message(conversation_id, {
+        "id": ai_msg.id,
+        "text": ai_text,
+        "sender": "ai",
+        "is_ai": True,
+        "status": "completed",
+        "created_at": str(ai_msg.created_at),
+    })
+    return tokens_used
+
+
+def retry_turn(ai_msg):
+    ai_msg.status = "processing"
+    ai_msg.save(update_fields=["status"])
+
+
+def release_turn_lock(conversation_id, user_id):
+    cache.delete(f"ai_processing_lock:{conversation_id}:{user_id}")
+
+
+@shared_task(bind=True, max_retries=MAX_TURN_RETRIES, default_retry_delay=15)
+def generate_ai_response(self, conversation_id, user_text, user_id, is_new_chat=False, image_id=None, ai_msg_id=None):
+    ai_msg = None
+
+    logger.info(
+        "ai_task_started",
+        conversation_id=conversation_id,
+        user_id=user_id,
+        attempt=self.request.retries + 1,
+    )
+
+    try:
+        if not validate_input(user_text):
+            logger.warning("prompt_injection_detected", user_id=user_id, conversation_id=conversation_id)
+            send_chat_event(conversation_id, {"type": "chat_error", "message": INJECTION_REFUSAL})
+            return
+
+        client = get_openai_client()
+        turn = start_turn(
+            conversation_id, user_id, user_text, is_new_chat, first_attempt=self.request.retries == 0, ai_msg_id=ai_msg_id
         )
+        if turn is None:
+            return
+        conversation, ai_msg = turn
 
-        ai_text = response.choices[0].message.content
-        tokens_used = response.usage.total_tokens
-
-        ai_msg.text = ai_text
-        ai_msg.token_count = tokens_used
-        ai_msg.status = "completed"
-        ai_msg.save(update_fields=["text", "token_count", "status"])
-
-        send_ws_message(conversation_id, {
-            "id": ai_msg.id,
-            "text": ai_text,
-            "sender": "ai",
-            "is_ai": True,
-            "status": "completed",
-            "created_at": str(ai_msg.created_at),
-        })
+        messages_payload = build_messages_payload(conversation, ai_msg)
+
+        if settings.AI_STREAMING_ENABLED:
+            ai_text, usage = _stream_completion(client, conversation_id, ai_msg, messages_payload)
+        else:
+            response = client.chat.completions.create(
+                model=settings.OPENAI_MODEL,
+                messages=messages_payload,
+                max_tokens=MAX_REPLY_TOKENS,
+            )
+            ai_text = response.choices[0].message.content
+            usage = response.usage
+
+        tokens_used = complete_turn(ai_msg, conversation_id, ai_text, usage)
 
         logger.info(
             "ai_task_completed",
             conversation_id=conversation_id,
             tokens_used=tokens_used,
+            openai_pool=get_pool_stats()["pools"].get("default"),
         )
 
-    except (RateLimitError, APITimeoutError, APIConnectionError) as e:
+    except TRANSIENT_ERRORS as e:
         logger.warning(
             "ai_transient_error_retrying",
             error=str(e),
@@ -236,23 +378,20 @@ def generate_ai_response(self, conversation_id, user_text, user_id, is_new_chat=
 
         if self.request.retries >= self.max_retries:
             if ai_msg:
-                _fail_ai_message(
-                    ai_msg,
-                    conversation_id,
-                    text="AI service is temporarily unavailable. Please try again."
-                )
+                fail_ai_message(ai_msg, conversation_id, text=UNAVAILABLE_TEXT)
             return
 
+        kwargs = self.request.kwargs
         if ai_msg:
-            ai_msg.status = "processing"
-            ai_msg.save(update_fields=["status"])
+            retry_turn(ai_msg)
+            kwargs = {**kwargs, "ai_msg_id": ai_msg.id}
 
-        raise self.retry(exc=e, countdown=15 * (self.request.retries + 1))
+        raise self.retry(exc=e, countdown=retry_countdown(self.request.retries), kwargs=kwargs)
 
     except SoftTimeLimitExceeded:
         logger.error("ai_task_soft_timeout", conversation_id=conversation_id)
         if ai_msg:
-            _fail_ai_message(ai_msg, conversation_id, text="Request timed out. Please try again.")
+            fail_ai_message(ai_msg, conversation_id, text=TIMEOUT_TEXT)
 
     except Exception as e:
         logger.error(
@@ -263,7 +402,119 @@ def generate_ai_response(self, conversation_id, user_text, user_id, is_new_chat=
             exc_info=True,
         )
         if ai_msg:
-            _fail_ai_message(ai_msg, conversation_id)
+            fail_ai_message(ai_msg, conversation_id)
+
+    finally:
+        release_turn_lock(conversation_id, user_id)
+
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=30)
+def update_conversation_summary(self, conversation_id, before_id):
+    """Fold turns older than before_id into the conversation's rolling summary."""
+    lock_key = f"ai_summary_lock:{conversation_id}"
+    reschedule = False
+
+    try:
+        conversation = Conversation.objects.only(
+            "id", "summary", "summary_until_id"
+        ).get(id=conversation_id)
+
+        batch = list(
+            Message.objects.filter(
+                conversation_id=conversation_id,
+                id__gt=conversation.summary_until_id or 0,
+                id__lt=before_id,
+                status="completed",
+            )
+            .only("id", "sender", "text", "image")
+            .order_by("created_at", "id")[:SUMMARY_BATCH_SIZE]
+        )
+        if not batch:
+            return
+
+        transcript = []
+        for msg in batch:
+            role = "Rai" if msg.sender == "ai" else "User"
+            text = msg.text[:SUMMARY_MESSAGE_CHARS]
+            if msg.image:
+                text = f"[shared an image] {text}".strip()
+            if text:
+                transcript.append(f"{role}: {text}")
+
+        summary = conversation.summary
+        tokens_used = 0
+        if transcript:
+            response = get_openai_client().chat.completions.create(
+                model=settings.OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {
+                        "role": "user",
+                        "content": f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n" + "\n".join(transcript),
+                    },
+                ],
+                max_tokens=settings.AI_SUMMARY_MAX_TOKENS,
+            )
+            summary = response.choices[0].message.content.strip()
+            tokens_used = response.usage.total_tokens if response.usage else 0
+
+        Conversation.objects.filter(
+            id=conversation_id,
+            summary_until_id=conversation.summary_until_id,
+        ).update(
+            summary=summary,
+            summary_token_count=count_tokens(summary),
+            summary_until_id=batch[-1].id,
+            total_tokens_used=F("total_tokens_used") + tokens_used,
+        )
+        logger.info(
+            "conversation_summary_updated",
+            conversation_id=conversation_id,
+            summarized_until=batch[-1].id,
+            tokens_used=tokens_used,
+        )
+        reschedule = len(batch) == SUMMARY_BATCH_SIZE
+
+    except Conversation.DoesNotExist:
+        return
+
+    except TRANSIENT_ERRORS as e:
+        logger.warning("summary_transient_error", error=str(e), conversation_id=conversation_id)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+
+    except Exception as e:
+        logger.error("summary_generation_failed", error=str(e), conversation_id=conversation_id, exc_info=True)
 
     finally:
-        cache.delete(f"ai_processing_lock:{conversation_id}:{user_id}")
\ No newline at end of file
+        cache.delete(lock_key)
+
+    if reschedule:
+        _schedule_summary(conversation_id, before_id)
+
+
+@shared_task(ignore_result=True)
+def generate_conversation_title(conversation_id, user_text):
+    """Name a new conversation from its first prompt, alongside the main reply."""
+    try:
+        title_res = get_openai_client().chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": "Generate a short 3-word title based on the user prompt. Reply with only the title, no quotes."},
+                {"role": "user", "content": user_text[:100]},
+            ],
+            max_tokens=15,
+        )
+        title = title_res.choices[0].message.content.strip().replace('"', "")[:100]
+
+        conversation = Conversation.objects.get(id=conversation_id)
+        conversation.title = title
+        conversation.save(update_fields=["title", "updated_at"])
+        if title_res.usage:
+            _add_conversation_tokens(conversation_id, title_res.usage.total_tokens)
+
+        send_chat_event(conversation_id, {"type": "chat_title_update", "title": title})
+    except Conversation.DoesNotExist:
+        logger.warning("title_conversation_not_found", conversation_id=conversation_id)
+    except Exception as e:
+        logger.warning("title_generation_failed", error=str(e), conversation_id=conversation_id)
\ No newline at end of file
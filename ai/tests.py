@@ -1,3 +1,372 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import uuid
+from datetime import timedelta
+from unittest import mock
+import fakeredis
+import httpx
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from openai import APIConnectionError
+from PIL import Image
+from rest_framework.test import APIClient
+from Rai_Backend import replay
+from Rai_Backend.pagination import encode_cursor
+from . import engine, tasks
+from .clients import get_async_openai_client, get_pool_stats
+from .context import build_context
+from .models import Conversation, Message
+from .services import AIService
+from .tasks import TIMEOUT_TEXT, UNAVAILABLE_TEXT, DeltaBuffer, build_messages_payload, update_conversation_summary
+from .views import MessagePagination
+from .vision import image_content_part, prepare_upload
 
-                         
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+@mock.patch.object(MessagePagination, "page_size", 3)
+class MessagePaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(username="reader", password="x" * 12)
+        self.conversation = Conversation.objects.create(user=user)
+        self.url = f"/api/ai/conversations/{self.conversation.id}/messages/"
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+        # Ten messages over four timestamps, so most page boundaries fall inside a run of equal created_at.
+        now = timezone.now()
+        for i in range(10):
+            msg = Message.objects.create(conversation=self.conversation, sender="user", text=str(i))
+            Message.objects.filter(id=msg.id).update(created_at=now + timedelta(seconds=i // 3))
+        self.chronological = list(
+            Message.objects.filter(conversation=self.conversation).order_by("created_at", "id").values_list("id", flat=True)
+        )
+
+    def fetch(self, cursor=None):
+        body = self.client.get(self.url, {"cursor": cursor} if cursor else {}).json()
+        return [m["id"] for m in body["data"]], body["pagination"]
+
+    def test_pages_through_duplicate_timestamps(self):
+        pages, cursor = [], None
+        while True:
+            ids, pagination = self.fetch(cursor)
+            pages.append(ids)
+            cursor = pagination["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual([i for page in reversed(pages) for i in page], self.chronological)
+        for page in pages:
+            self.assertEqual(page, sorted(page, key=self.chronological.index))
+
+    def test_previous_cursor_returns_the_same_pages(self):
+        forward, cursor = [], None
+        while True:
+            ids, pagination = self.fetch(cursor)
+            forward.append((ids, pagination))
+            cursor = pagination["next_cursor"]
+            if cursor is None:
+                break
+
+        backward = [forward[-1][0]]
+        cursor = forward[-1][1]["previous_cursor"]
+        while cursor is not None:
+            ids, pagination = self.fetch(cursor)
+            backward.append(ids)
+            cursor = pagination["previous_cursor"]
+
+        self.assertEqual(backward, [ids for ids, _ in reversed(forward)])
+        self.assertIsNone(forward[0][1]["previous_cursor"])
+
+    def test_invalid_cursors_are_rejected(self):
+        first = Message.objects.get(id=self.chronological[0])
+        for cursor in [
+            "not-a-cursor",
+            encode_cursor([first.created_at]),
+            encode_cursor(["yesterday", first.id]),
+            encode_cursor([first.created_at, "abc"]),
+        ]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SubmitUserTurnTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username="chatter", password="x" * 12)
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.lock_key = f"ai_processing_lock:{self.conversation.id}:{self.user.id}"
+
+    def test_creates_new_chat(self):
+        msg, is_new_chat, error = AIService.submit_user_turn(self.user, None, "hello")
+        self.assertIsNone(error)
+        self.assertTrue(is_new_chat)
+        self.assertEqual(msg.text, "hello")
+        self.assertNotEqual(msg.conversation_id, self.conversation.id)
+        self.assertEqual(Conversation.objects.filter(user=self.user).count(), 2)
+        self.assertIsNotNone(cache.get(f"ai_processing_lock:{msg.conversation_id}:{self.user.id}"))
+
+    def test_existing_chat_is_not_new(self):
+        Message.objects.create(conversation=self.conversation, sender="user", text="earlier")
+        msg, is_new_chat, error = AIService.submit_user_turn(self.user, self.conversation.id, "again")
+        self.assertEqual((msg.conversation_id, is_new_chat, error), (self.conversation.id, False, None))
+
+    def test_unknown_conversation(self):
+        stranger = get_user_model().objects.create_user(username="stranger", email="s@example.com", password="x" * 12)
+        for user, conversation_id in [(self.user, uuid.uuid4()), (stranger, self.conversation.id)]:
+            with self.subTest(user=user.username):
+                self.assertEqual(AIService.submit_user_turn(user, conversation_id, "hi"), (None, False, "not_found"))
+
+    def test_rejects_turn_while_reply_is_processing(self):
+        Message.objects.create(conversation=self.conversation, sender="ai", status="processing")
+        self.assertIsNone(AIService.submit_user_turn(self.user, self.conversation.id, "first")[2])
+        self.assertEqual(AIService.submit_user_turn(self.user, self.conversation.id, "second"), (None, False, "ai_busy"))
+        self.assertEqual(Message.objects.filter(conversation=self.conversation, sender="user").count(), 1)
+
+    def test_stale_lock_is_cleared(self):
+        cache.set(self.lock_key, "true")
+        self.assertIsNone(AIService.submit_user_turn(self.user, self.conversation.id, "hi")[2])
+
+    def test_failed_transaction_releases_lock(self):
+        with self.assertRaises(ValueError):
+            AIService.submit_user_turn(self.user, self.conversation.id, "caption", image_id=10 ** 9)
+        self.assertIsNone(cache.get(self.lock_key))
+
+        with mock.patch.object(Conversation.objects, "filter", side_effect=[
+            Conversation.objects.filter(id=self.conversation.id),  # the state query
+            RuntimeError("database went away"),
+        ]):
+            with self.assertRaises(RuntimeError):
+                AIService.submit_user_turn(self.user, self.conversation.id, "hi")
+        self.assertIsNone(cache.get(self.lock_key))
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+
+class DeltaBufferTests(SimpleTestCase):
+    def test_flushes_at_most_once_per_interval(self):
+        buffer = DeltaBuffer(0.25)
+        with mock.patch("ai.tasks.time.monotonic", side_effect=[10.0, 10.1, 10.3, 10.4]):
+            flushed = [buffer.add(delta) for delta in ["a", "b", "c", "d"]]
+        self.assertEqual(flushed, ["a", None, "bc", None])
+        self.assertEqual(buffer.drain(), "d")
+        self.assertIsNone(buffer.drain())
+        self.assertEqual(buffer.text, "abcd")
+
+
+@override_settings(OPENAI_API_KEY="test")
+class AsyncClientTests(SimpleTestCase):
+    async def fetch(self):
+        return get_async_openai_client()
+
+    def test_each_event_loop_reports_its_own_pool(self):
+        loops = [asyncio.new_event_loop() for _ in range(2)]
+        try:
+            clients = [loop.run_until_complete(self.fetch()) for loop in loops]
+            self.assertIsNot(clients[0], clients[1])
+            self.assertIs(loops[0].run_until_complete(self.fetch()), clients[0])
+            pools = get_pool_stats()["pools"]
+            self.assertTrue({f"async:default:{id(loop)}" for loop in loops} <= set(pools))
+        finally:
+            for loop in loops:
+                loop.close()
+
+
+def completion(text):
+    return mock.Mock(
+        choices=[mock.Mock(message=mock.Mock(content=text))],
+        usage=mock.Mock(total_tokens=12, completion_tokens=4),
+    )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    AI_STREAMING_ENABLED=False,
+)
+class AsyncEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.create = mock.AsyncMock()
+        client = mock.Mock()
+        client.chat.completions.create = self.create
+        for patcher in [
+            mock.patch.object(replay, "get_redis_connection", lambda alias: redis),
+            mock.patch.object(replay, "_script", None),
+            mock.patch.object(engine, "get_async_openai_client", return_value=client),
+            mock.patch.object(engine, "retry_countdown", return_value=0),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(username="asker", password="x" * 12)
+        self.conversation = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=self.conversation, sender="user", text="hello")
+        self.lock_key = f"ai_processing_lock:{self.conversation.id}:{self.user.id}"
+        cache.set(self.lock_key, "true")
+
+    def run_turn(self):
+        return engine.generate_ai_response(str(self.conversation.id), "hello", self.user.id)
+
+    @database_sync_to_async
+    def replies(self):
+        return list(Message.objects.filter(conversation=self.conversation, sender="ai").values_list("status", "text"))
+
+    async def test_completes_turn(self):
+        self.create.return_value = completion("hi there")
+        await self.run_turn()
+        self.assertEqual(await self.replies(), [("completed", "hi there")])
+        self.assertIsNone(cache.get(self.lock_key))
+
+    async def test_retries_transient_error_once(self):
+        error = APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        self.create.side_effect = [error, completion("second try")]
+        await self.run_turn()
+        self.assertEqual(self.create.await_count, 2)
+        self.assertEqual(await self.replies(), [("completed", "second try")])
+
+    @override_settings(AI_ASYNC_TURN_TIMEOUT=0.05)
+    async def test_timeout_fails_placeholder(self):
+        async def slow(**kwargs):
+            await asyncio.sleep(1)
+
+        self.create.side_effect = slow
+        await self.run_turn()
+        self.assertEqual(await self.replies(), [("failed", TIMEOUT_TEXT)])
+        self.assertIsNone(cache.get(self.lock_key))
+
+    async def test_cancellation_fails_placeholder_and_reraises(self):
+        started = asyncio.Event()
+
+        async def hang(**kwargs):
+            started.set()
+            await asyncio.Event().wait()
+
+        self.create.side_effect = hang
+        task = asyncio.ensure_future(self.run_turn())
+        await asyncio.wait_for(started.wait(), 5)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(await self.replies(), [("failed", UNAVAILABLE_TEXT)])
+        self.assertIsNone(cache.get(self.lock_key))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    AI_CONTEXT_TOKEN_BUDGET=35,
+    AI_CONTEXT_MAX_MESSAGES=50,
+)
+class ContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(username="historian", password="x" * 12)
+        self.conversation = Conversation.objects.create(user=user)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender="user" if i % 2 else "ai", text=str(i), token_count=10)
+            for i in range(6)
+        ]
+        patcher = mock.patch.object(tasks, "_system_prompt_tokens", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_trims_to_token_budget(self):
+        selected, used, has_overflow = build_context(self.conversation)
+        self.assertEqual(selected, self.messages[-3:])
+        self.assertEqual(used, 30)
+        self.assertTrue(has_overflow)
+
+    def test_newest_message_is_kept_over_budget(self):
+        self.messages[-1].token_count = 100
+        self.messages[-1].save(update_fields=["token_count"])
+        self.assertEqual(build_context(self.conversation)[0], self.messages[-1:])
+
+    def test_summary_replaces_older_turns(self):
+        self.conversation.summary = "They talked about odds."
+        self.conversation.summary_token_count = 5
+        self.conversation.summary_until_id = self.messages[3].id
+        selected, used, has_overflow = build_context(self.conversation)
+        self.assertEqual(selected, self.messages[4:])
+        self.assertFalse(has_overflow)
+
+        payload = build_messages_payload(self.conversation, self.messages[-1])
+        self.assertEqual(payload[1], {"role": "system", "content": "Summary of the earlier conversation:\nThey talked about odds."})
+        self.assertEqual([m["content"] for m in payload[2:]], ["4"])
+
+    def test_summary_is_scheduled_only_on_overflow(self):
+        with mock.patch.object(update_conversation_summary, "delay") as delay:
+            with override_settings(AI_CONTEXT_TOKEN_BUDGET=1000):
+                build_messages_payload(self.conversation, self.messages[-1])
+            delay.assert_not_called()
+
+            build_messages_payload(self.conversation, self.messages[-1])
+            build_messages_payload(self.conversation, self.messages[-1])
+        # The placeholder is left out of the window, which starts at messages[2]; the second overflow finds
+        # the summary lock taken.
+        delay.assert_called_once_with(str(self.conversation.id), self.messages[2].id)
+
+    def test_summary_folds_turns_before_window(self):
+        client = mock.Mock()
+        client.chat.completions.create.return_value = mock.Mock(
+            choices=[mock.Mock(message=mock.Mock(content=" Rolling summary. "))],
+            usage=mock.Mock(total_tokens=40),
+        )
+        with mock.patch.object(tasks, "get_openai_client", return_value=client):
+            update_conversation_summary.apply(args=(str(self.conversation.id), self.messages[3].id))
+
+        transcript = client.chat.completions.create.call_args.kwargs["messages"][1]["content"]
+        self.assertIn("Rai: 0\nUser: 1\nRai: 2", transcript)
+        self.assertNotIn("User: 3", transcript)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "Rolling summary.")
+        self.assertEqual(self.conversation.summary_until_id, self.messages[2].id)
+        self.assertEqual(self.conversation.total_tokens_used, 40)
+
+
+def image_upload(size, mode="RGB", fmt="JPEG"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "red").save(buffer, format=fmt)
+    return SimpleUploadedFile(f"photo.{fmt.lower()}", buffer.getvalue())
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    AI_IMAGE_MAX_DIMENSION=512,
+    AI_VISION_USE_URLS=False,
+)
+class VisionTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_large_image_is_downscaled(self):
+        stored, digest = prepare_upload(image_upload((2048, 1024)))
+        data = stored.read()
+        self.assertTrue(stored.name.endswith(".jpg"))
+        self.assertEqual(digest, hashlib.sha256(data).hexdigest())
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.size, (512, 256))
+
+    def test_transparency_is_kept_as_png(self):
+        stored, _ = prepare_upload(image_upload((64, 64), mode="RGBA", fmt="PNG"))
+        self.assertTrue(stored.name.endswith(".png"))
+
+    def test_data_url_is_reused_for_same_image_hash(self):
+        def message(pk):
+            image = mock.Mock()
+            image.name = "chat_images/photo.png"
+            image.open.return_value = io.BytesIO(b"png-bytes")
+            return mock.Mock(id=pk, image_hash="abc123", image=image)
+
+        first, second = message(1), message(2)
+        part = image_content_part(first)
+        self.assertEqual(part["image_url"]["url"], "data:image/png;base64,cG5nLWJ5dGVz")
+        self.assertEqual(image_content_part(second), part)
+        second.image.open.assert_not_called()
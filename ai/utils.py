@@ -0,0 +1,22 @@
+import functools
+import structlog
+import tiktoken
+
+logger = structlog.get_logger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=ENCODING_NAME):
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    try:
+        return len(get_encoding().encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning("tiktoken_encoding_failed", error=str(e))
+        return len(text) // 4
\ No newline at end of file
@@ -4,25 +4,38 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from drf_spectacular.utils import extend_schema
 
+from Rai_Backend.cache import read_through
+from Rai_Backend.pagination import KeysetPagination
 from .serializers import (
     ConversationSerializer, MessageSerializer, 
     AudioTranscribeSerializer, ImageUploadSerializer
 )
 from .services import AIService
-from openai import OpenAI
+from .clients import get_openai_client
+from .vision import prepare_upload
 from django.conf import settings
 import os
 import tempfile
 
 logger = structlog.get_logger(__name__)
 
-class StandardPagination(PageNumberPagination):
+class StandardPagination(KeysetPagination):
     page_size = 20
     max_page_size = 100
 
+
+class MessagePagination(KeysetPagination):
+    """Newest page first; messages inside a page stay in chronological order."""
+    page_size = 20
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = super().paginate_queryset(queryset, request, view)
+        rows.reverse()
+        return rows
+
 @extend_schema(
     responses={200: ConversationSerializer(many=True)},
     summary="Get Conversations"
@@ -32,11 +45,15 @@ class StandardPagination(PageNumberPagination):
 @throttle_classes([ScopedRateThrottle])
 def get_conversations(request):
     """Fetch user's chat history list."""
-    conversations = AIService.get_user_conversations(request.user)
-    paginator = StandardPagination()
-    page = paginator.paginate_queryset(conversations, request)
-    serializer = ConversationSerializer(page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    def load_page():
+        conversations = AIService.get_user_conversations(request.user)
+        paginator = StandardPagination()
+        page = paginator.paginate_queryset(conversations, request)
+        serializer = ConversationSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data).data
+
+    data = read_through(f'user_conversations_{request.user.id}', request.build_absolute_uri(), load_page)
+    return Response(data)
 
 get_conversations.throttle_scope = 'conversation'
 
@@ -49,12 +66,16 @@ get_conversations.throttle_scope = 'conversation'
 @throttle_classes([ScopedRateThrottle])
 def get_messages(request, conversation_id):
     """Fetch messages inside a chat."""
-    try:
-        messages = AIService.get_messages(request.user, conversation_id)
-        paginator = StandardPagination()
+    def load_page():
+        paginator = MessagePagination()
         page = paginator.paginate_queryset(messages, request)
         serializer = MessageSerializer(page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(serializer.data).data
+
+    try:
+        messages = AIService.get_messages(request.user, conversation_id)
+        data = read_through(f'conversation_messages_{conversation_id}', request.build_absolute_uri(), load_page)
+        return Response(data)
     except Exception as e:
         logger.error("fetch_messages_error", error=str(e))
         return Response({"detail": "Conversation not found"}, status=404)
@@ -96,7 +117,7 @@ def transcribe_audio(request):
     audio_file = serializer.validated_data['audio']
     
     try:
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client(timeout=settings.OPENAI_TRANSCRIBE_TIMEOUT)
         
         filename = audio_file.name if hasattr(audio_file, 'name') and audio_file.name else 'audio.webm'
         if '.' not in filename or filename.split('.')[-1].lower() not in['mp3', 'wav', 'm4a', 'webm', 'aac', 'ogg', 'flac', 'mp4']:
@@ -138,11 +159,13 @@ def upload_chat_image(request):
     try:
         from .models import Conversation, Message
         conv = Conversation.objects.get(id=conversation_id, user=request.user, is_active=True)
+        image_file, image_hash = prepare_upload(serializer.validated_data['image'])
         message = Message.objects.create(
             conversation=conv,
             sender='user',
             text='',
-            image=serializer.validated_data['image']
+            image=image_file,
+            image_hash=image_hash,
         )
         
         url = message.image.url
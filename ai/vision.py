@@ -0,0 +1,69 @@
+import base64
+import hashlib
+import io
+import uuid
+import structlog
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+logger = structlog.get_logger(__name__)
+
+MIME_TYPES = {"jpeg": "image/jpeg", "jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+
+def prepare_upload(image_file):
+    """
+    Downscale and recompress an uploaded chat image once, so every later AI turn works with a small file.
+    Returns the file to store and the sha256 of its bytes.
+    """
+    try:
+        image_file.seek(0)
+        with Image.open(image_file) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((settings.AI_IMAGE_MAX_DIMENSION, settings.AI_IMAGE_MAX_DIMENSION))
+
+            buffer = io.BytesIO()
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                img.save(buffer, format="PNG", optimize=True)
+                ext = "png"
+            else:
+                img.convert("RGB").save(buffer, format="JPEG", quality=settings.AI_IMAGE_JPEG_QUALITY, optimize=True)
+                ext = "jpg"
+        data = buffer.getvalue()
+    except Exception as e:
+        logger.warning("vision_image_recompress_failed", error=str(e))
+        image_file.seek(0)
+        data = image_file.read()
+        name = getattr(image_file, "name", "") or ""
+        ext = name.rsplit(".", 1)[-1].lower() if "." in name else "jpg"
+
+    digest = hashlib.sha256(data).hexdigest()
+    return ContentFile(data, name=f"{uuid.uuid4().hex}.{ext}"), digest
+
+
+def _data_url_cache_key(msg):
+    if msg.image_hash:
+        return f"vision_data_url_{msg.image_hash}"
+    return f"vision_data_url_msg_{msg.id}"
+
+
+def image_content_part(msg):
+    """Build the image_url part for a message, reading and encoding the file at most once per cache period."""
+    if settings.AI_VISION_USE_URLS:
+        url = msg.image.url
+        if url.startswith("http"):
+            return {"type": "image_url", "image_url": {"url": url}}
+
+    key = _data_url_cache_key(msg)
+    data_url = cache.get(key)
+    if data_url is None:
+        ext = msg.image.name.rsplit(".", 1)[-1].lower() if "." in msg.image.name else "jpeg"
+        mime_type = MIME_TYPES.get(ext, "image/jpeg")
+        with msg.image.open("rb") as img_file:
+            encoded = base64.b64encode(img_file.read()).decode("utf-8")
+        data_url = f"data:{mime_type};base64,{encoded}"
+        cache.set(key, data_url, settings.AI_VISION_CACHE_TIMEOUT)
+
+    return {"type": "image_url", "image_url": {"url": data_url}}
\ No newline at end of file
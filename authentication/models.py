@@ -5,6 +5,7 @@ from django.utils import timezone
 from django.core.validators import RegexValidator
 from datetime import timedelta
 from rest_framework_simplejwt.tokens import RefreshToken
+from Rai_Backend.cache import register
 
 
 class OTP(models.Model):
@@ -134,4 +135,7 @@ class User(AbstractUser):
     @property
     def tokens(self):
         refresh = RefreshToken.for_user(self)
-        return {"refresh": str(refresh), "access": str(refresh.access_token)}
\ No newline at end of file
+        return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+
+register(User, 'user_profile_{id}', fields=['username', 'first_name', 'last_name', 'profile_picture'])
\ No newline at end of file
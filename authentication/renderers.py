@@ -28,13 +28,16 @@ class CustomJSONRenderer(JSONRenderer):
         }
 
         if success:
-            if isinstance(data, dict) and 'results' in data and 'count' in data:
+            if isinstance(data, dict) and 'results' in data and ('count' in data or 'next' in data):
                 response_data['data'] = data.pop('results')
                 response_data['pagination'] = {
                     'count': data.get('count'),
                     'next': data.get('next'),
                     'previous': data.get('previous')
                 }
+                if 'next_cursor' in data:
+                    response_data['pagination']['next_cursor'] = data.get('next_cursor')
+                    response_data['pagination']['previous_cursor'] = data.get('previous_cursor')
             else:
                 response_data['data'] = data
                 
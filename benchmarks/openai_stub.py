@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAI:
+    """
+    OpenAI-compatible /chat/completions endpoint on localhost. Replies with `tokens` canned tokens after
+    `latency` seconds, streamed one every `token_delay` seconds when the request asks for a stream.
+    """
+
+    def __init__(self, tokens=50, token_delay=0.01, latency=0.2):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.latency = latency
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.0"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                stub.requests += 1
+                time.sleep(stub.latency)
+                if body.get("stream"):
+                    stub.stream(self, body)
+                else:
+                    stub.complete(self, body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="openai-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _usage(self):
+        return {"prompt_tokens": 20, "completion_tokens": self.tokens, "total_tokens": 20 + self.tokens}
+
+    def complete(self, handler, body):
+        payload = json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(["token"] * self.tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(),
+        }).encode()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def stream(self, handler, body):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.end_headers()
+
+        def chunk(choices, usage=None):
+            data = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "bench"),
+                "choices": choices,
+            }
+            if usage:
+                data["usage"] = usage
+            handler.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+            handler.wfile.flush()
+
+        for _ in range(self.tokens):
+            chunk([{"index": 0, "delta": {"content": "token "}, "finish_reason": None}])
+            time.sleep(self.token_delay)
+        chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        chunk([], self._usage())
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
\ No newline at end of file
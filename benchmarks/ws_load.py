@@ -0,0 +1,332 @@
+"""
+WebSocket load harness for ChatConsumer and CommunityConsumer.
+
+    python -m benchmarks.ws_load --users 200 --communities 10 --messages 5 --ai-users 20
+
+Runs in-process against Rai_Backend.asgi.application on a throwaway test database (created and dropped
+like the test runner does, on the configured engine). The channel layer is in-memory unless --redis
+points the cache and channel layer at a Redis instance. OpenAI is replaced by benchmarks.openai_stub.
+Reports connect latency, end-to-end latency percentiles, fan-out throughput and queries per message.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from .openai_stub import StubOpenAI
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="community sockets to open")
+    parser.add_argument("--communities", type=int, default=5, help="users are spread round-robin across these")
+    parser.add_argument("--messages", type=int, default=5, help="messages each community user sends")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between one user's messages")
+    parser.add_argument("--ai-users", type=int, default=10, help="AI chat sockets to open")
+    parser.add_argument("--ai-turns", type=int, default=2, help="turns each AI user runs, one after another")
+    parser.add_argument("--concurrency", type=int, default=50, help="sockets connecting at the same time")
+    parser.add_argument("--tokens", type=int, default=50, help="tokens per stubbed AI reply")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="seconds between streamed tokens")
+    parser.add_argument("--ai-latency", type=float, default=0.1, help="stubbed time to first token")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for deliveries")
+    parser.add_argument("--redis", help="Redis URL for the cache and channel layer instead of in-memory")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep application logging on")
+    return parser.parse_args(argv)
+
+
+def configure(args, stub):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Rai_Backend.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("DEBUG", "True")
+
+    import django
+    from django.conf import settings
+    django.setup()
+    if not args.verbose:
+        # Per-message info/debug logging would dominate the numbers.
+        logging.disable(logging.WARNING)
+
+    if args.redis:
+        settings.CACHES["default"]["LOCATION"] = args.redis
+        settings.CACHES["default"]["KEY_PREFIX"] = "bench"
+        settings.CHANNEL_LAYERS = {
+            "default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [args.redis], "prefix": "bench"},
+            }
+        }
+    else:
+        settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "KEY_PREFIX": "bench"}}
+        settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+    settings.ALLOWED_HOSTS = ["*"]
+    settings.AI_GENERATION_MODE = "async"
+    settings.OPENAI_API_KEY = "bench"
+    settings.OPENAI_BASE_URL = stub.url
+    settings.OPENAI_HTTP2 = False
+
+    from Rai_Backend.celery import app
+    app.conf.task_always_eager = True
+
+
+class QueryCounter:
+    """Counts SQL statements on every connection, including those opened by database_sync_to_async threads."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        connection_created.connect(self._attach, weak=False)
+        for connection in connections.all():
+            self._attach(connection=connection)
+
+    def _attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    values = sorted(values)
+
+    def at(p):
+        return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000, 2)
+
+    return {"n": len(values), "p50_ms": at(50), "p95_ms": at(95), "p99_ms": at(99), "max_ms": at(100)}
+
+
+def create_fixtures(args):
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.tokens import AccessToken
+    from ai.models import Conversation, Message
+    from community.models import Community, Membership
+
+    User = get_user_model()
+    run = uuid.uuid4().hex[:8]
+    total = max(args.users, args.ai_users)
+    users = [User.objects.create(username=f"bench_{run}_{i}", email=f"bench_{run}_{i}@example.com") for i in range(total)]
+    communities = [Community.objects.create(name=f"bench {i}") for i in range(max(args.communities, 1))]
+    Membership.objects.bulk_create([
+        Membership(community=communities[i % len(communities)], user=user, role="member")
+        for i, user in enumerate(users[:args.users])
+    ])
+    conversations = [Conversation.objects.create(user=user, title="Benchmark") for user in users[:args.ai_users]]
+    # Seed one exchange so turns are not "new chat" and skip title generation, which runs on Celery.
+    Message.objects.bulk_create([
+        Message(conversation=conv, sender=sender, text="hello", status="completed")
+        for conv in conversations for sender in ("user", "ai")
+    ])
+
+    tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+    community_clients = [
+        (user.id, str(communities[i % len(communities)].id), tokens[user.id]) for i, user in enumerate(users[:args.users])
+    ]
+    chat_clients = [(user.id, str(conv.id), tokens[user.id]) for user, conv in zip(users, conversations)]
+    return community_clients, chat_clients
+
+
+class Client:
+    """One socket on the ASGI app. Frames are read straight off the output queue so reads never time out the app."""
+
+    def __init__(self, application, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        return connected
+
+    async def frame(self):
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message["type"] == "websocket.close":
+                raise ConnectionError("socket closed")
+            if message.get("text"):
+                return json.loads(message["text"])
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+async def connect_all(application, paths, concurrency, first_frame_type):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(path):
+        async with semaphore:
+            client = Client(application, path)
+            start = time.perf_counter()
+            if not await client.connect():
+                raise ConnectionError(f"connect rejected: {path}")
+            while (await client.frame())["type"] != first_frame_type:
+                pass
+            latencies.append(time.perf_counter() - start)
+            return client
+
+    clients = await asyncio.gather(*(one(path) for path in paths))
+    return clients, latencies
+
+
+async def run_community(args, application, counter, specs):
+    from community.buffer import get_message_buffer
+
+    members = {}
+    for _, community_id, _ in specs:
+        members[community_id] = members.get(community_id, 0) + 1
+
+    paths = [f"/ws/community/{community_id}/?token={token}" for _, community_id, token in specs]
+    clients, connect_latencies = await connect_all(application, paths, args.concurrency, "history")
+
+    sent = {}
+    latencies = []
+    expected = sum(members[community_id] * args.messages for _, community_id, _ in specs)
+    done = asyncio.Event()
+
+    async def read(client):
+        while True:
+            frame = await client.frame()
+            if frame.get("type") == "chat_message" and frame.get("client_id") in sent:
+                latencies.append(time.perf_counter() - sent[frame["client_id"]])
+                if len(latencies) >= expected:
+                    done.set()
+
+    for client in clients:
+        client.reader = asyncio.get_running_loop().create_task(read(client))
+
+    async def talk(client):
+        for _ in range(args.messages):
+            client_id = str(uuid.uuid4())
+            sent[client_id] = time.perf_counter()
+            await client.send({"message": "benchmark message", "client_id": client_id})
+            await asyncio.sleep(args.interval)
+
+    queries_before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(talk(client) for client in clients))
+    try:
+        await asyncio.wait_for(done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    await get_message_buffer().flush()
+    messages = len(sent)
+
+    for client in clients:
+        await client.close()
+
+    return {
+        "sockets": len(clients),
+        "connect": percentiles(connect_latencies),
+        "end_to_end": percentiles(latencies),
+        "messages": messages,
+        "deliveries": len(latencies),
+        "expected_deliveries": expected,
+        "fanout_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "queries_per_message": round((counter.count - queries_before) / messages, 2) if messages else None,
+    }
+
+
+async def run_chat(args, application, counter, specs):
+    paths = [f"/ws/chat/{conversation_id}/?token={token}" for _, conversation_id, token in specs]
+    clients, connect_latencies = await connect_all(application, paths, args.concurrency, "chat_history")
+
+    first_token, turn = [], []
+
+    async def converse(client):
+        for i in range(args.ai_turns):
+            start = time.perf_counter()
+            await client.send({"message": f"benchmark turn {i}"})
+            got_first = False
+            while True:
+                frame = await client.frame()
+                kind = frame.get("type")
+                if kind == "message_delta" and not got_first:
+                    first_token.append(time.perf_counter() - start)
+                    got_first = True
+                elif kind == "message_update" and frame["message"].get("status") in ("completed", "failed"):
+                    turn.append(time.perf_counter() - start)
+                    break
+                elif kind == "error":
+                    raise RuntimeError(frame.get("message"))
+
+    queries_before = counter.count
+    start = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(converse(client) for client in clients)), args.timeout)
+    elapsed = time.perf_counter() - start
+    turns = len(turn)
+
+    for client in clients:
+        await client.close()
+
+    return {
+        "sockets": len(clients),
+        "connect": percentiles(connect_latencies),
+        "first_token": percentiles(first_token),
+        "turn": percentiles(turn),
+        "turns_per_s": round(turns / elapsed, 1) if elapsed else None,
+        "queries_per_turn": round((counter.count - queries_before) / turns, 2) if turns else None,
+    }
+
+
+async def run(args, counter, community_specs, chat_specs):
+    from Rai_Backend.asgi import application
+    report = {}
+    if community_specs:
+        report["community"] = await run_community(args, application, counter, community_specs)
+    if chat_specs:
+        report["chat"] = await run_chat(args, application, counter, chat_specs)
+    return report
+
+
+def print_report(report):
+    for section, results in report.items():
+        print(f"[{section}]")
+        for key, value in results.items():
+            if isinstance(value, dict):
+                value = "  ".join(f"{k}={v}" for k, v in value.items())
+            print(f"  {key:<22} {value}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stub = StubOpenAI(tokens=args.tokens, token_delay=args.token_delay, latency=args.ai_latency).start()
+    configure(args, stub)
+
+    from django.test.utils import setup_databases, teardown_databases
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        community_specs, chat_specs = create_fixtures(args)
+        counter = QueryCounter()
+        counter.install()
+        report = asyncio.run(run(args, counter, community_specs, chat_specs))
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        stub.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import SportCategory, Match, Pick, UserParlay
+from .models import SportCategory, Match, Pick, UserParlay, OddsSyncState
 
 @admin.register(SportCategory)
 class SportCategoryAdmin(admin.ModelAdmin):
@@ -61,4 +61,12 @@ class UserParlayAdmin(admin.ModelAdmin):
     search_fields = ("user__username", "user__email")
     readonly_fields = ("id", "created_at")
     filter_horizontal = ("picks",)
-    ordering = ("-created_at",)
\ No newline at end of file
+    ordering = ("-created_at",)
+
+@admin.register(OddsSyncState)
+class OddsSyncStateAdmin(admin.ModelAdmin):
+    list_display = ("sport_key", "title", "active", "interval", "next_sync_at", "last_synced_at", "requests_remaining")
+    list_filter = ("active",)
+    search_fields = ("sport_key", "title")
+    readonly_fields = ("etag", "last_modified", "cursor", "last_synced_at", "requests_remaining", "requests_used")
+    ordering = ("next_sync_at",)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import itertools
+import ijson
+import requests
+from django.conf import settings
+
+class OddsFeedError(Exception):
+    pass
+
+
+def sports_url():
+    return f"{settings.ODDS_API_BASE_URL}/sports/?apiKey={settings.THE_ODDS_API_KEY}"
+
+
+def odds_url(sport="upcoming", **params):
+    query = {"regions": "us", "markets": "h2h", "oddsFormat": "american", "apiKey": settings.THE_ODDS_API_KEY, **params}
+    return f"{settings.ODDS_API_BASE_URL}/sports/{sport}/odds/?" + "&".join(f"{k}={v}" for k, v in query.items() if v is not None)
+
+
+def iter_games(response):
+    """
+    Yield the games of an odds response one at a time. The body is parsed incrementally from the
+    socket, so memory stays at one game plus the read buffer however large the feed is.
+    """
+    response.raw.decode_content = True
+    yield from ijson.items(response.raw, "item", use_float=True)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def error_message(response):
+    try:
+        message = response.json().get("message")
+    except ValueError:
+        message = None
+    return message or f"HTTP {response.status_code}"
+
+
+def open_feed(url, etag="", last_modified="", timeout=10):
+    """
+    Open a streamed odds response, sending the validators of the previous fetch so an unchanged feed
+    comes back as an empty 304. Raises OddsFeedError on any other non-200 status.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    response = requests.get(url, headers=headers, timeout=timeout, stream=True)
+    if response.status_code not in (200, 304):
+        try:
+            raise OddsFeedError(error_message(response))
+        finally:
+            response.close()
+    return response
+
+
+def quota(response):
+    """Request credits left and used as reported by the x-requests-* headers, None when absent."""
+    def header(name):
+        try:
+            return int(float(response.headers[name]))
+        except (KeyError, ValueError):
+            return None
+    return {"remaining": header("x-requests-remaining"), "used": header("x-requests-used")}
+
+
+def fetch_sports(timeout=10):
+    """The sports currently listed by the API. This endpoint does not count against the quota."""
+    response = requests.get(sports_url(), timeout=timeout)
+    if response.status_code != 200:
+        raise OddsFeedError(error_message(response))
+    return response.json()
\ No newline at end of file
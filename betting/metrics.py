@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def american_to_decimal(odds):
+    odds = np.asarray(odds, dtype=float)
+    return np.where(odds > 0, odds / 100 + 1, 100 / np.abs(odds) + 1)
+
+
+def compute(odds, market, outcome):
+    """
+    Metrics for a flat batch of prices in one vectorized pass. `odds` holds American prices, `market`
+    the index of the (game, bookmaker) market each price belongs to and `outcome` the index of its
+    (game, outcome). Returns per-price arrays, probabilities as fractions:
+
+    implied      1 / decimal odds, vig included
+    fair         implied normalized over its market, i.e. the book's no-vig probability
+    consensus    mean fair probability of the outcome across every book quoting it
+    edge         consensus - implied, in percentage points
+    ev           expected return of a 1-unit stake at this price, in percent
+    """
+    decimal = american_to_decimal(odds)
+    implied = 1 / decimal
+    fair = implied / np.bincount(market, weights=implied)[market]
+    consensus = (np.bincount(outcome, weights=fair) / np.bincount(outcome))[outcome]
+    return {
+        'implied': implied,
+        'fair': fair,
+        'consensus': consensus,
+        'edge': (consensus - implied) * 100,
+        'ev': (consensus * decimal - 1) * 100,
+    }
+
+
+def valid_price(price):
+    return isinstance(price, (int, float)) and abs(price) >= 100
+
+
+def price_games(games, select_bookmaker, market_key='h2h'):
+    """
+    Price the selected bookmaker's outcomes of each game against the consensus of every bookmaker in
+    the feed. Returns one list per game of (outcome name, odds, metrics) tuples, empty when the game has
+    no usable market from the selected bookmaker.
+    """
+    odds, market, outcome, selected = [], [], [], []
+    markets, outcomes = 0, {}
+    for index, game in enumerate(games):
+        chosen = select_bookmaker(game)
+        for bookmaker in game.get('bookmakers') or []:
+            for entry in bookmaker.get('markets', []):
+                prices = [o for o in entry.get('outcomes', []) if valid_price(o.get('price'))]
+                if entry.get('key', market_key) != market_key or len(prices) < 2:
+                    continue
+                for o in prices:
+                    if bookmaker is chosen:
+                        selected.append((index, o['name'], len(odds)))
+                    odds.append(o['price'])
+                    market.append(markets)
+                    outcome.append(outcomes.setdefault((index, o['name']), len(outcomes)))
+                markets += 1
+
+    priced = [[] for _ in games]
+    if not selected:
+        return priced
+
+    metrics = compute(np.array(odds, dtype=float), np.array(market), np.array(outcome))
+    rows = np.array([row for _, _, row in selected])
+    confidence = np.floor(metrics['consensus'][rows] * 100).astype(int).tolist()
+    edge = np.round(metrics['edge'][rows], 2).tolist()
+    ev = np.round(metrics['ev'][rows], 2).tolist()
+    for i, (index, name, row) in enumerate(selected):
+        priced[index].append((name, odds[row], {'confidence': confidence[i], 'edge': edge[i], 'ev': ev[i]}))
+    return priced
\ No newline at end of file
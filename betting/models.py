@@ -1,7 +1,8 @@
 import uuid
 from django.db import models
 from django.conf import settings
-from django.core.cache import cache
+from django.utils import timezone
+from Rai_Backend.cache import CacheInvalidatingQuerySet, register
 
 class SportCategory(models.Model):
     name = models.CharField(max_length=50, unique=True)
@@ -19,23 +20,18 @@ class Match(models.Model):
     away_team_logo = models.URLField(blank=True, null=True)
     start_time = models.DateTimeField(db_index=True)
     is_active = models.BooleanField(default=True, db_index=True)
-    
+
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         ordering =['start_time']
         indexes = [
             models.Index(fields=['is_active', 'start_time']),
             models.Index(fields=['sport', 'is_active']),
         ]
-
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete('active_matches')
-        cache.delete(f'match_{self.id}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete('active_matches')
-        cache.delete(f'match_{self.id}')
-        super().delete(*args, **kwargs)
+        constraints = [
+            models.UniqueConstraint(fields=['sport', 'home_team', 'away_team', 'start_time'], name='unique_match_fixture'),
+        ]
 
 class Pick(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -54,23 +50,28 @@ class Pick(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=['match', 'pick_type']),
             models.Index(fields=['is_pick_of_the_day', '-created_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['match', 'pick_type', 'team_selected'], name='unique_pick_outcome'),
+        ]
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'match_picks_{self.match_id}')
-        if self.is_pick_of_the_day:
-            cache.delete('picks_of_the_day')
+class OddsSnapshot(models.Model):
+    """Append-only price history of a pick. Rows are written only when the price moves."""
+    pick = models.ForeignKey(Pick, on_delete=models.CASCADE, related_name="snapshots")
+    odds_american = models.IntegerField()
+    recorded_at = models.DateTimeField(default=timezone.now)
 
-    def delete(self, *args, **kwargs):
-        cache.delete(f'match_picks_{self.match_id}')
-        if self.is_pick_of_the_day:
-            cache.delete('picks_of_the_day')
-        super().delete(*args, **kwargs)
+    class Meta:
+        indexes = [
+            models.Index(fields=['pick', 'recorded_at']),
+            models.Index(fields=['recorded_at']),
+        ]
 
 class UserParlay(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -82,35 +83,56 @@ class UserParlay(models.Model):
     is_tracked = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['user', 'is_tracked']),
         ]
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'user_parlays_{self.user_id}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete(f'user_parlays_{self.user_id}')
-        super().delete(*args, **kwargs)
-
 class SavedPick(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="saved_picks")
     pick = models.ForeignKey(Pick, on_delete=models.CASCADE, related_name="saved_by")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'pick')
         indexes = [
             models.Index(fields=['user', '-created_at']),
         ]
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'user_saved_picks_{self.user_id}')
 
-    def delete(self, *args, **kwargs):
-        cache.delete(f'user_saved_picks_{self.user_id}')
-        super().delete(*args, **kwargs)
\ No newline at end of file
+class OddsSyncState(models.Model):
+    """
+    Per-sport fetch schedule, HTTP validators and update cursor for the odds feed. The cursor maps each
+    ingested event id to the bookmaker update it was ingested at.
+    """
+    sport_key = models.CharField(max_length=100, unique=True)
+    title = models.CharField(max_length=100, blank=True)
+    active = models.BooleanField(default=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    cursor = models.JSONField(default=dict, blank=True)
+    interval = models.PositiveIntegerField(default=0)
+    next_sync_at = models.DateTimeField(default=timezone.now)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    requests_remaining = models.IntegerField(null=True, blank=True)
+    requests_used = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'next_sync_at']),
+        ]
+
+    def __str__(self):
+        return self.sport_key
+
+
+register(Match, 'active_matches', 'match_{id}')
+register(Pick, 'match_picks_{match_id}')
+register(Pick, 'picks_of_the_day', fields=['is_pick_of_the_day'], when=lambda pick: pick.is_pick_of_the_day)
+register(UserParlay, 'user_parlays_{user_id}')
+register(SavedPick, 'user_saved_picks_{user_id}')
\ No newline at end of file
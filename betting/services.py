@@ -1,7 +1,14 @@
+from datetime import timedelta
 import structlog
+from django.conf import settings
 from django.db import transaction
-from .models import UserParlay, Pick
-from .utils import calculate_metrics
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .feed import batched, fetch_sports, iter_games, odds_url, open_feed, quota
+from .models import Match, OddsSnapshot, OddsSyncState, SportCategory, UserParlay, Pick
+from .metrics import price_games
+from .utils import calculate_implied_probability
 
 logger = structlog.get_logger(__name__)
 
@@ -20,4 +27,384 @@ class BettingService:
             parlay.save(update_fields=['overall_confidence'])
             
         logger.info("parlay_created", user_id=user.id, parlay_id=str(parlay.id))
-        return parlay, "Parlay built successfully."
\ No newline at end of file
+        return parlay, "Parlay built successfully."
+
+
+class OddsIngestionService:
+    """
+    Bulk upsert of odds-feed games. A batch costs a fixed handful of queries: sports and matches are
+    loaded by natural key, picks are diffed against what is stored, and only new or changed outcomes
+    are written, in one upsert.
+    """
+    PICK_TYPE = 'Moneyline'
+    PICK_FIELDS = ('odds_american', 'confidence_percentage', 'edge_percentage', 'ev_percentage')
+    EMPTY_STATS = {
+        'games': 0, 'matches_created': 0, 'picks_created': 0, 'picks_updated': 0, 'picks_unchanged': 0, 'snapshots': 0,
+    }
+
+    @staticmethod
+    def select_bookmaker(game):
+        """DraftKings when the game has it, otherwise the first bookmaker in the feed."""
+        bookmakers = game.get('bookmakers') or []
+        for bookie in bookmakers:
+            if bookie['key'] == 'draftkings':
+                return bookie
+        return bookmakers[0] if bookmakers else None
+
+    @staticmethod
+    def match_key(sport_id, home_team, away_team, start_time):
+        return (sport_id, home_team, away_team, start_time)
+
+    @staticmethod
+    def load_sports(names):
+        sports = {s.name: s for s in SportCategory.objects.filter(name__in=names)}
+        missing = set(names) - set(sports)
+        if missing:
+            SportCategory.objects.bulk_create([SportCategory(name=n) for n in missing], ignore_conflicts=True)
+            sports.update({s.name: s for s in SportCategory.objects.filter(name__in=missing)})
+        return sports
+
+    @staticmethod
+    def load_matches(games, sports):
+        """Map each game's natural key to its Match, creating the missing ones in one insert."""
+        wanted = {}
+        for game in games:
+            key = OddsIngestionService.match_key(
+                sports[game['sport_key']].id, game['home_team'], game['away_team'], parse_datetime(game['commence_time'])
+            )
+            wanted[key] = game
+
+        existing = Match.objects.filter(
+            sport_id__in={k[0] for k in wanted},
+            home_team__in={k[1] for k in wanted},
+            start_time__in={k[3] for k in wanted},
+        )
+        matches = {}
+        for match in existing:
+            key = OddsIngestionService.match_key(match.sport_id, match.home_team, match.away_team, match.start_time)
+            if key in wanted:
+                matches[key] = match
+
+        missing = [
+            Match(sport_id=k[0], home_team=k[1], away_team=k[2], start_time=k[3])
+            for k in wanted if k not in matches
+        ]
+        if missing:
+            Match.objects.bulk_create(missing, ignore_conflicts=True)
+            # Reload rather than trust the instances: on a conflict the stored row keeps its own id.
+            for match in Match.objects.filter(
+                sport_id__in={m.sport_id for m in missing},
+                home_team__in={m.home_team for m in missing},
+                start_time__in={m.start_time for m in missing},
+            ):
+                key = OddsIngestionService.match_key(match.sport_id, match.home_team, match.away_team, match.start_time)
+                if key in wanted:
+                    matches[key] = match
+        return matches, len(missing)
+
+    @staticmethod
+    def build_picks(games, sports, matches):
+        """
+        One unsaved Pick per outcome of each game's selected bookmaker, keyed by (match id, team). Metrics
+        for the whole batch are computed in one pass against the consensus of every bookmaker.
+        """
+        picks = {}
+        priced = price_games(games, OddsIngestionService.select_bookmaker)
+        for game, outcomes in zip(games, priced):
+            if not outcomes:
+                continue
+            match = matches[OddsIngestionService.match_key(
+                sports[game['sport_key']].id, game['home_team'], game['away_team'], parse_datetime(game['commence_time'])
+            )]
+            for name, odds, metrics in outcomes:
+                picks[(match.id, name)] = Pick(
+                    match=match,
+                    team_selected=name,
+                    pick_type=OddsIngestionService.PICK_TYPE,
+                    odds_american=odds,
+                    confidence_percentage=metrics['confidence'],
+                    edge_percentage=metrics['edge'],
+                    ev_percentage=metrics['ev'],
+                )
+        return picks
+
+    @staticmethod
+    def diff_picks(picks):
+        """
+        Split built picks into new and changed ones, dropping outcomes whose stored values are identical.
+        Changed picks take the stored id; `moved` is the subset of them whose price itself changed.
+        """
+        stored = {
+            (row['match_id'], row['team_selected']): row
+            for row in Pick.objects.filter(
+                match_id__in={k[0] for k in picks}, pick_type=OddsIngestionService.PICK_TYPE
+            ).values('id', 'match_id', 'team_selected', *OddsIngestionService.PICK_FIELDS)
+        }
+        created, changed, moved = [], [], []
+        for key, pick in picks.items():
+            current = stored.get(key)
+            if current is None:
+                created.append(pick)
+            elif any(current[f] != getattr(pick, f) for f in OddsIngestionService.PICK_FIELDS):
+                pick.id = current['id']
+                changed.append(pick)
+                if current['odds_american'] != pick.odds_american:
+                    moved.append(pick)
+        return created, changed, moved
+
+    @staticmethod
+    def ingest(games):
+        """Persist one batch of feed games. Returns counts for logging."""
+        games = [g for g in games if g.get('sport_key') and g.get('commence_time')]
+        if not games:
+            return dict(OddsIngestionService.EMPTY_STATS)
+
+        with transaction.atomic():
+            sports = OddsIngestionService.load_sports({g['sport_key'] for g in games})
+            matches, matches_created = OddsIngestionService.load_matches(games, sports)
+            picks = OddsIngestionService.build_picks(games, sports, matches)
+            created, changed, moved = OddsIngestionService.diff_picks(picks)
+
+            if created or changed:
+                Pick.objects.bulk_create(
+                    created + changed,
+                    update_conflicts=True,
+                    unique_fields=['match', 'pick_type', 'team_selected'],
+                    update_fields=[*OddsIngestionService.PICK_FIELDS, 'updated_at'],
+                )
+                OddsHistoryService.record(created + moved)
+
+        return {
+            'games': len(games),
+            'matches_created': matches_created,
+            'picks_created': len(created),
+            'picks_updated': len(changed),
+            'picks_unchanged': len(picks) - len(created) - len(changed),
+            'snapshots': len(created) + len(moved),
+        }
+
+
+class OddsHistoryService:
+    """
+    Line history for picks. A snapshot is written only when a pick is first seen or its price moves,
+    so a pick's series is its opening line followed by one row per move.
+    """
+
+    @staticmethod
+    def record(picks, recorded_at=None):
+        recorded_at = recorded_at or timezone.now()
+        OddsSnapshot.objects.bulk_create([
+            OddsSnapshot(pick_id=pick.id, odds_american=pick.odds_american, recorded_at=recorded_at)
+            for pick in picks
+        ])
+
+    @staticmethod
+    def point(odds_american, recorded_at):
+        return {
+            'recorded_at': recorded_at,
+            'odds_american': odds_american,
+            'implied_probability': round(calculate_implied_probability(odds_american), 2),
+        }
+
+    @staticmethod
+    def downsample(rows, points):
+        """
+        Reduce a time-ordered (recorded_at, odds) series to at most `points` rows by splitting its span
+        into equal buckets and keeping the last price of each. The line is a step function, so the last
+        price is what was on offer at the end of the bucket; the opening and closing rows always survive.
+        """
+        if len(rows) <= points:
+            return rows
+        start, end = rows[0][0], rows[-1][0]
+        width = (end - start) / (points - 1)
+        if not width:
+            return [rows[0], rows[-1]]
+
+        buckets = {}
+        for row in rows[1:]:
+            buckets[min(int((row[0] - start) / width), points - 2)] = row
+        return [rows[0], *(buckets[b] for b in sorted(buckets))]
+
+    @staticmethod
+    def line_movement(pick, points):
+        rows = list(pick.snapshots.order_by('recorded_at', 'id').values_list('recorded_at', 'odds_american'))
+        if not rows:
+            rows = [(pick.created_at, pick.odds_american)]
+        opening, current = rows[0], rows[-1]
+        return {
+            'pick_id': pick.id,
+            'moves': len(rows) - 1,
+            'opening': OddsHistoryService.point(opening[1], opening[0]),
+            'current': OddsHistoryService.point(current[1], current[0]),
+            'implied_probability_change': round(
+                calculate_implied_probability(current[1]) - calculate_implied_probability(opening[1]), 2
+            ),
+            'series': [OddsHistoryService.point(odds, at) for at, odds in OddsHistoryService.downsample(rows, points)],
+        }
+
+    @staticmethod
+    def prune(before, batch_size):
+        """Delete snapshots recorded before `before` in id batches, so no single statement locks the table for long."""
+        deleted = 0
+        while True:
+            ids = list(OddsSnapshot.objects.filter(recorded_at__lt=before).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += OddsSnapshot.objects.filter(id__in=ids).delete()[0]
+
+
+class OddsSyncService:
+    """
+    Per-sport odds scheduling. Each sport is fetched on its own interval, picked from how close its
+    nearest game is, with the previous response's validators so an unchanged feed costs no parsing, and
+    with a per-event update cursor so only events whose bookmakers moved since the last sync are ingested.
+    """
+    @staticmethod
+    def refresh_sports():
+        """Mirror the API's in-season head-to-head sports into OddsSyncState rows."""
+        wanted = set(settings.ODDS_SPORTS)
+        active = {
+            sport['key']: sport.get('title', '')
+            for sport in fetch_sports()
+            if sport.get('active') and not sport.get('has_outrights') and (not wanted or sport['key'] in wanted)
+        }
+        OddsSyncState.objects.bulk_create(
+            [OddsSyncState(sport_key=key, title=title) for key, title in active.items()], ignore_conflicts=True
+        )
+        OddsSyncState.objects.filter(sport_key__in=active, active=False).update(active=True)
+        OddsSyncState.objects.exclude(sport_key__in=active).filter(active=True).update(active=False)
+        return len(active)
+
+    @staticmethod
+    def quota_remaining():
+        """Credits left as of the most recent fetch, None before the first one."""
+        return OddsSyncState.objects.filter(requests_remaining__isnull=False).order_by(
+            '-last_synced_at'
+        ).values_list('requests_remaining', flat=True).first()
+
+    @staticmethod
+    def claim_due(now):
+        """
+        Sport keys whose interval has elapsed, each leased for ODDS_SYNC_LEASE seconds so a slow fetch is
+        not dispatched twice. Below ODDS_API_QUOTA_FLOOR only sports on the live interval are claimed.
+        """
+        due = OddsSyncState.objects.filter(active=True, next_sync_at__lte=now)
+        remaining = OddsSyncService.quota_remaining()
+        if remaining is not None and remaining <= settings.ODDS_API_QUOTA_FLOOR:
+            logger.warning("odds_quota_low", remaining=remaining)
+            due = due.filter(interval__lte=settings.ODDS_SYNC_INTERVAL_LIVE)
+
+        claimed = []
+        lease = now + timedelta(seconds=settings.ODDS_SYNC_LEASE)
+        for state in due.only('id', 'sport_key', 'next_sync_at'):
+            if OddsSyncState.objects.filter(id=state.id, next_sync_at=state.next_sync_at).update(next_sync_at=lease):
+                claimed.append(state.sport_key)
+        return claimed
+
+    @staticmethod
+    def next_interval(sport_key, now):
+        """Seconds until the sport is due again, from its nearest game that is upcoming or still in play."""
+        soonest = Match.objects.filter(
+            sport__name=sport_key,
+            is_active=True,
+            start_time__gte=now - timedelta(seconds=settings.ODDS_SYNC_LIVE_WINDOW),
+        ).aggregate(soonest=Min('start_time'))['soonest']
+        if soonest is None:
+            return settings.ODDS_SYNC_INTERVAL_EMPTY
+
+        lead = (soonest - now).total_seconds()
+        if lead <= settings.ODDS_SYNC_LIVE_LEAD:
+            return settings.ODDS_SYNC_INTERVAL_LIVE
+        if lead <= settings.ODDS_SYNC_SOON_LEAD:
+            return settings.ODDS_SYNC_INTERVAL_SOON
+        return settings.ODDS_SYNC_INTERVAL_IDLE
+
+    @staticmethod
+    def event_updated_at(game):
+        stamps = [parse_datetime(b['last_update']) for b in game.get('bookmakers') or [] if b.get('last_update')]
+        return max(stamps) if stamps else None
+
+    @staticmethod
+    def event_key(game):
+        return game.get('id') or '|'.join(str(game.get(k)) for k in ('sport_key', 'home_team', 'away_team', 'commence_time'))
+
+    @staticmethod
+    def changed_games(games, cursor, current, stats):
+        """
+        Yield the games worth ingesting: those without bookmaker timestamps and those not ingested at their
+        latest update yet, i.e. absent from `cursor` (new fixtures, or ones cut off by ODDS_SYNC_MAX_GAMES
+        last time) or updated since. Every timestamped game's update is recorded in `current`; skipped
+        games are counted in stats['events_skipped'].
+        """
+        for game in games:
+            updated = OddsSyncService.event_updated_at(game)
+            if updated is None:
+                yield game
+                continue
+            key = OddsSyncService.event_key(game)
+            current[key] = updated.isoformat()
+            seen = parse_datetime(cursor[key]) if key in cursor else None
+            if seen is not None and seen >= updated:
+                stats['events_skipped'] += 1
+            else:
+                yield game
+
+    @staticmethod
+    def reschedule(state, now):
+        """Push a failed sport to its usual interval instead of leaving it leased."""
+        interval = state.interval or settings.ODDS_SYNC_INTERVAL_LIVE
+        OddsSyncState.objects.filter(id=state.id).update(next_sync_at=now + timedelta(seconds=interval))
+
+    @staticmethod
+    def sync_sport(state):
+        """
+        Fetch and ingest one sport, then record its validators, cursor, quota and next due time. At most
+        ODDS_SYNC_MAX_GAMES changed games are ingested per run; when the cap cuts the feed short only the
+        ingested games enter the cursor and the validators are dropped, so the next run picks up the rest.
+        """
+        now = timezone.now()
+        stats = {
+            **OddsIngestionService.EMPTY_STATS, 'events_skipped': 0, 'not_modified': False, 'truncated': False,
+        }
+        cursor = state.cursor or {}
+
+        with open_feed(odds_url(state.sport_key), etag=state.etag, last_modified=state.last_modified) as response:
+            credits = quota(response)
+            if response.status_code == 304:
+                stats['not_modified'] = True
+            else:
+                current, ingested, leftover = {}, [], []
+                games = OddsSyncService.changed_games(iter_games(response), cursor, current, stats)
+                for batch in batched(games, settings.ODDS_SYNC_BATCH_SIZE):
+                    room = settings.ODDS_SYNC_MAX_GAMES - stats['games']
+                    batch, leftover = batch[:room], batch[room:]
+                    if batch:
+                        for key, value in OddsIngestionService.ingest(batch).items():
+                            stats[key] += value
+                        ingested += map(OddsSyncService.event_key, batch)
+                    if leftover:
+                        break
+
+                if leftover:
+                    stats['truncated'] = True
+                    cursor = {**cursor, **{key: current[key] for key in ingested if key in current}}
+                    state.etag, state.last_modified = '', ''
+                    logger.warning("odds_sync_truncated", sport=state.sport_key, limit=settings.ODDS_SYNC_MAX_GAMES)
+                else:
+                    cursor = current
+                    state.etag = response.headers.get('ETag', '')
+                    state.last_modified = response.headers.get('Last-Modified', '')
+
+        state.cursor = cursor
+        if credits['remaining'] is not None:
+            state.requests_remaining = credits['remaining']
+        if credits['used'] is not None:
+            state.requests_used = credits['used']
+        state.interval = OddsSyncService.next_interval(state.sport_key, now)
+        state.last_synced_at = now
+        state.next_sync_at = now + timedelta(seconds=state.interval)
+        state.save(update_fields=[
+            'etag', 'last_modified', 'cursor', 'requests_remaining', 'requests_used',
+            'interval', 'last_synced_at', 'next_sync_at',
+        ])
+        return {**stats, 'interval': state.interval, 'requests_remaining': state.requests_remaining}
\ No newline at end of file
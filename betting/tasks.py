@@ -1,69 +1,59 @@
 # betting/tasks.py
+from datetime import timedelta
 import structlog
-import requests
 from celery import shared_task
 from django.conf import settings
-from .models import Match, Pick, SportCategory
-from .utils import calculate_metrics
+from django.core.cache import cache
+from django.utils import timezone
+from .feed import OddsFeedError
+from .models import OddsSyncState
+from .services import OddsHistoryService, OddsSyncService
+from Rai_Backend.cache import deferred_invalidation
 
 logger = structlog.get_logger(__name__)
 
+SPORTS_REFRESH_KEY = "odds_sports_refreshed"
+
+
 @shared_task
 def sync_odds_data():
-    logger.info("sync_odds_started")
-    api_key = getattr(settings, 'THE_ODDS_API_KEY', 'your_api_key_here')
-    
-    # CHANGED: 'h2h' (Moneyline) is always available, unlike spreads.
-    url = f"https://api.the-odds-api.com/v4/sports/upcoming/odds/?regions=us&markets=h2h&oddsFormat=american&apiKey={api_key}"
-    
-    try:
-        response = requests.get(url, timeout=10)
-        data = response.json()
-        
-        # Check if the API returned an error message
-        if isinstance(data, dict) and "message" in data:
-            logger.error("odds_api_error_message", message=data["message"])
-            return
+    """Beat entry point: refresh the sport list when it is stale and dispatch every sport that is due."""
+    if cache.add(SPORTS_REFRESH_KEY, "1", settings.ODDS_SPORTS_REFRESH_INTERVAL):
+        try:
+            sports = OddsSyncService.refresh_sports()
+            logger.info("odds_sports_refreshed", sports=sports)
+        except Exception as e:
+            cache.delete(SPORTS_REFRESH_KEY)
+            logger.error("odds_sports_refresh_failed", error=str(e))
 
-        for game in data[:1000]:
-            sport, _ = SportCategory.objects.get_or_create(name=game['sport_key'])
-            match, _ = Match.objects.get_or_create(
-                sport=sport,
-                home_team=game['home_team'],
-                away_team=game['away_team'],
-                start_time=game['commence_time']
-            )
-            
-            bookmakers = game.get('bookmakers', [])
-            if not bookmakers:
-                continue
-                
-            # FALLBACK SYSTEM: Look for DraftKings. If not found, use the first bookmaker available!
-            selected_bookmaker = None
-            for bookie in bookmakers:
-                if bookie['key'] == 'draftkings':
-                    selected_bookmaker = bookie
-                    break
-            
-            if not selected_bookmaker:
-                selected_bookmaker = bookmakers[0] # Grab whatever bookie is there
-                
-            for market in selected_bookmaker.get('markets', []):
-                for outcome in market.get('outcomes', []):
-                    odds = outcome['price']
-                    metrics = calculate_metrics(odds)
-                    
-                    Pick.objects.update_or_create(
-                        match=match,
-                        team_selected=outcome['name'],
-                        defaults={
-                            'pick_type': 'Moneyline',
-                            'odds_american': odds,
-                            'confidence_percentage': metrics['confidence'],
-                            'edge_percentage': metrics['edge'],
-                            'ev_percentage': metrics['ev']
-                        }
-                    )
-        logger.info("sync_odds_completed")
+    due = OddsSyncService.claim_due(timezone.now())
+    for sport_key in due:
+        sync_sport_odds.delay(sport_key)
+    if due:
+        logger.info("sync_odds_dispatched", sports=due)
+
+
+@shared_task
+def sync_sport_odds(sport_key):
+    state = OddsSyncState.objects.filter(sport_key=sport_key, active=True).first()
+    if state is None:
+        return
+
+    logger.info("sync_odds_started", sport=sport_key)
+    try:
+        with deferred_invalidation():
+            stats = OddsSyncService.sync_sport(state)
+        logger.info("sync_odds_completed", sport=sport_key, **stats)
+    except OddsFeedError as e:
+        logger.error("odds_api_error_message", sport=sport_key, message=str(e))
+        OddsSyncService.reschedule(state, timezone.now())
     except Exception as e:
-        logger.error("sync_odds_failed", error=str(e))
\ No newline at end of file
+        logger.error("sync_odds_failed", sport=sport_key, error=str(e))
+        OddsSyncService.reschedule(state, timezone.now())
+
+
+@shared_task
+def prune_odds_snapshots():
+    before = timezone.now() - timedelta(days=settings.ODDS_SNAPSHOT_RETENTION_DAYS)
+    deleted = OddsHistoryService.prune(before, settings.ODDS_SNAPSHOT_PRUNE_BATCH)
+    logger.info("odds_snapshots_pruned", deleted=deleted, before=before.isoformat())
\ No newline at end of file
@@ -1,3 +1,431 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import math
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+import requests
+import urllib3
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient
+from Rai_Backend.celery import app
+from .feed import OddsFeedError, batched, iter_games, open_feed
+from .metrics import compute, price_games
+from .models import Match, OddsSnapshot, OddsSyncState, Pick, SportCategory
+from .services import OddsHistoryService, OddsIngestionService, OddsSyncService
+from .tasks import prune_odds_snapshots, sync_odds_data
+from .utils import calculate_implied_probability, calculate_metrics
 
-# Create your tests here.
+FIXTURE = Path(__file__).resolve().parent / "test_data" / "odds_upcoming.json"
+
+
+class StubOddsAPI:
+    """
+    Serves the recorded feed on localhost in small chunked writes, so the parser sees the body arrive
+    piecemeal the way it does from the real API. Sport odds are filtered from the recording, carry an
+    ETag and quota headers, and requests with apiKey=bad get the API's error body.
+    """
+
+    def __init__(self, games, chunk_size=512):
+        self.games = games
+        self.chunk_size = chunk_size
+        self.remaining = 500
+        self.odds_requests = 0
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sports(self):
+        keys = dict.fromkeys(g["sport_key"] for g in self.games)
+        sports = [{"key": k, "title": k, "active": True, "has_outrights": False} for k in keys]
+        return sports + [{"key": "golf_masters_tournament_winner", "title": "Masters", "active": True, "has_outrights": True}]
+
+    def odds(self, sport):
+        return [g for g in self.games if sport == "upcoming" or g["sport_key"] == sport]
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_json(self, status, data, headers=()):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if "apiKey=bad" in self.path:
+                    self.send_json(401, {"message": "API key is not valid"})
+                    return
+
+                parts = self.path.split("?")[0].strip("/").split("/")
+                if parts == ["sports"]:
+                    self.send_json(200, stub.sports())
+                    return
+
+                body = json.dumps(stub.odds(parts[1])).encode()
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                stub.odds_requests += 1
+                quota = [("x-requests-used", str(500 - stub.remaining)), ("x-requests-remaining", str(stub.remaining))]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    for name, value in quota + [("ETag", etag)]:
+                        self.send_header(name, value)
+                    self.end_headers()
+                    return
+
+                stub.remaining -= 1
+                quota = [("x-requests-used", str(500 - stub.remaining)), ("x-requests-remaining", str(stub.remaining))]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                for name, value in quota + [("ETag", etag)]:
+                    self.send_header(name, value)
+                self.end_headers()
+                for i in range(0, len(body), stub.chunk_size):
+                    chunk = body[i:i + stub.chunk_size]
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StubServerMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.games = json.loads(FIXTURE.read_bytes())
+        cls.stub = StubOddsAPI(cls.games).start()
+        cls.addClassCleanup(cls.stub.stop)
+
+
+def feed_response(status, body, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response.raw = urllib3.HTTPResponse(body=io.BytesIO(body), preload_content=False)
+    return response
+
+
+class FeedParsingTests(SimpleTestCase):
+    def setUp(self):
+        self.body = FIXTURE.read_bytes()
+        patcher = mock.patch("betting.feed.requests.get")
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stream_matches_full_parse(self):
+        self.get.return_value = feed_response(200, self.body)
+        with open_feed("https://odds.test/feed") as response:
+            self.assertEqual(list(iter_games(response)), json.loads(self.body))
+
+    def test_sends_validators(self):
+        self.get.return_value = feed_response(304, b"")
+        response = open_feed("https://odds.test/feed", etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.get.call_args.kwargs["headers"], {
+            "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+        })
+        self.assertTrue(self.get.call_args.kwargs["stream"])
+
+    def test_error_response_raises(self):
+        response = feed_response(401, json.dumps({"message": "API key is not valid"}).encode())
+        self.get.return_value = response
+        with self.assertRaisesMessage(OddsFeedError, "API key is not valid"):
+            open_feed("https://odds.test/feed")
+        self.assertTrue(response.raw.closed)
+
+    def test_batched(self):
+        self.assertEqual([len(b) for b in batched(range(20), 8)], [8, 8, 4])
+        self.assertEqual(list(batched([], 8)), [])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SyncOddsTaskTests(StubServerMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, "task_always_eager", False)
+
+    def run_sync(self, **overrides):
+        with override_settings(**{"ODDS_API_BASE_URL": self.stub.url, "THE_ODDS_API_KEY": "test", **overrides}):
+            sync_odds_data()
+
+    def make_due(self, **fields):
+        OddsSyncState.objects.update(next_sync_at=timezone.now(), **fields)
+
+    def expected_picks(self, games):
+        return sum(
+            len(g["bookmakers"][0]["markets"][0]["outcomes"]) for g in games if g["bookmakers"]
+        )
+
+    def test_sync_in_batches(self):
+        self.run_sync(ODDS_SYNC_BATCH_SIZE=3)
+
+        self.assertEqual(Match.objects.count(), len(self.games))
+        self.assertEqual(Pick.objects.count(), self.expected_picks(self.games))
+        draftkings = next(
+            b for b in self.games[0]["bookmakers"] if b["key"] == "draftkings"
+        )["markets"][0]["outcomes"][0]
+        pick = Pick.objects.get(
+            match__start_time=parse_datetime(self.games[0]["commence_time"]), team_selected=draftkings["name"]
+        )
+        self.assertEqual(pick.odds_american, draftkings["price"])
+
+    def test_fan_out_records_state(self):
+        self.run_sync()
+
+        sports = {g["sport_key"] for g in self.games}
+        states = OddsSyncState.objects.all()
+        self.assertEqual({s.sport_key for s in states}, sports)
+        for state in states:
+            self.assertTrue(state.etag)
+            self.assertTrue(state.cursor)
+            self.assertGreater(state.next_sync_at, timezone.now())
+            self.assertIsNotNone(state.requests_remaining)
+        self.assertEqual(OddsSyncService.quota_remaining(), self.stub.remaining)
+
+    def test_nothing_due_makes_no_requests(self):
+        self.run_sync()
+        requests = self.stub.odds_requests
+        self.run_sync()
+
+        self.assertEqual(self.stub.odds_requests, requests)
+
+    def test_unchanged_feed_is_not_modified(self):
+        self.run_sync()
+        picks = dict(Pick.objects.values_list("id", "updated_at"))
+        remaining = self.stub.remaining
+        self.make_due()
+        self.run_sync()
+
+        self.assertEqual(self.stub.remaining, remaining)
+        self.assertEqual(dict(Pick.objects.values_list("id", "updated_at")), picks)
+        self.assertEqual(OddsSnapshot.objects.count(), len(picks))
+
+    def test_cursor_skips_old_events(self):
+        self.run_sync(ODDS_SYNC_BATCH_SIZE=7)
+        picks = dict(Pick.objects.values_list("id", "updated_at"))
+        self.make_due(etag="")
+
+        state = OddsSyncState.objects.get(sport_key="basketball_nba")
+        with override_settings(ODDS_API_BASE_URL=self.stub.url, THE_ODDS_API_KEY="test"):
+            stats = OddsSyncService.sync_sport(state)
+
+        games = [g for g in self.games if g["sport_key"] == "basketball_nba"]
+        untimed = sum(1 for g in games if OddsSyncService.event_updated_at(g) is None)
+        self.assertEqual(stats["games"], untimed)
+        self.assertEqual(stats["events_skipped"], len(games) - untimed)
+        self.assertEqual(stats["picks_updated"] + stats["picks_created"], 0)
+        self.assertEqual(dict(Pick.objects.values_list("id", "updated_at")), picks)
+
+    def test_max_games(self):
+        self.run_sync(ODDS_SYNC_BATCH_SIZE=3, ODDS_SYNC_MAX_GAMES=2)
+
+        firsts = []
+        for sport in {g["sport_key"] for g in self.games}:
+            firsts += [g for g in self.games if g["sport_key"] == sport][:2]
+        self.assertEqual(Match.objects.count(), len(firsts))
+        self.assertEqual(Pick.objects.count(), self.expected_picks(firsts))
+        self.assertFalse(OddsSyncState.objects.exclude(etag="").exists())
+
+        for _ in range(len(self.games)):
+            self.make_due()
+            self.run_sync(ODDS_SYNC_BATCH_SIZE=3, ODDS_SYNC_MAX_GAMES=2)
+        self.assertEqual(Match.objects.count(), len(self.games))
+        self.assertEqual(Pick.objects.count(), self.expected_picks(self.games))
+
+    def test_new_events_with_old_updates_are_ingested(self):
+        self.run_sync()
+        oldest = min(
+            (g for g in self.games if g["bookmakers"]), key=lambda g: OddsSyncService.event_updated_at(g)
+        )
+        added = {**oldest, "id": "added", "home_team": "Expansion Team"}
+        self.stub.games = self.games + [added]
+        self.addCleanup(setattr, self.stub, "games", self.games)
+        self.make_due(etag="")
+        self.run_sync()
+
+        self.assertTrue(Match.objects.filter(home_team="Expansion Team").exists())
+        self.assertEqual(Pick.objects.count(), self.expected_picks(self.stub.games))
+
+    def test_failure_releases_lease(self):
+        self.run_sync()
+        self.make_due()
+        with override_settings(ODDS_SYNC_LEASE=86400):
+            self.run_sync(THE_ODDS_API_KEY="bad")
+
+        for state in OddsSyncState.objects.all():
+            self.assertLessEqual(state.next_sync_at, timezone.now() + timedelta(seconds=state.interval))
+
+
+class OddsScheduleTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.sport = SportCategory.objects.create(name="basketball_nba")
+
+    def add_match(self, **offset):
+        Match.objects.create(
+            sport=self.sport, home_team="Lakers", away_team="Celtics", start_time=self.now + timedelta(**offset)
+        )
+
+    def test_interval_follows_nearest_game(self):
+        self.assertEqual(OddsSyncService.next_interval("basketball_nba", self.now), settings.ODDS_SYNC_INTERVAL_EMPTY)
+        self.add_match(days=3)
+        self.assertEqual(OddsSyncService.next_interval("basketball_nba", self.now), settings.ODDS_SYNC_INTERVAL_IDLE)
+        self.add_match(hours=6)
+        self.assertEqual(OddsSyncService.next_interval("basketball_nba", self.now), settings.ODDS_SYNC_INTERVAL_SOON)
+        self.add_match(hours=-1)
+        self.assertEqual(OddsSyncService.next_interval("basketball_nba", self.now), settings.ODDS_SYNC_INTERVAL_LIVE)
+
+    def test_claim_is_leased(self):
+        OddsSyncState.objects.create(sport_key="basketball_nba", next_sync_at=self.now)
+
+        self.assertEqual(OddsSyncService.claim_due(self.now), ["basketball_nba"])
+        self.assertEqual(OddsSyncService.claim_due(self.now), [])
+
+    def test_low_quota_claims_only_live_sports(self):
+        OddsSyncState.objects.create(
+            sport_key="basketball_nba", interval=60, next_sync_at=self.now, last_synced_at=self.now, requests_remaining=5
+        )
+        OddsSyncState.objects.create(sport_key="icehockey_nhl", interval=3600, next_sync_at=self.now)
+
+        self.assertEqual(OddsSyncService.claim_due(self.now), ["basketball_nba"])
+
+
+def game(home_price, away_price, commence_time="2026-10-20T17:00:00Z"):
+    return {
+        "sport_key": "basketball_nba",
+        "commence_time": commence_time,
+        "home_team": "Lakers",
+        "away_team": "Celtics",
+        "bookmakers": [{"key": "draftkings", "markets": [{"key": "h2h", "outcomes": [
+            {"name": "Lakers", "price": home_price},
+            {"name": "Celtics", "price": away_price},
+        ]}]}],
+    }
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class OddsHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_snapshots_record_only_moves(self):
+        OddsIngestionService.ingest([game(-150, 130)])
+        OddsIngestionService.ingest([game(-150, 130)])
+        stats = OddsIngestionService.ingest([game(-170, 130)])
+
+        self.assertEqual(stats["snapshots"], 1)
+        self.assertEqual(Pick.objects.count(), 2)
+        lakers = Pick.objects.get(team_selected="Lakers")
+        self.assertEqual(list(lakers.snapshots.order_by("recorded_at", "id").values_list("odds_american", flat=True)), [-150, -170])
+        self.assertEqual(OddsSnapshot.objects.filter(pick__team_selected="Celtics").count(), 1)
+
+    def test_downsample_keeps_ends_and_last_price_per_bucket(self):
+        start = timezone.now()
+        rows = [(start + timedelta(minutes=i), -100 - i) for i in range(100)]
+
+        sampled = OddsHistoryService.downsample(rows, 10)
+        self.assertLessEqual(len(sampled), 10)
+        self.assertEqual(sampled[0], rows[0])
+        self.assertEqual(sampled[-1], rows[-1])
+        self.assertEqual(sampled, sorted(sampled))
+        self.assertEqual(OddsHistoryService.downsample(rows[:5], 10), rows[:5])
+
+    def test_line_movement_endpoint(self):
+        OddsIngestionService.ingest([game(-150, 130)])
+        OddsIngestionService.ingest([game(-170, 150)])
+        lakers = Pick.objects.get(team_selected="Lakers")
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(username="bettor", password="x" * 12))
+
+        data = client.get(f"/api/betting/{lakers.id}/line_movement/", {"points": 50}).json()["data"]
+        self.assertEqual(data["moves"], 1)
+        self.assertEqual(data["opening"]["odds_american"], -150)
+        self.assertEqual(data["current"]["odds_american"], -170)
+        self.assertGreater(data["implied_probability_change"], 0)
+        self.assertEqual([p["odds_american"] for p in data["series"]], [-150, -170])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            OddsIngestionService.ingest([game(-190, 150)])
+        data = client.get(f"/api/betting/{lakers.id}/line_movement/", {"points": 50}).json()["data"]
+        self.assertEqual(data["current"]["odds_american"], -190)
+
+        self.assertEqual(client.get(f"/api/betting/{lakers.id}/line_movement/", {"points": "x"}).status_code, 400)
+
+    def test_prune(self):
+        OddsIngestionService.ingest([game(-150, 130)])
+        OddsSnapshot.objects.update(recorded_at=timezone.now() - timedelta(days=settings.ODDS_SNAPSHOT_RETENTION_DAYS + 1))
+        OddsIngestionService.ingest([game(-170, 130)])
+
+        prune_odds_snapshots()
+        self.assertEqual(list(OddsSnapshot.objects.values_list("odds_american", flat=True)), [-170])
+
+
+class MetricsTests(SimpleTestCase):
+    def test_compute_removes_vig_and_averages_books(self):
+        # Two books on one game: (-150, +130) and (-120, +100).
+        metrics = compute([-150, 130, -120, 100], [0, 0, 1, 1], [0, 1, 0, 1])
+
+        self.assertTrue(all(math.isclose(a, b) for a, b in zip(
+            metrics["implied"], [calculate_implied_probability(p) / 100 for p in (-150, 130, -120, 100)]
+        )))
+        self.assertAlmostEqual(metrics["fair"][0] + metrics["fair"][1], 1)
+        self.assertAlmostEqual(metrics["fair"][2] + metrics["fair"][3], 1)
+        favourite = (metrics["fair"][0] + metrics["fair"][2]) / 2
+        self.assertAlmostEqual(metrics["consensus"][0], favourite)
+        self.assertAlmostEqual(metrics["consensus"][0] + metrics["consensus"][1], 1)
+        self.assertAlmostEqual(metrics["edge"][3], (metrics["consensus"][3] - 0.5) * 100)
+        self.assertAlmostEqual(metrics["ev"][3], (metrics["consensus"][3] * 2 - 1) * 100)
+
+    def test_price_games_uses_every_book(self):
+        games = [game(-150, 130), game(-110, -110, "2026-10-21T17:00:00Z"), {"bookmakers": []}]
+        games[0]["bookmakers"].insert(0, {"key": "fanduel", "markets": [{"key": "h2h", "outcomes": [
+            {"name": "Lakers", "price": -120}, {"name": "Celtics", "price": 100},
+        ]}]})
+
+        priced = price_games(games, OddsIngestionService.select_bookmaker)
+        self.assertEqual([len(p) for p in priced], [2, 2, 0])
+        (home, home_odds, home_metrics), (away, away_odds, away_metrics) = priced[0]
+        self.assertEqual((home, home_odds, away, away_odds), ("Lakers", -150, "Celtics", 130))
+        # FanDuel rates the underdog higher than DraftKings' price implies, so backing it has an edge.
+        self.assertGreater(away_metrics["edge"], 0)
+        self.assertLess(home_metrics["edge"], 0)
+        # A single book priced against itself only gives up its vig.
+        self.assertEqual(priced[1][0][2]["edge"], priced[1][1][2]["edge"])
+        self.assertLess(priced[1][0][2]["ev"], 0)
+
+    def test_scalar_metrics_agree_with_batch(self):
+        (_, _, batch), _ = price_games([game(-150, 130)], OddsIngestionService.select_bookmaker)[0]
+        fair = compute([-150, 130], [0, 0], [0, 1])["consensus"][0] * 100
+
+        self.assertEqual(calculate_metrics(-150, fair), batch)
+        self.assertEqual(calculate_metrics(-150)["edge"], 0)
@@ -9,14 +9,19 @@ def calculate_implied_probability(american_odds):
     return (1 / decimal_odds) * 100
 
 def calculate_metrics(odds, sharp_implied_prob=None):
+    """
+    Metrics for a single price. `sharp_implied_prob` is the fair win probability in percent, e.g. a
+    no-vig consensus; without it the price's own implied probability is used, which means no edge.
+    Feed ingestion prices whole batches with betting.metrics instead.
+    """
     implied_prob = calculate_implied_probability(odds)
-    confidence = int(implied_prob)
-    
-    edge = 2.5 if odds > 0 else 0.5
-    ev = edge * 1.2 
+    fair_prob = implied_prob if sharp_implied_prob is None else sharp_implied_prob
+
+    edge = fair_prob - implied_prob
+    ev = (fair_prob / 100 * american_to_decimal(odds) - 1) * 100
 
     return {
-        "confidence": confidence,
+        "confidence": int(fair_prob),
         "edge": round(edge, 2),
         "ev": round(ev, 2)
     }
\ No newline at end of file
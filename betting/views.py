@@ -3,9 +3,12 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.throttling import ScopedRateThrottle
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from .models import Pick, UserParlay
 from .serializers import PickSerializer, ParlaySerializer
-from .services import BettingService
+from .services import BettingService, OddsHistoryService
+from Rai_Backend.cache import read_through
 
 class BettingViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -63,6 +66,26 @@ class BettingViewSet(viewsets.ViewSet):
         except Pick.DoesNotExist:
             return Response({"error": "Pick not found"}, status=404)
 
+    @action(detail=True, methods=['get'])
+    def line_movement(self, request, pk=None):
+        try:
+            points = int(request.query_params.get('points', settings.ODDS_HISTORY_DEFAULT_POINTS))
+        except ValueError:
+            return Response({"detail": "points must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        points = max(2, min(points, settings.ODDS_HISTORY_MAX_POINTS))
+
+        try:
+            pick = Pick.objects.only('id', 'match_id', 'odds_american', 'created_at').get(pk=pk)
+        except (Pick.DoesNotExist, ValidationError):
+            return Response({"error": "Pick not found"}, status=404)
+
+        data = read_through(
+            f'match_picks_{pick.match_id}',
+            f'line_movement:{pick.id}:{points}',
+            lambda: OddsHistoryService.line_movement(pick, points),
+        )
+        return Response(data)
+
     @action(detail=True, methods=['post'])
     def send_to_tracking(self, request, pk=None):
         try:
@@ -0,0 +1,144 @@
+import asyncio
+import weakref
+import structlog
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django_redis import get_redis_connection
+from .services import CommunityService
+
+logger = structlog.get_logger(__name__)
+
+MAX_FLUSH_ATTEMPTS = 3
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+class MessageBuffer:
+    """
+    Write-behind queue for community chat messages on one event loop.
+
+    Messages are broadcast as soon as they are accepted and persisted here in bulk_create batches,
+    every `interval` seconds or as soon as `max_size` are pending. Flushes run one at a time, so
+    batches reach the database in the order they were accepted. Primary keys are assigned before
+    enqueueing, so a retried batch cannot insert a message twice. A batch that still fails after
+    MAX_FLUSH_ATTEMPTS is written row by row, and rows that cannot be written are stashed in Redis.
+    """
+
+    def __init__(self, interval, max_size):
+        self.interval = interval
+        self.max_size = max_size
+        self._pending = []
+        self._attempts = 0
+        self._timer = None
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    def add(self, msg):
+        self._pending.append(msg)
+        if len(self._pending) >= self.max_size:
+            self._spawn(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self._spawn(self._flush_later())
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await database_sync_to_async(CommunityService.persist_messages)(batch)
+                self._attempts = 0
+            except Exception as e:
+                self._attempts += 1
+                if self._attempts < MAX_FLUSH_ATTEMPTS:
+                    logger.warning("community_buffer_flush_failed", error=str(e), messages=len(batch), attempt=self._attempts)
+                    self._pending[:0] = batch
+                else:
+                    logger.error("community_buffer_flush_gave_up", error=str(e), messages=len(batch))
+                    self._attempts = 0
+                    await database_sync_to_async(save_or_stash)(batch)
+
+        if self._pending and (self._timer is None or self._timer.done()):
+            self._timer = self._spawn(self._flush_later())
+
+
+def _unsaved_key():
+    return f"{settings.CACHES['default'].get('KEY_PREFIX', '')}:community:unsaved"
+
+
+def stash(messages):
+    """
+    Park messages that could not be written in a Redis list for replay_unsaved. They were already broadcast,
+    so if Redis is down too the full messages go to the error log rather than disappearing.
+    """
+    try:
+        get_redis_connection("default").rpush(_unsaved_key(), *[CommunityService.encode_message(m) for m in messages])
+        logger.warning("community_messages_stashed", message_ids=[str(m.id) for m in messages])
+    except Exception as e:
+        logger.error(
+            "community_messages_lost",
+            error=str(e),
+            messages=[CommunityService.encode_message(m) for m in messages],
+        )
+
+
+def save_or_stash(batch):
+    """Fallback for a batch that keeps failing: write it row by row and stash whatever still fails."""
+    failed = CommunityService.persist_each(batch)
+    for msg, error in failed:
+        logger.error("community_message_write_failed", message_id=str(msg.id), error=str(error))
+    if failed:
+        stash([msg for msg, _ in failed])
+
+
+def replay_unsaved(limit):
+    """
+    Write up to `limit` stashed messages. Rows the database rejects outright (the sender or community is
+    gone) are logged and discarded; anything else is stashed again for the next run.
+    """
+    redis = get_redis_connection("default")
+    key = _unsaved_key()
+    pipe = redis.pipeline()
+    pipe.lrange(key, 0, limit - 1)
+    pipe.ltrim(key, limit, -1)
+    raw, _ = pipe.execute()
+    if not raw:
+        return 0
+
+    messages = [CommunityService.decode_message(item) for item in raw]
+    try:
+        CommunityService.persist_messages(messages)
+        return len(messages)
+    except Exception:
+        failed = CommunityService.persist_each(messages)
+
+    retry = []
+    for msg, error in failed:
+        if isinstance(error, IntegrityError):
+            logger.error("community_message_discarded", message=CommunityService.encode_message(msg), error=str(error))
+        else:
+            retry.append(msg)
+    if retry:
+        stash(retry)
+    return len(messages) - len(failed)
+
+
+def get_message_buffer():
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageBuffer(
+            settings.COMMUNITY_WRITE_BUFFER_INTERVAL, settings.COMMUNITY_WRITE_BUFFER_MAX
+        )
+    return buffer
\ No newline at end of file
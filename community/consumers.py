@@ -1,14 +1,124 @@
+import asyncio
 import json
+import time
+import weakref
 import structlog
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.conf import settings
-from .models import Community, Membership, CommunityMessage
+from Rai_Backend.presence import GLOBAL_SCOPE, PresenceService, PresenceTracker, community_scope
+from Rai_Backend import replay
+from .buffer import get_message_buffer
+from .models import CommunityMessage
+from .services import CommunityService
+from .signals import member_group_name
 
 logger = structlog.get_logger(__name__)
 
 MAX_MESSAGE_LENGTH = 5000
 
+_digests = weakref.WeakKeyDictionary()
+
+
+class TypingThrottle:
+    """Lets a typing start through at most once per PRESENCE_TYPING_INTERVAL; a stop only follows a start."""
+
+    def __init__(self):
+        self.last_start = 0
+
+    def allow(self, is_typing):
+        if not is_typing:
+            allowed, self.last_start = bool(self.last_start), 0
+            return allowed
+        now = time.monotonic()
+        if now - self.last_start < settings.PRESENCE_TYPING_INTERVAL:
+            return False
+        self.last_start = now
+        return True
+
+
+async def broadcast_typing(channel_layer, community_id, user, is_typing, exclude):
+    """Typing frames are ephemeral: relayed through the room group and never stored."""
+    frame = json.dumps({
+        "type": "typing",
+        "community_id": community_id,
+        "user_id": user.id,
+        "username": user.username,
+        "is_typing": is_typing,
+    })
+    await channel_layer.group_send(
+        f"community_{community_id}",
+        {"type": "forward_frame", "community_id": community_id, "frame": frame, "exclude": exclude},
+    )
+
+
+class PresenceDigest:
+    """
+    Presence changes for one event loop, coalesced per community. Instead of a frame per connect and
+    disconnect, each room gets one frame per PRESENCE_BROADCAST_INTERVAL listing who came online and
+    who went offline since the last one, with its online count. A user who leaves and comes back
+    within the interval cancels out.
+    """
+
+    def __init__(self, channel_layer, interval):
+        self.channel_layer = channel_layer
+        self.interval = interval
+        self._pending = {}
+        self._timer = None
+
+    def add(self, community_id, user_id, status):
+        changes = self._pending.setdefault(community_id, {})
+        if changes.get(user_id, status) != status:
+            del changes[user_id]
+        else:
+            changes[user_id] = status
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        for community_id, changes in pending.items():
+            if not changes:
+                continue
+            try:
+                await self._send(community_id, changes)
+            except Exception as e:
+                logger.warning("community_ws_presence_broadcast_failed", community_id=community_id, error=str(e))
+
+    async def _send(self, community_id, changes):
+        try:
+            count = await sync_to_async(PresenceService.online_count, thread_sensitive=False)(community_scope(community_id))
+        except Exception as e:
+            logger.warning("community_ws_presence_count_failed", error=str(e))
+            count = None
+        frame = json.dumps({
+            "type": "presence",
+            "community_id": community_id,
+            "online": [user_id for user_id, status in changes.items() if status == "online"],
+            "offline": [user_id for user_id, status in changes.items() if status == "offline"],
+            "online_count": count,
+        })
+        await self.channel_layer.group_send(
+            f"community_{community_id}", {"type": "forward_frame", "community_id": community_id, "frame": frame}
+        )
+
+
+def get_presence_digest(channel_layer):
+    loop = asyncio.get_running_loop()
+    digest = _digests.get(loop)
+    if digest is None:
+        digest = _digests[loop] = PresenceDigest(channel_layer, settings.PRESENCE_BROADCAST_INTERVAL)
+    return digest
+
+
+async def broadcast_presence(channel_layer, community_id, user_id, status):
+    get_presence_digest(channel_layer).add(community_id, user_id, status)
+
 
 class CommunityConsumer(AsyncWebsocketConsumer):
 
@@ -23,8 +133,8 @@ class CommunityConsumer(AsyncWebsocketConsumer):
         self.community_id = self.scope["url_route"]["kwargs"]["community_id"]
         self.room_group_name = f"community_{self.community_id}"
 
-        membership = await self.get_membership(self.community_id, self.user)
-        if not membership:
+        self.membership = await self.get_membership_state(self.community_id, self.user.id)
+        if not self.membership:
             logger.warning(
                 "community_ws_unauthorized",
                 user_id=self.user.id,
@@ -33,25 +143,48 @@ class CommunityConsumer(AsyncWebsocketConsumer):
             await self.close(code=4003)
             return
 
-        self.is_muted = membership.is_muted
-
+        self.member_group_name = member_group_name(self.community_id, self.user.id)
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.channel_layer.group_add(self.member_group_name, self.channel_name)
         await self.accept()
 
         self.base_url = getattr(settings, "SERVER_BASE_URL", "")
+        self.typing = TypingThrottle()
 
-        try:
-            history = await self.get_chat_history(self.community_id, self.base_url)
-            await self.send(text_data=json.dumps({"type": "history", "messages": history}))
-        except Exception as e:
-            logger.error("community_ws_history_failed", error=str(e), exc_info=True)
-            await self.send(text_data=json.dumps({"type": "history", "messages": []}))
+        self.presence = PresenceTracker(self.user.id, self.channel_name, [GLOBAL_SCOPE, self.presence_scope])
+        if self.presence_scope in await self.presence.start():
+            await self.broadcast_presence("online")
+
+        seq, frames = await sync_to_async(replay.resume, thread_sensitive=False)(
+            f"community:{self.community_id}", replay.last_seq_from_scope(self.scope)
+        )
+        if frames is not None:
+            for frame in frames:
+                await self.send(text_data=frame)
+            await self.send(text_data=json.dumps({"type": "resumed", "community_id": self.community_id, "seq": seq}))
+        else:
+            try:
+                history = await self.get_chat_history(self.community_id, self.base_url)
+                await self.send(text_data=json.dumps({"type": "history", "seq": seq, "messages": history}))
+            except Exception as e:
+                logger.error("community_ws_history_failed", error=str(e), exc_info=True)
+                await self.send(text_data=json.dumps({"type": "history", "seq": seq, "messages": []}))
 
         logger.info("community_ws_connected", user_id=self.user.id, community_id=self.community_id)
 
+    @property
+    def presence_scope(self):
+        return community_scope(self.community_id)
+
     async def disconnect(self, close_code):
+        await get_message_buffer().flush()
+        if hasattr(self, "presence"):
+            if self.presence_scope in await self.presence.stop():
+                await self.broadcast_presence("offline")
         if hasattr(self, "room_group_name"):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if hasattr(self, "member_group_name"):
+            await self.channel_layer.group_discard(self.member_group_name, self.channel_name)
         logger.info("community_ws_disconnected", user_id=getattr(self.user, "id", None), code=close_code)
 
     async def receive(self, text_data):
@@ -63,6 +196,14 @@ class CommunityConsumer(AsyncWebsocketConsumer):
             return
 
         try:
+            action = data.get("action")
+            if action == "typing":
+                await self.handle_typing(bool(data.get("is_typing", True)))
+                return
+            if action == "online":
+                await self.send_online()
+                return
+
             message_text = data.get("message", "").strip()
             if not message_text:
                 return
@@ -74,63 +215,71 @@ class CommunityConsumer(AsyncWebsocketConsumer):
                 }))
                 return
 
-            membership = await self.get_membership(self.community_id, self.user)
-            if not membership:
+            if not self.membership:
                 await self.send(text_data=json.dumps({"type": "error", "message": "You are no longer a member."}))
                 return
 
-            if membership.is_muted:
+            if self.membership["is_muted"]:
                 await self.send(text_data=json.dumps({
                     "type": "error",
                     "message": "You are muted in this community.",
                 }))
                 return
 
-            saved_msg = await self.save_message(self.community_id, self.user, message_text)
-
-            profile_pic = None
-            if self.user.profile_picture:
-                url = self.user.profile_picture.url
-                profile_pic = url if url.startswith("http") else f"{self.base_url}{url}"
-
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat_message",
-                    "id": str(saved_msg.id),
-                    "message": saved_msg.text,
-                    "image": None,
-                    "audio": None,
-                    "sender": {
-                        "id": self.user.id,
-                        "username": self.user.username,
-                        "first_name": self.user.first_name,
-                        "last_name": self.user.last_name,
-                        "profile_picture": profile_pic,
-                    },
-                    "created_at": str(saved_msg.created_at),
-                },
+            msg, frame = await database_sync_to_async(CommunityService.prepare_message)(
+                self.community_id, self.user.id, message_text, data.get("client_id"), self.base_url
             )
+            get_message_buffer().add(msg)
+            await self.channel_layer.group_send(self.room_group_name, {
+                "type": "chat_message",
+                "community_id": self.community_id,
+                "frame": frame,
+            })
         except Exception as e:
             logger.error("community_ws_receive_error", error=str(e), exc_info=True)
             await self.send(text_data=json.dumps({"type": "error", "message": "Failed to send message."}))
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send(text_data=event["frame"])
 
-    @database_sync_to_async
-    def get_membership(self, community_id, user):
+    async def forward_frame(self, event):
+        """Relay a pre-encoded ephemeral frame (presence, typing), skipping the socket it came from."""
+        if event.get("exclude") == self.channel_name:
+            return
+        await self.send(text_data=event["frame"])
+
+    async def handle_typing(self, is_typing):
+        if self.typing.allow(is_typing):
+            await broadcast_typing(self.channel_layer, self.community_id, self.user, is_typing, self.channel_name)
+
+    async def broadcast_presence(self, status):
+        await broadcast_presence(self.channel_layer, self.community_id, self.user.id, status)
+
+    async def send_online(self):
         try:
-            return Membership.objects.get(community_id=community_id, user=user)
-        except Membership.DoesNotExist:
-            return None
+            user_ids = await sync_to_async(PresenceService.online_user_ids, thread_sensitive=False)(self.presence_scope)
+        except Exception as e:
+            logger.warning("community_ws_presence_lookup_failed", error=str(e))
+            user_ids = []
+        await self.send(text_data=json.dumps({
+            "type": "online",
+            "community_id": self.community_id,
+            "count": len(user_ids),
+            "user_ids": user_ids,
+        }))
+
+    async def membership_update(self, event):
+        """Pushed by community.signals when this user's membership is changed or removed."""
+        self.membership = event["membership"]
+        if not self.membership:
+            await self.send(text_data=json.dumps({"type": "membership_removed", "community_id": self.community_id}))
+            await self.close(code=4003)
+            return
+        await self.send(text_data=json.dumps({"type": "membership_update", **self.membership}))
 
     @database_sync_to_async
-    def save_message(self, community_id, user, text):
-        community = Community.objects.get(id=community_id)
-        msg = CommunityMessage.objects.create(community=community, sender=user, text=text)
-        community.save(update_fields=["updated_at"])
-        return msg
+    def get_membership_state(self, community_id, user_id):
+        return CommunityService.get_membership_state(community_id, user_id)
 
     @database_sync_to_async
     def get_chat_history(self, community_id, base_url):
@@ -1,8 +1,9 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.crypto import get_random_string
-from django.core.cache import cache
 import uuid
+from Rai_Backend.cache import CacheInvalidatingQuerySet, register
 
 
 class Community(models.Model):
@@ -16,6 +17,8 @@ class Community(models.Model):
     approval_required = models.BooleanField(default=True)
     invite_code = models.CharField(max_length=20, unique=True, blank=True, db_index=True)
 
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         ordering = ['-updated_at']
 
@@ -30,13 +33,6 @@ class Community(models.Model):
         if not self.invite_code:
             self.invite_code = self._generate_unique_invite_code()
         super().save(*args, **kwargs)
-        cache.delete('all_communities')
-        cache.delete(f'community_{self.id}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete('all_communities')
-        cache.delete(f'community_{self.id}')
-        super().delete(*args, **kwargs)
 
     def rotate_invite_code(self):
         self.invite_code = self._generate_unique_invite_code()
@@ -57,6 +53,8 @@ class Membership(models.Model):
     joined_at = models.DateTimeField(auto_now_add=True)
     is_muted = models.BooleanField(default=False)
 
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         unique_together = ('community', 'user')
         indexes = [
@@ -64,16 +62,6 @@ class Membership(models.Model):
             models.Index(fields=['user', 'role']),
         ]
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'_membership_{self.community_id}_{self.user_id}')
-        cache.delete(f'user_memberships_{self.user_id}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete(f'_membership_{self.community_id}_{self.user_id}')
-        cache.delete(f'user_memberships_{self.user_id}')
-        super().delete(*args, **kwargs)
-
 
 class CommunityMessage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -82,21 +70,19 @@ class CommunityMessage(models.Model):
     text = models.TextField(blank=True)
     image = models.ImageField(upload_to='community_images/', null=True, blank=True)
     audio = models.FileField(upload_to='community_audio/', null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    client_id = models.CharField(max_length=64, null=True, blank=True)
+
+    objects = CacheInvalidatingQuerySet.as_manager()
 
     class Meta:
         ordering = ['created_at']
         indexes = [
             models.Index(fields=['community', '-created_at']),
         ]
-
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'community_messages_{self.community_id}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete(f'community_messages_{self.community_id}')
-        super().delete(*args, **kwargs)
+        constraints = [
+            models.UniqueConstraint(fields=['community', 'sender', 'client_id'], name='unique_community_client_message'),
+        ]
 
 
 class JoinRequest(models.Model):
@@ -105,4 +91,9 @@ class JoinRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('community', 'user')
\ No newline at end of file
+        unique_together = ('community', 'user')
+
+
+register(Community, 'all_communities', 'community_{id}')
+register(Membership, '_membership_{community_id}_{user_id}', 'user_memberships_{user_id}')
+register(CommunityMessage, 'community_messages_{community_id}')
\ No newline at end of file
@@ -1,9 +1,15 @@
+import json
+import uuid
+from datetime import datetime
 import structlog
+from django.conf import settings
 from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from Rai_Backend import replay
+from Rai_Backend.cache import read_through
 from .models import Community, Membership, JoinRequest, CommunityMessage
 
 logger = structlog.get_logger(__name__)
@@ -12,6 +18,164 @@ User = get_user_model()
 
 class CommunityService:
 
+    @staticmethod
+    def get_membership_state(community_id, user_id):
+        """{'role', 'is_muted'} for a member, None otherwise. Cached in the _membership_ namespace."""
+        state = read_through(
+            f'_membership_{community_id}_{user_id}', 'state',
+            lambda: Membership.objects.filter(
+                community_id=community_id, user_id=user_id
+            ).values('role', 'is_muted').first() or {},
+        )
+        return state or None
+
+    @staticmethod
+    def absolute_url(url, base_url=None):
+        if not url:
+            return None
+        if url.startswith('http'):
+            return url
+        return f"{settings.SERVER_BASE_URL if base_url is None else base_url}{url}"
+
+    @staticmethod
+    def sender_profile(user_id, base_url=None):
+        """The sender blob broadcast with every community message, cached in the user_profile_ namespace."""
+        def load():
+            user = User.objects.get(id=user_id)
+            return {
+                "id": user.id,
+                "username": user.username,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+                "profile_picture": CommunityService.absolute_url(
+                    user.profile_picture.url if user.profile_picture else None, base_url
+                ),
+            }
+
+        return read_through(f'user_profile_{user_id}', f'sender:{base_url}', load)
+
+    @staticmethod
+    def message_frame(msg, sender, image=None, audio=None):
+        """Encode a chat_message frame once; the channel layer carries the string and receivers forward it as-is."""
+        return json.dumps({
+            "type": "chat_message",
+            "id": str(msg.id),
+            "message": msg.text,
+            "image": image,
+            "audio": audio,
+            "sender": sender,
+            "created_at": str(msg.created_at),
+            "client_id": msg.client_id,
+        })
+
+    @staticmethod
+    def build_message(community_id, user_id, text, client_id=None):
+        """
+        An unsaved CommunityMessage with its id and timestamp fixed, ready for broadcast and write-behind.
+        The id is always ours; the client's id is kept only as an idempotency key.
+        """
+        client_id = str(client_id) if client_id else None
+        return CommunityMessage(
+            id=uuid.uuid4(),
+            community_id=community_id,
+            sender_id=user_id,
+            text=text,
+            created_at=timezone.now(),
+            client_id=client_id if client_id and len(client_id) <= 64 else None,
+        )
+
+    @staticmethod
+    def prepare_message(community_id, user_id, text, client_id=None, base_url=None):
+        """A socket-posted message and its broadcast frame, stamped with the room's next replay seq."""
+        msg = CommunityService.build_message(community_id, user_id, text, client_id)
+        frame = CommunityService.message_frame(msg, CommunityService.sender_profile(user_id, base_url))
+        return msg, replay.sequence(f"community:{community_id}", frame)[1]
+
+    @staticmethod
+    def drop_duplicates(messages):
+        """Remove messages whose (community, sender, client_id) is already stored or repeated in the batch."""
+        keyed = [msg for msg in messages if msg.client_id]
+        if not keyed:
+            return messages
+        seen = set(CommunityMessage.objects.filter(
+            community_id__in={msg.community_id for msg in keyed},
+            client_id__in={msg.client_id for msg in keyed},
+        ).values_list('community_id', 'sender_id', 'client_id'))
+        seen = {(str(c), s, k) for c, s, k in seen}
+
+        unique, duplicates = [], []
+        for msg in messages:
+            key = (str(msg.community_id), msg.sender_id, msg.client_id)
+            if msg.client_id and key in seen:
+                duplicates.append(msg)
+                continue
+            seen.add(key)
+            unique.append(msg)
+        if duplicates:
+            logger.info("community_messages_deduplicated", message_ids=[str(m.id) for m in duplicates])
+        return unique
+
+    @staticmethod
+    def persist_messages(messages):
+        """
+        Insert a batch and bump each community's updated_at once. Messages repeating a stored client_id are
+        dropped as resends; a replayed batch cannot insert twice because ids are fixed before broadcast.
+        """
+        existing = {str(pk) for pk in Community.objects.filter(
+            id__in={msg.community_id for msg in messages}
+        ).values_list('id', flat=True)}
+        dropped = [msg for msg in messages if str(msg.community_id) not in existing]
+        if dropped:
+            logger.warning("community_messages_for_deleted_community", messages=len(dropped))
+            messages = [msg for msg in messages if str(msg.community_id) in existing]
+
+        messages = CommunityService.drop_duplicates(messages)
+        latest = {}
+        for msg in messages:
+            if msg.community_id not in latest or msg.created_at > latest[msg.community_id]:
+                latest[msg.community_id] = msg.created_at
+
+        with transaction.atomic():
+            CommunityMessage.objects.bulk_create(messages, ignore_conflicts=True)
+            for community_id, created_at in latest.items():
+                Community.objects.filter(id=community_id, updated_at__lt=created_at).update(updated_at=created_at)
+
+        logger.debug("community_messages_persisted", messages=len(messages), communities=len(latest))
+
+    @staticmethod
+    def persist_each(messages):
+        """Write messages one at a time so one bad row cannot sink the rest. Returns [(message, error)] for failures."""
+        failed = []
+        for msg in messages:
+            try:
+                CommunityService.persist_messages([msg])
+            except Exception as e:
+                failed.append((msg, e))
+        return failed
+
+    @staticmethod
+    def encode_message(msg):
+        return json.dumps({
+            "id": str(msg.id),
+            "community_id": str(msg.community_id),
+            "sender_id": msg.sender_id,
+            "text": msg.text,
+            "created_at": msg.created_at.isoformat(),
+            "client_id": msg.client_id,
+        })
+
+    @staticmethod
+    def decode_message(raw):
+        data = json.loads(raw)
+        return CommunityMessage(
+            id=uuid.UUID(data["id"]),
+            community_id=data["community_id"],
+            sender_id=data["sender_id"],
+            text=data["text"],
+            created_at=datetime.fromisoformat(data["created_at"]),
+            client_id=data.get("client_id"),
+        )
+
     @staticmethod
     def create_community(user, validated_data):
         try:
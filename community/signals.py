@@ -0,0 +1,53 @@
+import structlog
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from Rai_Backend.cache import rows_updated
+from .models import Membership
+
+logger = structlog.get_logger(__name__)
+
+
+def member_group_name(community_id, user_id):
+    return f"community_member_{community_id}_{user_id}"
+
+
+def _push_membership(community_id, user_id, state):
+    def send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                member_group_name(community_id, user_id),
+                {"type": "membership_update", "community_id": str(community_id), "membership": state},
+            )
+        except Exception as e:
+            logger.warning(
+                "membership_push_failed",
+                error=str(e),
+                community_id=str(community_id),
+                user_id=user_id,
+            )
+
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Membership)
+def membership_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    _push_membership(instance.community_id, instance.user_id, {"role": instance.role, "is_muted": instance.is_muted})
+
+
+@receiver(post_delete, sender=Membership)
+def membership_deleted(sender, instance, **kwargs):
+    _push_membership(instance.community_id, instance.user_id, None)
+
+
+@receiver(rows_updated, sender=Membership)
+def memberships_updated(sender, pks, fields, **kwargs):
+    """QuerySet.update() skips post_save, so push the new state of every row it changed."""
+    if not {"role", "is_muted"} & set(fields):
+        return
+    for row in Membership.objects.filter(pk__in=pks).values("community_id", "user_id", "role", "is_muted"):
+        _push_membership(row["community_id"], row["user_id"], {"role": row["role"], "is_muted": row["is_muted"]})
\ No newline at end of file
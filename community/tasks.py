@@ -0,0 +1,13 @@
+import structlog
+from celery import shared_task
+from django.conf import settings
+from .buffer import replay_unsaved
+
+logger = structlog.get_logger(__name__)
+
+
+@shared_task
+def replay_unsaved_messages():
+    written = replay_unsaved(settings.COMMUNITY_UNSAVED_REPLAY_BATCH)
+    if written:
+        logger.info("community_unsaved_messages_replayed", messages=written)
\ No newline at end of file
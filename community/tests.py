@@ -1,3 +1,301 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
+import fakeredis
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ai.models import Conversation
+from ai.tasks import generate_ai_response
+from Rai_Backend import presence, replay
+from Rai_Backend.consumers import MultiplexConsumer, Subscription, wrap
+from Rai_Backend.pagination import encode_cursor
+from . import buffer
+from .buffer import MAX_FLUSH_ATTEMPTS, MessageBuffer, replay_unsaved, stash
+from .models import Community, CommunityMessage, Membership
+from .services import CommunityService
+from .signals import member_group_name
+from .views import StandardPagination
 
-                         
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+@mock.patch.object(StandardPagination, "page_size", 2)
+class CommunityPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username="member", password="x" * 12))
+        for i in range(5):
+            Community.objects.create(name=f"Room {i}")
+        Community.objects.update(updated_at=timezone.now())
+        self.ordered = [str(pk) for pk in Community.objects.order_by("-updated_at", "-pk").values_list("id", flat=True)]
+
+    def fetch(self, cursor=None):
+        response = self.client.get("/api/community/", {"cursor": cursor} if cursor else {})
+        body = response.json()
+        return [c["id"] for c in body["data"]], body["pagination"]
+
+    def test_equal_updated_at_pages_in_both_directions(self):
+        pages, paginations, cursor = [], [], None
+        while True:
+            ids, pagination = self.fetch(cursor)
+            pages.append(ids)
+            paginations.append(pagination)
+            cursor = pagination["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual([i for page in pages for i in page], self.ordered)
+
+        ids, pagination = self.fetch(paginations[-1]["previous_cursor"])
+        self.assertEqual(ids, pages[-2])
+        self.assertEqual(self.fetch(pagination["next_cursor"])[0], pages[-1])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ["%%%", encode_cursor([timezone.now().isoformat(), "not-a-uuid"]), encode_cursor([1, 2, 3])]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/api/community/", {"cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json()["message"], "Invalid cursor")
+
+
+@override_settings(REPLAY_MAXLEN=5, REPLAY_TTL=60)
+class ReplayTests(SimpleTestCase):
+    channel = "community:replay-test"
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server)
+        for target, value in [("get_redis_connection", lambda alias: self.redis), ("_script", None)]:
+            patcher = mock.patch.object(replay, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def append(self, count):
+        return [replay.append(self.channel, json.dumps({"type": "chat_message", "n": n})) for n in range(count)]
+
+    def test_append_numbers_frames_in_order(self):
+        appended = self.append(3)
+
+        seqs = [seq for seq, _ in appended]
+        self.assertEqual(seqs, list(range(seqs[0], seqs[0] + 3)))
+        for seq, frame in appended:
+            self.assertEqual(json.loads(frame)["seq"], seq)
+        self.assertEqual(replay.current_seq(self.channel), seqs[-1])
+
+    def test_resume_inside_window_returns_missed_frames(self):
+        appended = self.append(4)
+        last_seq = appended[0][0]
+
+        current, frames = replay.resume(self.channel, last_seq)
+        self.assertEqual(current, appended[-1][0])
+        self.assertEqual(frames, [frame for _, frame in appended[1:]])
+        self.assertEqual(replay.resume(self.channel, current), (current, []))
+
+    def test_resume_outside_window_asks_for_reload(self):
+        appended = self.append(12)
+        current = appended[-1][0]
+
+        self.assertEqual(replay.resume(self.channel, appended[0][0]), (current, None))
+        self.assertEqual(replay.resume(self.channel, current + 1), (current, None))
+        self.assertEqual(replay.resume(self.channel), (current, None))
+
+    def test_lost_counter_restarts_above_buffered_frames(self):
+        last_seq = self.append(3)[-1][0]
+        self.redis.delete(replay._keys(self.channel)[0])
+
+        seq, _ = replay.append(self.channel, json.dumps({"type": "chat_message"}))
+        self.assertGreater(seq, last_seq)
+
+    def test_redis_failure_degrades_to_unsequenced_frames(self):
+        self.server.connected = False
+        frame = json.dumps({"type": "chat_message"})
+
+        self.assertEqual(replay.sequence(self.channel, frame), (None, frame))
+        self.assertEqual(replay.resume(self.channel, 1), (None, None))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE_BROADCAST_INTERVAL=0,
+)
+class MultiplexConsumerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        for target, attribute, value in [
+            (replay, "get_redis_connection", lambda alias: redis),
+            (replay, "_script", None),
+            (presence, "get_redis_connection", lambda alias: redis),
+            (presence.PresenceService, "_scripts", {}),
+        ]:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(username="streamer", password="x" * 12)
+        self.communities = [str(Community.objects.create(name=f"Room {i}").id) for i in range(2)]
+        for community_id in self.communities:
+            Membership.objects.create(community_id=community_id, user=self.user)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), "/ws/stream/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["type"], "ready")
+        return communicator
+
+    async def subscribe(self, communicator, channel):
+        await communicator.send_json_to({"action": "subscribe", "channel": channel})
+        return await communicator.receive_json_from()
+
+    async def test_subscribe_and_unsubscribe(self):
+        communicator = await self.connect()
+        channel = f"community:{self.communities[0]}"
+
+        reply = await self.subscribe(communicator, channel)
+        self.assertEqual(reply["type"], "subscribed")
+        self.assertEqual(reply["membership"], {"role": "member", "is_muted": False})
+
+        await communicator.send_json_to({"action": "unsubscribe", "channel": channel})
+        self.assertEqual(await communicator.receive_json_from(), {"type": "unsubscribed", "channel": channel})
+        await communicator.send_json_to({"action": "typing", "channel": channel, "is_typing": True})
+        await communicator.send_json_to({"action": "message", "channel": channel, "message": "hi"})
+        self.assertEqual((await communicator.receive_json_from())["code"], "not_subscribed")
+        await communicator.disconnect()
+
+    @override_settings(STREAM_MAX_SUBSCRIPTIONS=1)
+    async def test_subscription_limit(self):
+        communicator = await self.connect()
+
+        self.assertEqual((await self.subscribe(communicator, f"community:{self.communities[0]}"))["type"], "subscribed")
+        error = await self.subscribe(communicator, f"community:{self.communities[1]}")
+        self.assertEqual(error["code"], "too_many_subscriptions")
+        await communicator.disconnect()
+
+    async def test_membership_removed_is_delivered_before_teardown(self):
+        communicator = await self.connect()
+        community_id = self.communities[0]
+        channel = f"community:{community_id}"
+        await self.subscribe(communicator, channel)
+
+        layer = get_channel_layer()
+        await layer.group_send(
+            f"community_{community_id}",
+            {"type": "chat_message", "community_id": community_id, "frame": json.dumps({"type": "chat_message"})},
+        )
+        await layer.group_send(
+            member_group_name(community_id, self.user.id),
+            {"type": "membership_update", "community_id": community_id, "membership": None},
+        )
+
+        self.assertEqual(await communicator.receive_json_from(), {"channel": channel, "event": {"type": "chat_message"}})
+        self.assertEqual(await communicator.receive_json_from(), {"channel": channel, "event": {"type": "membership_removed"}})
+        await communicator.send_json_to({"action": "message", "channel": channel, "message": "hi"})
+        self.assertEqual((await communicator.receive_json_from())["code"], "not_subscribed")
+        await communicator.disconnect()
+
+    async def test_chat_channel_accepts_user_turns(self):
+        user = self.user
+        conversation = await database_sync_to_async(Conversation.objects.create)(user=user)
+        communicator = await self.connect()
+        channel = f"chat:{conversation.id}"
+        await self.subscribe(communicator, channel)
+
+        with mock.patch.object(generate_ai_response, "delay") as delay:
+            await communicator.send_json_to({"action": "message", "channel": channel, "message": "hello"})
+            frame = await communicator.receive_json_from()
+
+        self.assertEqual(frame["event"]["type"], "new_message")
+        self.assertEqual(frame["event"]["message"]["text"], "hello")
+        delay.assert_called_once_with(str(conversation.id), "hello", user.id, True, None)
+        await communicator.disconnect()
+
+
+class SubscriptionQueueTests(SimpleTestCase):
+    @override_settings(STREAM_CHANNEL_QUEUE_SIZE=3)
+    async def test_overflow_replaces_backlog_with_resync(self):
+        sent, unblock = [], asyncio.Event()
+
+        async def send(text_data):
+            await unblock.wait()
+            sent.append(text_data)
+
+        consumer = mock.Mock(send=send, user=mock.Mock(id=1))
+        subscription = Subscription(consumer, "community:x", "community", "x", [])
+        subscription.release(["first"])
+        await asyncio.sleep(0)
+        for frame in ["a", "b", "c", "d"]:
+            subscription.put(frame)
+        unblock.set()
+        await asyncio.sleep(0.01)
+        subscription.close()
+
+        self.assertEqual(sent, ["first", wrap("community:x", json.dumps({"type": "resync_required"}))])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class MessageBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        patcher = mock.patch.object(buffer, "get_redis_connection", lambda alias: self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = get_user_model().objects.create_user(username="writer", password="x" * 12)
+        self.community = Community.objects.create(name="Room")
+
+    def message(self, text, client_id=None):
+        return CommunityMessage(community=self.community, sender=self.user, text=text, client_id=client_id)
+
+    @database_sync_to_async
+    def stored(self):
+        return sorted(CommunityMessage.objects.filter(community=self.community).values_list("text", flat=True))
+
+    def stashed(self):
+        return self.redis.lrange(buffer._unsaved_key(), 0, -1)
+
+    async def flush(self, message_buffer):
+        try:
+            await message_buffer.flush()
+        finally:
+            for task in list(message_buffer._tasks):
+                task.cancel()
+
+    async def test_flush_drops_duplicate_client_ids(self):
+        await database_sync_to_async(self.message("stored", client_id="a").save)()
+        message_buffer = MessageBuffer(interval=60, max_size=100)
+        for msg in [self.message("resend", "a"), self.message("new", "b"), self.message("repeat", "b"), self.message("plain")]:
+            message_buffer.add(msg)
+        await self.flush(message_buffer)
+        self.assertEqual(await self.stored(), ["new", "plain", "stored"])
+
+    async def test_repeated_db_failure_stashes_batch(self):
+        message_buffer = MessageBuffer(interval=60, max_size=100)
+        msg = self.message("hello")
+        message_buffer.add(msg)
+        with mock.patch.object(CommunityService, "persist_messages", side_effect=DatabaseError("down")):
+            for attempt in range(1, MAX_FLUSH_ATTEMPTS + 1):
+                await self.flush(message_buffer)
+                self.assertEqual(len(message_buffer._pending), 0 if attempt == MAX_FLUSH_ATTEMPTS else 1)
+                self.assertEqual(len(self.stashed()), 1 if attempt == MAX_FLUSH_ATTEMPTS else 0)
+        self.assertEqual(await self.stored(), [])
+        self.assertEqual(CommunityService.decode_message(self.stashed()[0]).id, msg.id)
+
+    def test_replay_unsaved_persists_and_clears_stash(self):
+        stash([self.message("one"), self.message("two")])
+        self.assertEqual(replay_unsaved(10), 2)
+        self.assertEqual(self.stashed(), [])
+        self.assertEqual(
+            sorted(CommunityMessage.objects.filter(community=self.community).values_list("text", flat=True)),
+            ["one", "two"],
+        )
+        self.assertEqual(replay_unsaved(10), 0)
@@ -3,7 +3,6 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from rest_framework.pagination import PageNumberPagination
 from django.db import transaction
 from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404
@@ -17,11 +16,14 @@ from .serializers import (
 )
 from .services import CommunityService
 from .permissions import IsCommunityAdmin
+from Rai_Backend.pagination import KeysetPagination
+from Rai_Backend.presence import PresenceService, community_scope
+from Rai_Backend import replay
 
 logger = structlog.get_logger(__name__)
 
 
-class StandardPagination(PageNumberPagination):
+class StandardPagination(KeysetPagination):
     page_size = 30
     max_page_size = 100
 
@@ -124,7 +126,7 @@ class CommunityViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         community = get_object_or_404(Community, pk=pk)
-        if not Membership.objects.filter(community=community, user=request.user).exists():
+        if not CommunityService.get_membership_state(community.id, request.user.id):
             return Response({"detail": "Not a member"}, status=status.HTTP_403_FORBIDDEN)
 
         msgs = CommunityMessage.objects.filter(community=community).select_related('sender').order_by('-created_at')
@@ -132,6 +134,19 @@ class CommunityViewSet(viewsets.ModelViewSet):
         serializer = CommunityMessageSerializer(page, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def online(self, request, pk=None):
+        community = get_object_or_404(Community, pk=pk)
+        if not CommunityService.get_membership_state(community.id, request.user.id):
+            return Response({"detail": "Not a member"}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            user_ids = PresenceService.online_user_ids(community_scope(community.id))
+        except Exception as e:
+            logger.warning("community_presence_lookup_failed", community_id=str(community.id), error=str(e))
+            return Response({"detail": "Presence is unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"count": len(user_ids), "user_ids": user_ids})
+
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         try:
@@ -243,7 +258,7 @@ class CommunityViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], url_path='upload-media')
     def upload_media(self, request, pk=None):
         community = get_object_or_404(Community, pk=pk)
-        if not Membership.objects.filter(community=community, user=request.user).exists():
+        if not CommunityService.get_membership_state(community.id, request.user.id):
             return Response({"detail": "Not a member"}, status=status.HTTP_403_FORBIDDEN)
 
         image = request.FILES.get('image')
@@ -256,28 +271,15 @@ class CommunityViewSet(viewsets.ModelViewSet):
         image_url = request.build_absolute_uri(msg.image.url) if msg.image else None
         audio_url = request.build_absolute_uri(msg.audio.url) if msg.audio else None
 
-        profile_pic_url = None
-        if request.user.profile_picture:
-            profile_pic_url = request.build_absolute_uri(request.user.profile_picture.url)
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"community_{community.id}",
-            {
-                'type': 'chat_message',
-                'id': str(msg.id),
-                'message': "",
-                'image': image_url,
-                'audio': audio_url,
-                'sender': {
-                    'id': request.user.id,
-                    'username': request.user.username,
-                    'first_name': request.user.first_name,
-                    'last_name': request.user.last_name,
-                    'profile_picture': profile_pic_url
-                },
-                'created_at': str(msg.created_at)
-            }
+        frame = CommunityService.message_frame(
+            msg,
+            CommunityService.sender_profile(request.user.id, request.build_absolute_uri('/')[:-1]),
+            image=image_url,
+            audio=audio_url,
+        )
+        _, frame = replay.sequence(f"community:{community.id}", frame)
+        async_to_sync(get_channel_layer().group_send)(
+            f"community_{community.id}", {'type': 'chat_message', 'community_id': str(community.id), 'frame': frame}
         )
 
         return Response({
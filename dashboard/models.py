@@ -1,6 +1,6 @@
 from django.db import models
-from django.core.cache import cache
 import uuid
+from Rai_Backend.cache import CacheInvalidatingQuerySet, register
 
 
 class AppPage(models.Model):
@@ -17,15 +17,10 @@ class AppPage(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete('all_app_pages')
-        cache.delete(f'app_page_{self.slug}')
-
-    def delete(self, *args, **kwargs):
-        cache.delete('all_app_pages')
-        cache.delete(f'app_page_{self.slug}')
-        super().delete(*args, **kwargs)
+    objects = CacheInvalidatingQuerySet.as_manager()
 
     def __str__(self):
-        return self.get_slug_display()
\ No newline at end of file
+        return self.get_slug_display()
+
+
+register(AppPage, 'all_app_pages', 'app_page_{slug}')
\ No newline at end of file
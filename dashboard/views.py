@@ -5,7 +5,7 @@ from rest_framework.permissions import IsAdminUser
 from django.db.models import Count, Q
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from rest_framework.pagination import PageNumberPagination
+from Rai_Backend.pagination import KeysetPagination
 
 from community.models import Community
 from support.models import SupportTicket
@@ -21,7 +21,7 @@ from Rai_Backend.utils import api_response
 User = get_user_model()
 
 
-class DashboardPagination(PageNumberPagination):
+class DashboardPagination(KeysetPagination):
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 100
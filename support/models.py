@@ -1,7 +1,7 @@
 from django.db import models
 from django.conf import settings
-from django.core.cache import cache
 import uuid
+from Rai_Backend.cache import CacheInvalidatingQuerySet, register
 
 
 class SupportTicket(models.Model):
@@ -22,6 +22,8 @@ class SupportTicket(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     replied_at = models.DateTimeField(null=True, blank=True)
 
+    objects = CacheInvalidatingQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
@@ -29,15 +31,8 @@ class SupportTicket(models.Model):
             models.Index(fields=['status', '-created_at']),
         ]
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        cache.delete(f'user_tickets_{self.user_id}')
-        cache.delete('all_support_tickets')
+    def __str__(self):
+        return f"{self.user.username} - {self.subject} ({self.status})"
 
-    def delete(self, *args, **kwargs):
-        cache.delete(f'user_tickets_{self.user_id}')
-        cache.delete('all_support_tickets')
-        super().delete(*args, **kwargs)
 
-    def __str__(self):
-        return f"{self.user.username} - {self.subject} ({self.status})"
\ No newline at end of file
+register(SupportTicket, 'user_tickets_{user_id}', 'all_support_tickets')
\ No newline at end of file